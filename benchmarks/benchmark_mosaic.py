@@ -0,0 +1,155 @@
+#####################################################
+# Author: Bertrand Delvaux (2023)                   #
+#                                                   #
+# Benchmark of the max-mosaic of depth maps against #
+# the previous full-canvas merge_tifs               #
+#                                                   #
+#####################################################
+
+import os
+import time
+import shutil
+import tempfile
+import argparse
+import tracemalloc
+
+import numpy as np
+import rasterio
+
+from rasterio.transform import from_origin
+
+from utils.mosaic import mosaic_max_tifs
+from utils.tif import reproject_tif_resolution
+
+
+def write_synthetic_tif(tif_file: str, width: int, height: int, res: float, left: float, top: float, seed: int) -> None:
+    """
+    Write a synthetic depth map in EPSG:3857, flooded along a few random patches
+    :param tif_file:
+    :param width:
+    :param height:
+    :param res:
+    :param left:
+    :param top:
+    :param seed:
+    :return:
+    """
+
+    rng = np.random.default_rng(seed)
+    array = np.zeros((height, width), dtype=np.uint8)
+    for _ in range(20):
+        row, col = rng.integers(0, height), rng.integers(0, width)
+        size = rng.integers(10, max(11, min(width, height) // 4))
+        array[row:row + size, col:col + size] = rng.integers(1, 212)
+
+    with rasterio.open(tif_file, 'w', driver='GTiff', width=width, height=height, count=1, dtype='uint8', nodata=0,
+                       crs='EPSG:3857', transform=from_origin(left, top, res, res), compress='lzw', tiled=True) as dst:
+        dst.write(array, 1)
+
+
+def merge_tifs_full_canvas(tifs_list: list[str], output_file: str) -> tuple:
+    """
+    Previous implementation of utils.tif.merge_tifs, kept as the reference of the mosaic: the files at a coarser
+    resolution are resampled in place to the finest one (see utils.tif.reproject_tif_resolution), then every file is
+    placed on a full-canvas array of the output grid and the maximum is taken
+    :param tifs_list: modified in place
+    :param output_file:
+    :return: bounds of the output
+    """
+
+    # Find the highest resolution
+    res, dtype = None, None
+    for tif in tifs_list:
+        with rasterio.open(tif) as src:
+            res = src.res if res is None else tuple(min(r, s) for r, s in zip(res, src.res))
+            dtype = dtype or src.dtypes[0]
+
+    for tif in tifs_list:
+        with rasterio.open(tif) as src:
+            resample = any(r > s for r, s in zip(src.res, res))
+        if resample:
+            reproject_tif_resolution(tif, target_resolution=res)
+
+    # Get spatial extent of all GeoTiffs
+    bounds = (float('inf'), float('inf'), float('-inf'), float('-inf'))
+    for tif in tifs_list:
+        with rasterio.open(tif) as src:
+            bounds = (
+                min(bounds[0], src.bounds[0]),
+                min(bounds[1], src.bounds[1]),
+                max(bounds[2], src.bounds[2]),
+                max(bounds[3], src.bounds[3]),
+            )
+
+    dst_shape = (int(np.round((bounds[3] - bounds[1]) / res[1])), int(np.round((bounds[2] - bounds[0]) / res[0])))
+    array_max = np.zeros(dst_shape, dtype=dtype)
+
+    for tif in tifs_list:
+        with rasterio.open(tif) as src:
+            row_off = int(np.round((bounds[3] - src.bounds.top) / res[1]))
+            col_off = int(np.round((src.bounds.left - bounds[0]) / res[0]))
+            block = np.s_[row_off:row_off + src.height, col_off:col_off + src.width]
+            array_max[block] = np.maximum(array_max[block], src.read(1))
+
+    with rasterio.open(output_file, 'w', driver='GTiff', dtype=dtype, nodata=0, width=dst_shape[1], height=dst_shape[0],
+                       count=1, crs='EPSG:3857', transform=rasterio.transform.from_bounds(*bounds, dst_shape[1], dst_shape[0]),
+                       compress='lzw', tiled=True) as dst:
+        dst.write(array_max, 1)
+
+    return bounds
+
+
+def measure(func, *args, **kwargs) -> tuple:
+    """
+    Run a function and measure its wall time and peak memory (numpy allocations included)
+    :param func:
+    :return: result, seconds, peak MB
+    """
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, seconds, peak / 1024 ** 2
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the max-mosaic of depth maps')
+    parser.add_argument('-n', '--n_files', help='Number of depth maps', type=int, default=8)
+    parser.add_argument('-s', '--size', help='Width and height of the depth maps, in pixels', type=int, default=4000)
+    parser.add_argument('-ts', '--tile_size', help='Tile size of the mosaic', type=int, default=1024)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        # depth maps with shifted extents, one in two at half the resolution
+        tifs_list = []
+        for i in range(args.n_files):
+            tif_file = os.path.join(folder, f'depth_{i}.tif')
+            coarse = i % 2 == 1
+            size = args.size // 2 if coarse else args.size
+            write_synthetic_tif(tif_file, width=size, height=size, res=200.0 if coarse else 100.0,
+                                left=i * 10_000.0, top=1_000_000.0 - i * 5_000.0, seed=i)
+            tifs_list.append(tif_file)
+
+        print(f'{args.n_files} depth maps of up to {args.size}x{args.size} px, differing resolutions and extents')
+
+        output_file = os.path.join(folder, 'mosaic.tif')
+        bounds, seconds, peak = measure(mosaic_max_tifs, tifs_list, output_file, tile_size=args.tile_size)
+        print(f'\tTiled mosaic:         {seconds:.2f} s, peak {peak:.0f} MB')
+
+        # the previous merge_tifs resamples the coarse files in place
+        reference_folder = os.path.join(folder, 'reference')
+        os.makedirs(reference_folder)
+        reference_files = [shutil.copy(tif, reference_folder) for tif in tifs_list]
+        reference_file = os.path.join(folder, 'reference.tif')
+        reference_bounds, seconds_ref, peak_ref = measure(merge_tifs_full_canvas, reference_files, reference_file)
+        print(f'\tPrevious merge_tifs:  {seconds_ref:.2f} s, peak {peak_ref:.0f} MB')
+
+        with rasterio.open(output_file) as src, rasterio.open(reference_file) as ref:
+            assert np.allclose(bounds, reference_bounds) and src.shape == ref.shape, 'Different output grids'
+            different = np.mean(src.read(1) != ref.read(1))
+        # the previous merge_tifs resampled the coarse files bilinearly, the edges of their flooded areas differ
+        print(f'\tSame grid, {different:.2%} of the pixels differ (edges of the coarse depth maps, see tests/test_mosaic.py)')
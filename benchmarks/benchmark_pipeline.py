@@ -0,0 +1,321 @@
+#####################################################
+# Author: Bertrand Delvaux (2023)                   #
+#                                                   #
+# End-to-end benchmark of the pipeline stages on    #
+# synthetic ensembles and impact csv files          #
+#                                                   #
+#####################################################
+
+import os
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import statistics
+
+import numpy as np
+import rasterio
+import geopandas as gpd
+
+from rasterio.transform import from_origin
+
+# the sftp credentials are read when utils.sftp is imported, the benchmark does not connect to the server
+os.environ.setdefault('JBA_USERNAME', 'benchmark')
+os.environ.setdefault('JBA_PASSWORD', 'benchmark')
+
+import scripts.pipeline as pipeline
+
+from benchmarks.benchmark_mosaic import measure
+from utils.tif import tifs_2_tif_depth, tif_2_array, merge_tifs
+from utils.stats import array_2_stats
+from utils.csv2geojson import csv2geojson
+from utils.logger import configure_logging
+
+from constants.constants import DATA_FOLDER, RASTER_FOLDER, BUFFER_FOLDER, IMPACTS_FOLDER, COUNTRIES_FOLDER, TIF_RESOLUTION
+
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def correlated_field(rng: np.random.Generator, height: int, width: int, scale: int) -> np.ndarray:
+    """
+    Spatially correlated random field in [0, 1]: white noise on a coarse grid, smoothed and upsampled
+    :param rng:
+    :param height:
+    :param width:
+    :param scale: correlation length, in pixels
+    :return:
+    """
+
+    coarse = rng.random((height // scale + 3, width // scale + 3))
+
+    # 3x3 box smoothing of the coarse grid
+    padded = np.pad(coarse, 1, mode='edge')
+    smooth = sum(padded[i:i + coarse.shape[0], j:j + coarse.shape[1]] for i in range(3) for j in range(3)) / 9
+
+    # bilinear upsampling to the full grid
+    rows = np.arange(height) / scale
+    cols = np.arange(width) / scale
+    r0, c0 = rows.astype(int), cols.astype(int)
+    fr, fc = (rows - r0)[:, None], (cols - c0)[None, :]
+    field = (smooth[r0][:, c0] * (1 - fr) * (1 - fc) + smooth[r0 + 1][:, c0] * fr * (1 - fc) +
+             smooth[r0][:, c0 + 1] * (1 - fr) * fc + smooth[r0 + 1][:, c0 + 1] * fr * fc)
+
+    return (field - field.min()) / (field.max() - field.min())
+
+
+def write_ensemble(folder: str, country: str, rd: str, fe: str, n_members: int, size: int, flooded: float, seed: int) -> list[str]:
+    """
+    Write the ensemble members of a forecast day, with JBA-style names: floods following a common correlated field,
+    and perturbed by each member, on a square area of the country at the resolution of the forecasts
+    :param folder:
+    :param country:
+    :param rd: run date (YYYYMMDD)
+    :param fe: forecast date (YYYYMMDD)
+    :param n_members:
+    :param size: width and height, in pixels
+    :param flooded: fraction of the area flooded
+    :param seed:
+    :return: file names
+    """
+
+    rng = np.random.default_rng(seed)
+    left, bottom, right, top = gpd.read_file(os.path.join(COUNTRIES_FOLDER, f'{country}_adm_shapefile.zip')).to_crs('EPSG:4326').total_bounds
+    transform = from_origin((left + right) / 2, (bottom + top) / 2, TIF_RESOLUTION, TIF_RESOLUTION)
+
+    base = correlated_field(rng, size, size, scale=max(size // 20, 1))
+
+    files = []
+    for member in range(n_members):
+        field = 0.8 * base + 0.2 * correlated_field(rng, size, size, scale=max(size // 40, 1))
+        threshold = np.quantile(field, 1 - flooded)
+        # depth band values (1 to 211) growing with the field above the threshold
+        array = np.where(field > threshold, 1 + (field - threshold) / (1 - threshold + 1e-9) * 60, 0).astype(np.uint8)
+
+        file = f'for_{country}_ts_rd{rd}T0000Z_fe{fe}T0000Z_ens{member:02d}.tif'
+        with rasterio.open(os.path.join(folder, file), 'w', driver='GTiff', width=size, height=size, count=1, dtype='uint8',
+                           crs='EPSG:4326', transform=transform, nodata=0, compress='lzw', tiled=True) as dst:
+            dst.write(array, 1)
+        files.append(file)
+
+    return files
+
+
+def write_impacts(folder: str, country: str, rd: str, impact: str, seed: int) -> str:
+    """
+    Write an impact csv file with JBA's layout (a row of units below the header) for the ADM2 units of the country
+    :param folder:
+    :param country:
+    :param rd: run date (YYYYMMDD)
+    :param impact: 'population' or 'economic'
+    :param seed:
+    :return: file name
+    """
+
+    rng = np.random.default_rng(seed)
+    admin_codes = gpd.read_file(os.path.join(COUNTRIES_FOLDER, f'{country}_adm_shapefile.zip'))['ADM2_CODE'].astype(int)
+
+    rows = ['admin_code,band_1,band_5,band_11', 'code,people,people,people' if impact == 'population' else 'code,usd,usd,usd']
+    for admin_code in admin_codes:
+        # a few ensemble members per unit, fewer people affected by deeper floods
+        for _ in range(3):
+            band_1 = int(rng.lognormal(7, 1.5))
+            band_5 = int(band_1 * rng.uniform(0.2, 0.6))
+            band_11 = int(band_5 * rng.uniform(0.1, 0.5))
+            rows.append(f'{admin_code},{band_1},{band_5},{band_11}')
+
+    file = f'for_{country}_ts_rd{rd}T0000Z_{impact}_impacts.csv'
+    with open(os.path.join(folder, file), 'w') as f:
+        f.write('\n'.join(rows))
+
+    return file
+
+
+def create_workdir(workdir: str) -> None:
+    """
+    Create a working directory with the folders the pipeline reads from the repository (shapefiles, constants)
+    :param workdir:
+    :return:
+    """
+    os.makedirs(workdir, exist_ok=True)
+    for folder in [COUNTRIES_FOLDER, 'constants']:
+        os.symlink(os.path.join(REPO_FOLDER, folder), os.path.join(workdir, folder))
+
+
+def local_download(remote_folder: str, country: str, rd: str, files: list[str]) -> None:
+    """
+    Local stand-in for the sftp download (see utils.sftp): copy the files of a run date to the buffer and impacts
+    folders of the country
+    :param remote_folder:
+    :param country:
+    :param rd:
+    :param files:
+    :return:
+    """
+    for file in files:
+        sub_folder = os.path.join(RASTER_FOLDER, BUFFER_FOLDER) if file.endswith('.tif') else IMPACTS_FOLDER
+        destination = os.path.join(DATA_FOLDER, country, sub_folder)
+        os.makedirs(destination, exist_ok=True)
+        shutil.copy(os.path.join(remote_folder, country, rd, file), os.path.join(destination, file))
+
+
+def local_upload(path_file: str, **kwargs) -> bool:
+    """
+    Local stand-in for the geoserver upload (see geoserver.interface): copy the file to a local folder
+    :param path_file:
+    :return:
+    """
+    os.makedirs('geoserver', exist_ok=True)
+    shutil.copy(path_file, os.path.join('geoserver', os.path.basename(path_file)))
+    return True
+
+
+def run_stage(results: dict, name: str, repeats: int, setup, func) -> None:
+    """
+    Time a stage several times (setup is not timed), keeping the wall times and the peak memory of each run
+    :param results:
+    :param name:
+    :param repeats:
+    :param setup: function called before each run, returning the arguments of func
+    :param func:
+    :return:
+    """
+
+    seconds, peaks = [], []
+    for _ in range(repeats):
+        args = setup()
+        _, run_seconds, peak = measure(func, *args)
+        seconds.append(round(run_seconds, 4))
+        peaks.append(round(peak, 1))
+
+    results[name] = {
+        'seconds': seconds,
+        'median_seconds': round(statistics.median(seconds), 4),
+        'min_seconds': min(seconds),
+        'peak_mb': max(peaks),
+    }
+    print(f'\t{name}: {results[name]["median_seconds"]:.3f} s (median of {repeats}), peak {results[name]["peak_mb"]:.0f} MB')
+
+
+def run_benchmark(country: str, n_members: int, size: int, flooded: float, repeats: int, workdir: str) -> dict:
+    """
+    Benchmark the stages of the pipeline, then a full process_pipeline day, in a working directory
+    :param country:
+    :param n_members:
+    :param size:
+    :param flooded:
+    :param repeats:
+    :param workdir:
+    :return: results
+    """
+
+    create_workdir(workdir)
+    os.chdir(workdir)
+
+    year, month, day = '2023', '01', '01'
+    rd = f'{year}{month}{day}'
+
+    # synthetic "remote" data: one ensemble and the impacts of the run date
+    remote_folder = os.path.join(workdir, 'remote')
+    os.makedirs(os.path.join(remote_folder, country, rd))
+    members = write_ensemble(os.path.join(remote_folder, country, rd), country, rd, rd, n_members, size, flooded, seed=0)
+    impacts = [write_impacts(os.path.join(remote_folder, country, rd), country, rd, impact, seed=i)
+               for i, impact in enumerate(['population', 'economic'])]
+
+    buffer_path = os.path.join(DATA_FOLDER, country, RASTER_FOLDER, BUFFER_FOLDER)
+    impacts_path = os.path.join(DATA_FOLDER, country, IMPACTS_FOLDER)
+
+    def download():
+        shutil.rmtree(DATA_FOLDER, ignore_errors=True)
+        return remote_folder, country, rd, members + impacts
+
+    results = {}
+    print(f'Benchmarking {country}: {n_members} members of {size}x{size} px, {flooded:.0%} flooded')
+
+    run_stage(results, 'download', repeats, download, local_download)
+
+    run_stage(results, 'tifs_2_tif_depth', repeats, lambda: (local_download(*download()) or (buffer_path, members)),
+              lambda folder_path, tifs_list: tifs_2_tif_depth(folder_path=folder_path, tifs_list=tifs_list, postfix='_3d_depth.tif'))
+
+    depth_file = os.path.join(buffer_path, members[0].split('ens')[0] + '_3d_depth.tif')
+    run_stage(results, 'tif_2_array', repeats, lambda: (depth_file,), tif_2_array)
+
+    array, meta = tif_2_array(depth_file)
+    run_stage(results, 'array_2_stats', repeats, lambda: (array[0], meta['transform'].a, meta['transform'].e), array_2_stats)
+
+    # max depth map of an event: the depth map merged with a copy shifted by a tenth of its size
+    def merge_setup():
+        shifted_file = os.path.join(workdir, 'shifted_depth.tif')
+        with rasterio.open(depth_file) as src:
+            profile = src.profile
+            profile['transform'] = src.transform * rasterio.Affine.translation(src.width // 10, src.height // 10)
+            with rasterio.open(shifted_file, 'w', **profile) as dst:
+                dst.write(src.read())
+        return [shifted_file, depth_file], os.path.join(workdir, 'max_depth.tif')
+
+    run_stage(results, 'merge_tifs', repeats, merge_setup, lambda tifs_list, output_file: merge_tifs(tifs_list=tifs_list, output_file=output_file))
+
+    shp_file = os.path.join(COUNTRIES_FOLDER, f'{country}_adm_shapefile.zip')
+    csv_file = os.path.join(impacts_path, impacts[0])
+    run_stage(results, 'csv2geojson', repeats, lambda: (csv_file, shp_file, csv_file.replace('.csv', '.geojson')), csv2geojson)
+
+    # full day, with the geoserver upload replaced by a local copy
+    pipeline.uploadToGeoserver = local_upload
+
+    def pipeline_setup():
+        local_download(*download())
+        shutil.rmtree('geoserver', ignore_errors=True)
+        return ()
+
+    def pipeline_day():
+        pipeline.process_pipeline(start_date=f'{year}_{month}_{day}', end_date=f'{year}_{month}_{day}', n_days=1,
+                                  list_countries=[country], geoserver=True, trigger_band_value=1)
+
+    run_stage(results, 'process_pipeline_day', repeats, pipeline_setup, pipeline_day)
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the stages of the pipeline on synthetic data')
+    parser.add_argument('-c', '--country', help='Country (its shapefile gives the admin codes and the area)', type=str, default='tgo')
+    parser.add_argument('-n', '--n_members', help='Number of ensemble members', type=int, default=8)
+    parser.add_argument('-s', '--size', help='Width and height of the members, in pixels', type=int, default=2000)
+    parser.add_argument('-f', '--flooded', help='Fraction of the area flooded', type=float, default=0.1)
+    parser.add_argument('-r', '--repeats', help='Number of runs of each stage', type=int, default=3)
+    parser.add_argument('-o', '--output', help='JSON file of the results (printed if not provided)', type=str, default=None)
+    args = parser.parse_args()
+
+    # the stages are measured without their progress messages (see utils.logger)
+    configure_logging(quiet=True)
+
+    output = os.path.abspath(args.output) if args.output else None
+    cwd = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            stages = run_benchmark(args.country, args.n_members, args.size, args.flooded, args.repeats, workdir)
+        finally:
+            os.chdir(cwd)
+
+    report = {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': vars(args),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'numpy': np.__version__,
+            'rasterio': rasterio.__version__,
+            'gdal': rasterio.__gdal_version__,
+        },
+        'stages': stages,
+    }
+
+    if output is None:
+        print(json.dumps(report, indent=4))
+    else:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f'Results written to {output}')
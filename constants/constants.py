@@ -61,3 +61,34 @@ TIF_RESOLUTION = 0.00027777777999999997
 
 # GeoServer constants
 GEOSERVER_WORKSPACE = 'flood_foresight'
+
+# Depth maps cache (content-addressed by the ensemble files)
+DEPTH_CACHE_FOLDER = 'cache/depth'
+DEPTH_CACHE_MAX_SIZE = 20 * 1024 ** 3  # 20 GB
+DEPTH_CACHE_VERSION = 3  # increment whenever the depth map algorithm changes, to invalidate the cache
+RASTER_CACHE_MAX_SIZE = 4 * 1024 ** 3  # 4 GB, decoded rasters kept during a run (see utils.memmap)
+
+# Daily agreement summary (per country, used to calibrate the event detection)
+DAILY_SUMMARY_FILE = 'daily_summary.csv'
+
+# Country grids (canonical EPSG:3857 grid of each country's depth maps)
+GRID_FILE = 'grid.json'
+GRID_TILE_SIZE = 1024
+
+# Zonal stats (admin units rasterized on the grid of the depth maps)
+ZONES_FOLDER = 'zones'
+
+# Placement of the files copied into the event folders: 'hardlink', 'reflink', 'symlink' or 'copy' (see utils.artifacts)
+ARTIFACT_PLACEMENT = 'hardlink'
+
+# Diagnostics of the runs (see utils.instrument)
+DIAGNOSTICS_FOLDER = 'diagnostics'
+INSTRUMENT_FOLDER = f'{DIAGNOSTICS_FOLDER}/instrument'
+
+# Logging (see utils.logger)
+LOGGER_NAME = 'pipeline'
+LOG_PROGRESS_INTERVAL = 5  # seconds between two progress messages of a loop
+
+# Profiles of the runs (see utils.profiler)
+PROFILE_FOLDER = f'{DIAGNOSTICS_FOLDER}/profile'
+PROFILE_SAMPLE_INTERVAL = 0.005  # seconds between two samples of the stack
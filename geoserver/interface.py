@@ -2,6 +2,12 @@ import os
 
 from constants.constants import GEOSERVER_WORKSPACE
 
+from utils.instrument import instrumented
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+@instrumented()
 def uploadToGeoserver(
         path_file: str,
         username: str,
@@ -37,7 +43,7 @@ def uploadToGeoserver(
         # CURL command
         curl_command = f'curl -v -s -u {passwordStr} -XPUT -H "Content-type: text/plain" -d "file://{path_file}" \'{url}\''
 
-        print(curl_command)
+        logger.debug(curl_command)
         os.system(curl_command)
 
         layername = coverage_name
@@ -55,10 +61,11 @@ def uploadToGeoserver(
         success = True
 
     except:
-        print(f'Error uploading {path_file} to Geoserver')
+        logger.error(f'Error uploading {path_file} to Geoserver')
 
     return success
 
+@instrumented()
 def deleteFromGeoserver(
         filename: str,
         username: str,
@@ -90,12 +97,12 @@ def deleteFromGeoserver(
         # CURL command
         curl_command = f'curl -v -s -u {passwordStr} -XDELETE \'{url}\''
 
-        print(curl_command)
+        logger.debug(curl_command)
         os.system(curl_command)
 
         success = True
 
     except:
-        print(f'Error removing {filename} from Geoserver')
+        logger.error(f'Error removing {filename} from Geoserver')
 
     return success
\ No newline at end of file
@@ -0,0 +1,30 @@
+#####################################################
+# Author: Bertrand Delvaux (2023)                   #
+#                                                   #
+# Script to report the disk usage of ARC's Flood    #
+# Explorer data tree                                #
+#                                                   #
+#####################################################
+
+import os
+import argparse
+
+from constants.constants import DATA_FOLDER, LIST_COUNTRIES
+
+from utils.artifacts import disk_usage_report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Report the disk usage of the data tree, counting the shared files only once')
+    parser.add_argument('-c', '--list_countries', help='List of countries', type=str, nargs='+', default=LIST_COUNTRIES)
+    args = parser.parse_args()
+
+    for country in args.list_countries:
+        root = os.path.join(DATA_FOLDER, country)
+        if not os.path.exists(root):
+            continue
+
+        report = disk_usage_report(root)
+        print(f'\033[1m{country}\033[0m: {report["n_files"]} files ({report["n_shared_files"]} shared), '
+              f'{report["apparent_size_gb"]} GB apparent, {report["disk_size_gb"]} GB on disk, '
+              f'\033[32m{report["saved_gb"]} GB saved\033[0m')
@@ -10,6 +10,9 @@ import shutil
 import datetime as dt
 import argparse
 
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 import numpy as np
 
@@ -22,17 +25,44 @@ from utils.files import createFolderIfNotExists, createDataTreeStructure
 from utils.date import increment_day
 from utils.json import createJSONifNotExists, jsonFileToDict
 from utils.event import initialize_event, set_ongoing_event, save_json_last_edit
-from utils.tif import tifs_2_tif_depth, tif_2_array, reproject_and_maximize_tifs, merge_tifs
+from utils.tif import tifs_2_tif_depth, tifs_2_tif_depths, threshold_agreement_tif, tif_2_array, merge_tifs
+from utils.grid import CountryGrid, get_country_grid
 from utils.stats import array_2_stats
+from utils.zonal import depth_2_zonal_stats
+from utils.memmap import raster_cache, copy_cached
+from utils.artifacts import place_file
+from utils.catalog import get_catalog
+from utils.instrument import instrumented, span, instrumentation
+from utils.logger import get_logger, configure_logging, log_context
+from utils.profiler import profiling, profile_day
 from utils.sftp import download_pipeline
 from utils.csv2geojson import csv2geojson
-from utils.string_format import colorize_text
 from utils.dataframe import sum_list_dict
 from utils.dataframe import find_maximum_values
 
-from constants.constants import AGREEMENT_THRESHOLD
+from stochastic.query import economic_return_periods, population_return_periods
+
+from constants.constants import AGREEMENT_THRESHOLD, DEPTH_CACHE_FOLDER, DAILY_SUMMARY_FILE, INSTRUMENT_FOLDER, \
+    PROFILE_FOLDER, PROFILE_SAMPLE_INTERVAL
+
+logger = get_logger(__name__)
 
 
+@contextmanager
+def day_diagnostics(country: str, date: str, stage: str = None):
+    """
+    Diagnostics of the processing of a country and day: instrumentation span (see utils.instrument), log context (see
+    utils.logger) and profile (see utils.profiler), each only if enabled
+    :param country:
+    :param date: day (YYYY_MM_DD)
+    :param stage: part of the processing of the day, if it is split (see process_pipeline_parallel)
+    :return:
+    """
+    with span('day', country=country, date=date, stage=stage), log_context(country=country, date=date), profile_day(country, date, stage=stage):
+        yield
+
+
+@instrumented()
 def clean_buffer_impacts(
         year: str,
         month: str,
@@ -53,50 +83,52 @@ def clean_buffer_impacts(
     :param n_days:
     :return:
     """
+    # get the latest date to keep
+    year_last, month_last, day_last = increment_day(year, month, day, -n_days)
+
+    catalog = get_catalog()
+
     # Remove past files which are not day 0, i.e. depth maps whose file name rdYYYYMMDD and feYYYYMMDD are different
     for country in list_countries:
 
         # clean buffer folder
         path = os.path.join(DATA_FOLDER, country, RASTER_FOLDER, BUFFER_FOLDER)
         if os.path.exists(path):
-            for file in os.listdir(path):
-                try:
-                    # extract the 8 characters of file name after 'rd' and after 'fe'
-                    rd = file.split('rd')[1][:8]
-                    fe = file.split('fe')[1][:8]
-
-                    # get the latest date to keep
-                    year_last, month_last, day_last = increment_day(year, month, day, -n_days)
-
-                    if fe > rd or rd < f'{year_last}{month_last}{day_last}':
-                        os.remove(os.path.join(path, file))
-                        if geoserver:
-                            #TODO: remove file from geoserver
-                            delete_success = deleteFromGeoserver(
-                                filename=os.path.join(path, file),
-                                username=username,
-                                password=password,
-                                server=server,
-                            )
-                            if delete_success:
-                                print(f'\t\t\tRemoved {file} from geoserver')
-                except IndexError:
-                    print(f'File {file} does not have the right format')
+            buffer_index = catalog.buffer(country)
+            for file in buffer_index.malformed():
+                logger.warning(f'File {file} does not have the right format')
+
+            for record in buffer_index.records():
+                if record.fe is None:
+                    logger.warning(f'File {record.file} does not have the right format')
+                    continue
+
+                if record.fe > record.rd or record.rd < f'{year_last}{month_last}{day_last}':
+                    buffer_index.remove(record.file)
+                    if geoserver:
+                        #TODO: remove file from geoserver
+                        delete_success = deleteFromGeoserver(
+                            filename=os.path.join(path, record.file),
+                            username=username,
+                            password=password,
+                            server=server,
+                        )
+                        if delete_success:
+                            logger.info(f'Removed {record.file} from geoserver', extra={'indent': 3})
 
         # clean impacts folder
         path = os.path.join(DATA_FOLDER, country, IMPACTS_FOLDER)
         if os.path.exists(path):
-            for file in os.listdir(path):
-                # extract the 8 characters of file name after 'rd'
-                rd = file.split('rd')[1][:8]
+            impacts_index = catalog.impacts(country)
+            for file in impacts_index.malformed():
+                logger.warning(f'File {file} does not have the right format')
 
-                # get the latest date to keep
-                year_last, month_last, day_last = increment_day(year, month, day, -n_days)
-
-                if rd < f'{year_last}{month_last}{day_last}':
-                    os.remove(os.path.join(path, file))
+            for record in impacts_index.records():
+                if record.rd < f'{year_last}{month_last}{day_last}':
+                    impacts_index.remove(record.file)
 
 
+@instrumented()
 def process_files_include_exclude(
         include_str_list: list[str],
         exclude_str_list: list[str],
@@ -109,7 +141,13 @@ def process_files_include_exclude(
         username: str = None,
         password: str = None,
         server: str = None,
-) -> tuple[bool, bool, tuple, int]:
+        cache_folder: str = None,
+        summary_file: str = None,
+        confidence_thresholds: list[float] = None,
+        agreement_band: bool = False,
+        grid: CountryGrid = None,
+        list_files: list[str] = None,
+) -> tuple[bool, bool, tuple, int, str]:
     """
     Process files in buffer folder
     :param include_str_list:
@@ -118,33 +156,75 @@ def process_files_include_exclude(
     :param postfix:
     :param n_bands:
     :param threshold:
+    :param cache_folder: folder of the depth maps cache (no cache if None)
+    :param summary_file: csv file to which the agreement summary is appended (no summary if None)
+    :param confidence_thresholds: additional agreement thresholds, each producing its own depth map (computed in the
+    same pass as the main one, or from its agreement band if agreement_band and they are all higher, e.g. suffixed
+    90pct_3d_depth.tif for 0.9)
+    :param agreement_band: add the agreement percentage as a second band of the depth maps
+    :param grid: if provided, grid of the depth maps (see utils.grid)
+    :param list_files: files of the buffer folder to process, if already selected (e.g. from utils.catalog), instead of
+    matching the file names against include_str_list and exclude_str_list
     :return:
     """
 
     # get list of files
-    list_files = [tif for tif in os.listdir(buffer_path) if
-                  all(include_str in tif for include_str in include_str_list) and include_str_list and not any(
-                      exclude_str in tif for exclude_str in exclude_str_list)]
+    if list_files is None:
+        list_files = [tif for tif in get_catalog().index(buffer_path).names() if
+                      all(include_str in tif for include_str in include_str_list) and include_str_list and not any(
+                          exclude_str in tif for exclude_str in exclude_str_list)]
 
     # check if list is empty
     if len(list_files) == 0:
         raise ValueError(f'No files found in buffer folder containing {", ".join(include_str_list)}')
 
     # process depth map
-    raster_depth_file, empty, bbox, max_band_value = tifs_2_tif_depth(
-        folder_path=buffer_path,
-        tifs_list=list_files,
-        postfix=postfix,
-        n_bands=n_bands,
-        threshold=threshold,
-        to_epsg_3857=to_epsg_3857,
-    )
+    confidence_depth_files = []
+    if not confidence_thresholds or (agreement_band and min(confidence_thresholds) >= threshold):
+        raster_depth_file, empty, bbox, max_band_value = tifs_2_tif_depth(
+            folder_path=buffer_path,
+            tifs_list=list_files,
+            postfix=postfix,
+            n_bands=n_bands,
+            threshold=threshold,
+            to_epsg_3857=to_epsg_3857,
+            cache_folder=cache_folder,
+            summary_file=summary_file,
+            agreement_band=agreement_band,
+            grid=grid,
+        )
+
+        # the higher thresholds are applied to the agreement percentage band of the depth map, which can come from the
+        # cache (see utils.tif.threshold_agreement_tif)
+        for confidence_threshold in confidence_thresholds or []:
+            if confidence_threshold != threshold:
+                confidence_depth_file = f'{raster_depth_file[:-len(postfix)]}{int(round(confidence_threshold * 100))}pct{postfix}'
+                threshold_agreement_tif(raster_depth_file, confidence_depth_file, threshold=confidence_threshold)
+                confidence_depth_files.append(confidence_depth_file)
+    else:
+        # all the thresholds in one pass over the ensemble (the cache only holds single threshold depth maps)
+        postfixes = {confidence_threshold: f'{int(round(confidence_threshold * 100))}pct{postfix}'
+                     for confidence_threshold in confidence_thresholds if confidence_threshold != threshold}
+        postfixes[threshold] = postfix
+        depths = tifs_2_tif_depths(
+            folder_path=buffer_path,
+            tifs_list=list_files,
+            postfixes=postfixes,
+            n_bands=n_bands,
+            to_epsg_3857=to_epsg_3857,
+            summary_file=summary_file,
+            agreement_band=agreement_band,
+            grid=grid,
+        )
+        raster_depth_file, empty, bbox, max_band_value = depths.pop(threshold)
+        confidence_depth_files = [depth[0] for depth in depths.values()]
 
     success = True
 
     # remove files from temp folder
+    buffer_index = get_catalog().index(buffer_path)
     for file in list_files:
-        os.remove(os.path.join(buffer_path, file))
+        buffer_index.remove(file)
 
     # upload to geoserver
     upload_success = False
@@ -155,10 +235,735 @@ def process_files_include_exclude(
             password=password,
             server=server
         )
+        for confidence_depth_file in confidence_depth_files:
+            uploadToGeoserver(
+                path_file=confidence_depth_file,
+                username=username,
+                password=password,
+                server=server
+            )
+
+    for confidence_depth_file in confidence_depth_files:
+        logger.info(f'Created confidence depth map: {confidence_depth_file}', extra={'indent': 3, 'color': 'green'})
+
+    logger.info(f'Created depth map{" (uploaded to geoserver)" if geoserver and upload_success else ""}: {raster_depth_file}',
+                extra={'indent': 3, 'color': 'green'})
+
+    return success, empty, bbox, max_band_value, raster_depth_file
+
+
+@instrumented()
+def process_impacts(
+        country: str,
+        year: str,
+        month: str,
+        day: str,
+        to_epsg_3857: bool = True,
+) -> dict:
+    """
+    Convert the impact csv files of a given day into geojson files and adm breakdowns
+    :param country:
+    :param year:
+    :param month:
+    :param day:
+    :param to_epsg_3857:
+    :return:
+    """
+
+    folder_path = os.path.join(DATA_FOLDER, country, IMPACTS_FOLDER)
+    csv_files = [os.path.join(folder_path, f) for f in get_catalog().impacts(country).files(f'{year}{month}{day}', extensions=('.csv',))
+                 if not f.endswith('_processed.csv')]
+
+    impacts = {
+        'population': None,
+        'economic': None,
+        'economic_data_available': False,
+    }
+
+    for csv_file in csv_files:
+        if 'population' in csv_file:
+            impacts['population'] = csv2geojson(
+                csv_file=csv_file,
+                shp_file=os.path.join(COUNTRIES_FOLDER, f'{country}_adm_shapefile.zip'),
+                output_file=csv_file.replace('.csv', '.geojson'),
+                to_epsg_3857=to_epsg_3857,
+            )
+        elif 'economic' in csv_file:
+            impacts['economic'] = csv2geojson(
+                csv_file=csv_file,
+                shp_file=os.path.join(COUNTRIES_FOLDER, f'{country}_adm_shapefile.zip'),
+                output_file=csv_file.replace('.csv', '.geojson'),
+                to_epsg_3857=to_epsg_3857,
+            )
+            impacts['economic_data_available'] = True
+        else:
+            raise ValueError('Unknown impact type')
+        logger.info(f'Processed {csv_file} ✔', extra={'indent': 2})
+
+    return impacts
+
+
+@instrumented()
+def process_rasters(
+        country: str,
+        year: str,
+        month: str,
+        day: str,
+        n_days: int = N_DAYS,
+        n_days_since_last_threshold: int = N_DAYS_SINCE_LAST_THRESHOLD,
+        threshold: float = AGREEMENT_THRESHOLD,
+        to_epsg_3857: bool = True,
+        geoserver: bool = False,
+        username: str = None,
+        password: str = None,
+        server: str = None,
+        cache_folder: str = None,
+        summary: bool = False,
+        confidence_thresholds: list[float] = None,
+        agreement_band: bool = False,
+        country_grid: bool = False,
+) -> list[dict]:
+    """
+    Create the depth maps of all the forecast days of a given run date
+    :param country:
+    :param year:
+    :param month:
+    :param day:
+    :param n_days:
+    :param n_days_since_last_threshold:
+    :param threshold:
+    :param to_epsg_3857:
+    :param cache_folder:
+    :param summary: append the agreement summaries to the country's daily summary file
+    :param confidence_thresholds: additional agreement thresholds (see process_files_include_exclude)
+    :param agreement_band: add the agreement percentage as a second band of the depth maps
+    :param country_grid: write the depth maps on the grid of the country (see utils.grid)
+    :return:
+    """
+
+    tmp_path = os.path.join(DATA_FOLDER, country, RASTER_FOLDER, BUFFER_FOLDER)
+    createFolderIfNotExists(tmp_path)
+
+    # grid of the country, None if it cannot be computed (e.g. missing shapefile)
+    grid = None
+    if country_grid:
+        try:
+            grid = get_country_grid(country)
+        except Exception as e:
+            logger.warning(f'Could not get the grid of {country}, using the extent of the depth maps: {e}', extra={'indent': 2})
+
+    rasters = []
+
+    for i_day in range(0, n_days):
+        year_n, month_n, day_n = increment_day(year, month, day, i_day)
+
+        # print day
+        logger.info(f'Processing day {i_day} : ({year_n}-{month_n}-{day_n}) ... ', extra={'indent': 2})
+
+        # create depth map
+        success, empty, bbox, max_band_value, depth_file = process_files_include_exclude(
+            include_str_list=[f'fe{year_n}{month_n}{day_n}', f'rd{year}{month}{day}'],
+            exclude_str_list=['Agreement', '_depth'],
+            buffer_path=tmp_path,
+            list_files=get_catalog().members(country, f'{year}{month}{day}', f'{year_n}{month_n}{day_n}'),
+            postfix=f'_{n_days_since_last_threshold}d_depth.tif',
+            n_bands=211,
+            threshold=threshold,
+            to_epsg_3857=to_epsg_3857,
+            geoserver=geoserver,
+            username=username,
+            password=password,
+            server=server,
+            cache_folder=cache_folder,
+            summary_file=os.path.join(DATA_FOLDER, country, DAILY_SUMMARY_FILE) if summary else None,
+            confidence_thresholds=confidence_thresholds,
+            agreement_band=agreement_band,
+            grid=grid,
+        )
+
+        if not success:
+            logger.error(f'Could not create depth map for day {i_day}', extra={'indent': 2})
+
+        rasters.append({
+            'i_day': i_day,
+            'date': (year_n, month_n, day_n),
+            'success': success,
+            'empty': empty,
+            'bbox': bbox,
+            'max_band_value': max_band_value,
+            'depth_file': depth_file,
+            'grid': grid,
+        })
+
+    return rasters
+
+
+@instrumented()
+def process_day_products(
+        country: str,
+        year: str,
+        month: str,
+        day: str,
+        n_days: int = N_DAYS,
+        n_days_since_last_threshold: int = N_DAYS_SINCE_LAST_THRESHOLD,
+        to_epsg_3857: bool = True,
+        threshold: float = AGREEMENT_THRESHOLD,
+        geoserver: bool = False,
+        username: str = None,
+        password: str = None,
+        server: str = None,
+        trigger_band_value: int = TRIGGER_BAND_VALUE,
+        compute_stats: bool = False,
+        cache_folder: str = None,
+        summary: bool = False,
+        confidence_thresholds: list[float] = None,
+        agreement_band: bool = False,
+        country_grid: bool = False,
+        zonal_stats: bool = False,
+) -> dict:
+    """
+    Compute the products of a given run date (impact breakdowns, depth maps and, optionally, the stats of the day 0
+    depth map). These products do not depend on the state of the events, so that different days can be processed
+    independently.
+    :param country:
+    :param year:
+    :param month:
+    :param day:
+    :param n_days:
+    :param n_days_since_last_threshold:
+    :param to_epsg_3857:
+    :param threshold:
+    :param trigger_band_value:
+    :param compute_stats: compute the stats (and zonal stats if required) of the day 0 depth map if it is above the
+    trigger band value
+    :param cache_folder: folder of the depth maps cache (no cache if None)
+    :param summary: append the agreement summaries to the country's daily summary file
+    :param confidence_thresholds: additional agreement thresholds (see process_files_include_exclude)
+    :param agreement_band: add the agreement percentage as a second band of the depth maps
+    :param country_grid: write the depth maps on the grid of the country (see utils.grid)
+    :param zonal_stats: add the flood stats of each admin unit to the day stats (see utils.zonal), implies country_grid
+    :return:
+    """
+
+    products = {
+        'impacts': None,
+        'rasters': None,
+        'stats': None,
+        'zonal_stats': None,
+    }
+
+    # loop over sub-folders (impacts, raster, etc.)
+    for sub_folder in LIST_SUBFOLDERS_BUFFER:
+        logger.info(f'Processing {sub_folder} data...', extra={'indent': 1})
+
+        if sub_folder == IMPACTS_FOLDER:
+            products['impacts'] = process_impacts(
+                country=country,
+                year=year,
+                month=month,
+                day=day,
+                to_epsg_3857=to_epsg_3857,
+            )
+
+        elif sub_folder == RASTER_FOLDER:
+            products['rasters'] = process_rasters(
+                country=country,
+                year=year,
+                month=month,
+                day=day,
+                n_days=n_days,
+                n_days_since_last_threshold=n_days_since_last_threshold,
+                threshold=threshold,
+                to_epsg_3857=to_epsg_3857,
+                geoserver=geoserver,
+                username=username,
+                password=password,
+                server=server,
+                cache_folder=cache_folder,
+                summary=summary,
+                confidence_thresholds=confidence_thresholds,
+                agreement_band=agreement_band,
+                # the admin units are rasterized once on the grid of the country (see utils.zonal)
+                country_grid=country_grid or zonal_stats,
+            )
+
+    raster = products['rasters'][0]
+    if compute_stats and raster['max_band_value'] >= trigger_band_value:
+        with span('stats'):
+            array, meta = tif_2_array(raster['depth_file'])
+            products['stats'] = array_2_stats(
+                array=array[0],  # depth band only (the agreement percentage may be the second band)
+                pixel_size_x_m=meta['transform'].a,
+                pixel_size_y_m=meta['transform'].e
+            )
+            if zonal_stats:
+                products['zonal_stats'] = depth_2_zonal_stats(country, array[0], meta)
+
+    return products
+
+
+def process_day_products_or_none(**kwargs) -> dict | None:
+    """
+    Compute the products of a given run date, return None if there are no files for that date
+    :param kwargs: see process_day_products
+    :return:
+    """
+    try:
+        with day_diagnostics(kwargs['country'], f'{kwargs["year"]}_{kwargs["month"]}_{kwargs["day"]}', stage='products'):
+            return process_day_products(**kwargs)
+    except ValueError as e:
+        logger.warning(str(e))
+        return None
+
+
+@instrumented()
+def update_event_state(
+        country: str,
+        year: str,
+        month: str,
+        day: str,
+        products: dict,
+        n_days_since_last_threshold: int = N_DAYS_SINCE_LAST_THRESHOLD,
+        trigger_band_value: int = TRIGGER_BAND_VALUE,
+        zonal_stats: bool = False,
+        impact_return_periods: bool = False,
+        economic_return_period: bool = False,
+) -> None:
+    """
+    Update the country, year and event jsons with the products of a given run date (event state machine). Days must be
+    fed in chronological order, as opening and closing events depend on the state left by the previous day.
+    :param country:
+    :param year:
+    :param month:
+    :param day:
+    :param products: output of process_day_products
+    :param n_days_since_last_threshold:
+    :param trigger_band_value:
+    :param zonal_stats: add the flood stats of each admin unit to the day stats (see utils.zonal)
+    :param impact_return_periods: add the return periods of the adm0 and adm1 population impacts to the day stats (see stochastic.query)
+    :param economic_return_period: add the return period of the economic losses to the day stats (see stochastic.query)
+    :return:
+    """
 
-    print(f'\t\t\tCreated depth map{" (uploaded to geoserver)" if geoserver and upload_success else ""}: \033[32m{raster_depth_file}\033[0m ', end='')
+    # Initialize JSON country file
+
+    # json file for country
+    json_path_country = os.path.join(DATA_FOLDER, country)
+    json_file_country = f'{country}.json'
+
+    # initialize event for country
+    dict_country = initialize_event(
+        json_path=json_path_country,
+        json_file=json_file_country,
+        json_dict_update={
+            'total_events_country': 0,
+            'total_days_country': 0,
+            'peak_year': {},
+            'year_by_year': {}
+        }
+    )
+
+    # only the day 0 depth map (the observed day) is used for the events
+    raster = products['rasters'][0]
+    empty = raster['empty']
+    bbox = raster['bbox']
+    max_band_value = raster['max_band_value']
+    year_n, month_n, day_n = raster['date']
+
+    impacts = products['impacts']
+    economic_data_available = impacts['economic_data_available']
+    if impacts['population'] is not None:
+        merged_population_adm0, merged_population_adm1, merged_population_adm2, df_grouped_population = impacts['population']
+    if economic_data_available:
+        merged_economic_adm0, merged_economic_adm1, merged_economic_adm2, df_grouped_economic = impacts['economic']
+
+    # above threshold
+    above_threshold = max_band_value >= trigger_band_value
+
+    # Initialize JSON year file
+    # json file for year
+    json_path_year = os.path.join(DATA_FOLDER, country, EVENTS_FOLDER, year_n)
+    json_file_year = f'{country}_{year_n}.json'
+
+    # initialize event for year
+    dict_year = initialize_event(
+        json_path=json_path_year,
+        json_file=json_file_year,
+        json_dict_update={
+            'total_events_year': 0,
+            'total_days_year': 0,
+            'peak_event': {},
+            'event_by_event': {}
+        }
+    )
+
+    # check if empty:
+    logger.info(f'Not empty? {"✘" if empty else "✔"}', extra={'indent': 3})
+
+    # check if above threshold
+    threshold_comparison = '≥' if above_threshold else '<'
+    logger.info(f'Above band threshold? ({max_band_value} {threshold_comparison} {trigger_band_value}) {"✔" if above_threshold else "✘"}',
+                extra={'indent': 3})
+
+    #TODO:
+    # If not above threshold:
+    #    if ongoing event exists:
+    #        if 'number_of_days_since_last_threshold' >= n_days_since_last_threshold:
+    #           close ongoing event:
+    #               copy 'tmp' event to 'ongoing' event
+    #               delete 'tmp' event
+    #        else:
+    #           if 'tmp' event does not exist:
+    #              create 'tmp' event as a copy of 'ongoing' event
+    #           else:
+    #              update 'tmp' event
+
+    # Not above threshold
+    if not(above_threshold):
+
+        # check if ongoing event exists
+        logger.info(f'Ongoing event? {"✔" if dict_country["ongoing"] else "✘"}', extra={'indent': 3})
+        if dict_country['ongoing']:
+
+            # get the json year of the ongoing event
+            year_ongoing = dict_country['ongoing_event_year']
+            month_ongoing = dict_country['ongoing_event_month']
+            day_ongoing = dict_country['ongoing_event_day']
+
+            # get the json year of the ongoing event
+            json_path_year = os.path.join(DATA_FOLDER, country, EVENTS_FOLDER, year_ongoing)
+            json_file_year = f'{country}_{year_ongoing}.json'
+            dict_year = jsonFileToDict(json_path_year, json_file_year)
+
+            # get the json event of the ongoing event
+            json_path_event = os.path.join(DATA_FOLDER, country, EVENTS_FOLDER,
+                                           year_ongoing, month_ongoing, day_ongoing)
+            json_file_event = f'{year_ongoing}_{month_ongoing}_{day_ongoing}.json'
+            dict_event = jsonFileToDict(json_path_event, json_file_event)
+
+            # get 'ongoing' and 'tmp' event files
+            ongoing_event_file = os.path.join(json_path_event, json_file_event)
+            tmp_event_file = ongoing_event_file.replace('.json', '_tmp.json')
+
+            # only close the event if the last above threshold day happened more than n days ago
+            if dict_event['number_of_days_since_last_threshold'] >= n_days_since_last_threshold:
+
+                #TODO: copy temporary json event file
+
+                shutil.copy(tmp_event_file, ongoing_event_file)
+                os.remove(tmp_event_file)
+
+                # load json event file
+                dict_event = jsonFileToDict(json_path_event, json_file_event)
+
+                # close ongoing event
+                logger.info(f'Closing ongoing event that started on {year_ongoing:04}_{month_ongoing:02}_{day_ongoing:02}... ',
+                            extra={'indent': 4, 'color': 'magenta'})
+                dict_country = set_ongoing_event(json_path_country, json_file_country, False)
+                dict_year = set_ongoing_event(json_path_year, json_file_year, False)
+
+                # update jsons
+                # TODO: this is where country and year jsons are incremented
+
+                # get event start date
+                start_date = dict_event['start_date']
+
+                dict_year['total_events_year'] += 1
+                dict_year['total_days_year'] += dict_event['total_days_event']
+                dict_year['event_by_event'][start_date] = {
+                    'path': os.path.join(DATA_FOLDER, country, EVENTS_FOLDER, year_ongoing, month_ongoing, day_ongoing, json_file_event),
+                    'event': dict_event
+                }
+
+                dict_country['total_events_country'] += 1
+                dict_country['total_days_country'] += dict_event['total_days_event']
+                dict_country['year_by_year'].setdefault(year_ongoing, {})
+                dict_country['year_by_year'][year_ongoing][start_date] = dict_year['event_by_event'][start_date]
+
+                # TODO: pick up the biggest numbers from the ongoing event and put them in the peak event: flooded area, flooded population, losses, severity_index
+
+                dict_country = save_json_last_edit(json_path_country, json_file_country,
+                                                   dict_country)
+                dict_year = save_json_last_edit(json_path_year, json_file_year, dict_year)
+
+            else:
+
+                if not os.path.exists(tmp_event_file):
+                    logger.info(f'Creating temporary json file for the ongoing event that started on {year_ongoing:04}_{month_ongoing:02}_{day_ongoing:02}... ',
+                                extra={'indent': 4, 'color': 'magenta'})
+                    shutil.copy(ongoing_event_file,tmp_event_file)
+
+                # # Check if there is a temporary json file for the event
+                # if not os.path.exists(os.path.join(DATA_FOLDER, country, EVENTS_FOLDER, year_ongoing, month_ongoing, day_ongoing, f'{year_ongoing}_{month_ongoing}_{day_ongoing}_temp.json')):
+                #     # if there isn't, copy the original json file and load it
+                #     shutil.copy(
+                #         os.path.join(json_path_event, json_file_event),
+                #         os.path.join(json_path_event, json_file_event).replace('.json', '_temp.json'),
+                #     )
+
+                dict_event = jsonFileToDict(json_path_event, json_file_event)
+
+                logger.info('Incrementing the number of days since last day above threshold', extra={'indent': 4, 'color': 'magenta'})
+                dict_event["number_of_days_since_last_threshold"] += 1
+
+                # print number of days since last day above threshold
+                logger.info(f'Number of days since last day above threshold: {dict_event["number_of_days_since_last_threshold"]}',
+                            extra={'indent': 4, 'color': 'magenta'})
+
+                dict_event = save_json_last_edit(
+                    json_path=json_path_event,
+                    json_file=json_file_event,
+                    json_dict=dict_event
+                )
+
+    # Above threshold
+    else:
+
+        # check if ongoing event exists
+        logger.info(f'Ongoing event? {"✔" if dict_country["ongoing"] else "✘"}', extra={'indent': 3})
+
+        if not dict_country['ongoing']:
+
+            # create new event
+            logger.info(f'Opening new event on {year_n:04}_{month_n:02}_{day_n:02}... ', extra={'indent': 4, 'color': 'magenta'})
+
+            # json file for event
+            json_path_event = os.path.join(DATA_FOLDER, country, EVENTS_FOLDER, year_n,
+                                           f'{month_n:02}',
+                                           f'{day_n:02}')
+            json_file_event = f'{year_n}_{month_n:02}_{day_n:02}.json'
+
+            # initialize event
+            dict_event = initialize_event(
+                json_path=json_path_event,
+                json_file=json_file_event,
+                json_dict_update={
+                    # 'ongoing': True,
+                    'start_date': f'{year_n:04}_{month_n:02}_{day_n:02}',
+                    'total_days_event': 0,
+                    'last_day_above_threshold': 0,
+                    'day_by_day': [],  # TODO: add the first day
+                    # 'stats': {}, #TODO: initialize with the stats of the first day
+                    'peak_flood': None,
+                    'peak_population': None,
+                    'peak_losses': None,
+                    'adm0_max': None,
+                    'adm1_max': None,
+                    'adm2_max': None,
+                    # TODO: peak day is the day with the highest stats, so the day of the creation, then the day with the highest stats
+                },
+                ongoing_year=year_n,
+                ongoing_month=month_n,
+                ongoing_day=day_n
+            )
+
+            # set ongoing event in country and year jsons
+            dict_country = set_ongoing_event(
+                json_path=json_path_country,
+                json_file=json_file_country,
+                ongoing=True,
+                ongoing_year=year_n,
+                ongoing_month=month_n,
+                ongoing_day=day_n
+            )
+
+            dict_year = set_ongoing_event(
+                json_path=json_path_year,
+                json_file=json_file_year,
+                ongoing=True,
+                ongoing_year=year_n,
+                ongoing_month=month_n,
+                ongoing_day=day_n
+            )
+
+        ### Update ongoing event and copy files
+
+        # get the json year of the ongoing event
+        year_ongoing = dict_country['ongoing_event_year']
+        month_ongoing = dict_country['ongoing_event_month']
+        day_ongoing = dict_country['ongoing_event_day']
+
+        # print(f'\t\t\t\tOngoing event: {year_ongoing:04}_{month_ongoing:02}_{day_ongoing:02}')
+
+        # get the json event of the ongoing event
+        json_path_event = os.path.join(DATA_FOLDER, country, EVENTS_FOLDER,
+                                       year_ongoing, month_ongoing, day_ongoing)
+        json_file_event = f'{year_ongoing}_{month_ongoing}_{day_ongoing}.json'
+        dict_event = jsonFileToDict(json_path_event, json_file_event)
+
+        # get 'ongoing' and 'tmp' event files
+        ongoing_event_file = os.path.join(json_path_event, json_file_event)
+        tmp_event_file = ongoing_event_file.replace('.json', '_tmp.json')
+
+        # remove the temporary json file if it exists
+        if os.path.exists(tmp_event_file):
+            os.remove(tmp_event_file)
+
+        ## Copy files
+
+        # copy the depth file
+        depth_file_buffer = raster['depth_file']
+        depth_file = os.path.join(json_path_event, os.path.basename(depth_file_buffer))
+        place_file(depth_file_buffer, depth_file)
+        copy_cached(depth_file_buffer, depth_file)
+        logger.info(f'Copied {os.path.basename(depth_file)}... ', extra={'indent': 4, 'color': 'blue'})
+
+        # get the stats (unless they were already computed along with the depth map), before the max depth map is
+        # updated so that the depth map is only decoded once if the raster cache is enabled
+        stats = products['stats']
+        adm_stats = products.get('zonal_stats')
+        if stats is None or (zonal_stats and adm_stats is None):
+            # open the raster file
+            array, meta = tif_2_array(depth_file)
+            stats = array_2_stats(
+                array=array[0],  # depth band only (the agreement percentage may be the second band)
+                pixel_size_x_m=meta['transform'].a,
+                pixel_size_y_m=meta['transform'].e
+            )
+            if zonal_stats:
+                adm_stats = depth_2_zonal_stats(country, array[0], meta)
+
+        # if a file named f'{year_ongoing}_{month_ongoing}_{day_ongoing}_max_depth.tif' does not exists, copy the only depth file and rename it, if not, merge the two files
+        max_depth_file = os.path.join(json_path_event, f'{country}_{year_ongoing}_{month_ongoing}_{day_ongoing}_max_depth.tif')
+        if not os.path.exists(max_depth_file):
+            place_file(depth_file, max_depth_file)  # replaced (not modified) when merged with the next days
+            bbox_max = bbox
+            logger.info(f'Created {os.path.basename(max_depth_file)}... ', extra={'indent': 4, 'color': 'blue'})
+        else:
+            # reproject and maximize the two raster files
+            bbox_max = merge_tifs(tifs_list=[max_depth_file, depth_file], output_file=max_depth_file, grid=raster.get('grid'))
+            logger.info(f'Updated {os.path.basename(max_depth_file)}... ', extra={'indent': 4, 'color': 'blue'})
+
+        # copy the impact files of the run date
+        impact_files = get_catalog().impact_files(country, f'{year}{month}{day}')
+        for impact_file in impact_files:
+            place_file(impact_file, os.path.join(json_path_event, os.path.basename(impact_file)))
+            logger.info(f'Copied {os.path.basename(impact_file)}... ', extra={'indent': 4, 'color': 'blue'})
+
+        # update ongoing event
+        logger.info('Updating ongoing event... ', extra={'indent': 3})
+        # update the json event of the ongoing event
+
+        # adm breakdown
+        adm0 = merged_population_adm0.to_dict(orient='records')
+        adm1 = merged_population_adm1.to_dict(orient='records')
+        adm2 = merged_population_adm2.to_dict(orient='records')
+
+        if economic_data_available:
+            # economic adm breakdown
+            adm0_eco = merged_economic_adm0.to_dict(orient='records')
+            adm1_eco = merged_economic_adm1.to_dict(orient='records')
+            adm2_eco = merged_economic_adm2.to_dict(orient='records')
+
+        # update the json event of the ongoing event
+        dict_event['total_days_event'] += 1
+        dict_event['number_of_days_since_last_threshold'] = 0
+        dict_event['max_depth_file'] = os.path.basename(max_depth_file)
+
+        day_stats = {
+            'day': dict_event['total_days_event'],
+            'map': os.path.basename(depth_file),
+            'bbox': bbox,
+            'stats': stats,
+            'adm0': adm0,
+            'adm1': adm1,
+            'adm2': adm2,
+            'economic_data_available': economic_data_available,
+        }
 
-    return success, empty, bbox, max_band_value
+        if zonal_stats:
+            day_stats['zonal_stats'] = adm_stats
+
+        if impact_return_periods:
+            # the AEP curves are loaded once per run (see stochastic.query)
+            day_stats['return_periods'] = population_return_periods(country, merged_population_adm0, merged_population_adm1)
+
+        if economic_data_available:
+            day_stats['adm0_eco'] = adm0_eco
+            day_stats['adm1_eco'] = adm1_eco
+            day_stats['adm2_eco'] = adm2_eco
+
+            if economic_return_period:
+                # return period of the losses of the whole country, for each depth band
+                adm0_losses = {band: float(merged_economic_adm0[band].sum()) for band in ['band_1', 'band_5', 'band_11'] if band in merged_economic_adm0.columns}
+                day_stats['economic_return_period'] = economic_return_periods(country, adm0_losses)
+
+        dict_event['day_by_day'].append(day_stats)
+        dict_event['bbox_max'] = bbox_max
+
+        if dict_event['total_days_event'] == 1:
+            dict_event['peak_flood'] = {
+                'day': dict_event['total_days_event'],
+                'stats': stats
+            }
+            dict_event['peak_population'] = {
+                'day': dict_event['total_days_event'],
+                'population': merged_population_adm0.to_dict(orient='records')
+            }
+            if economic_data_available:
+                dict_event['peak_economic'] = {
+                    'day': dict_event['total_days_event'],
+                    'economic': merged_economic_adm0.to_dict(orient='records')
+                }
+            dict_event['stats'] = stats
+            dict_event['adm0_max'] = merged_population_adm0.to_dict(orient='records')
+            dict_event['adm1_max'] = merged_population_adm1.to_dict(orient='records')
+            dict_event['adm2_max'] = merged_population_adm2.to_dict(orient='records')
+            dict_event['population_max'] = df_grouped_population.to_dict(orient='records')
+            dict_event['population_total'] = [{key: int(value)} for key, value in pd.DataFrame.from_records(dict_event['population_max']).sum().items() if key != 'admin_code']
+            if economic_data_available:
+                dict_event['adm0_eco_max'] = merged_economic_adm0.to_dict(orient='records')
+                dict_event['adm1_eco_max'] = merged_economic_adm1.to_dict(orient='records')
+                dict_event['adm2_eco_max'] = merged_economic_adm2.to_dict(orient='records')
+                dict_event['economic_max'] = df_grouped_economic.to_dict(orient='records')
+                dict_event['economic_total'] = [{key: int(value)} for key, value in pd.DataFrame.from_records(dict_event['economic_max']).sum().items() if key != 'admin_code']
+        else:
+            # update the stats of the event: take the maximum value of each stat
+            for stat in dict_event['stats']:
+                dict_event['stats'][stat] = max(dict_event['stats'][stat], stats[stat])
+            # dict_event['stats'] = {**dict_event['stats'],
+            # **stats}
+            if stats['severity_index_1m'] > dict_event['stats']['severity_index_1m']:
+                dict_event['peak_flood'] = {
+                    'day': dict_event['total_days_event'],
+                    'stats': stats
+                }
+                dict_event['stats']['severity_index_1m'] = stats['severity_index_1m']
+            # if the sum of the numerical values of adm0 is greater than the previous peak
+            if sum_list_dict(adm0) > sum_list_dict(dict_event['peak_population']['population']) : #TODO!!!!!!!
+                dict_event['peak_population'] = {
+                    'day': dict_event['total_days_event'],
+                    'population': adm0
+                }
+
+
+            dict_event['adm0_max'] = find_maximum_values(merged_population_adm0, pd.DataFrame.from_records(dict_event['adm0_max'])).to_dict(orient='records')
+            dict_event['adm1_max'] = find_maximum_values(merged_population_adm1, pd.DataFrame.from_records(dict_event['adm1_max'])).to_dict(orient='records')
+            dict_event['adm2_max'] = find_maximum_values(merged_population_adm2, pd.DataFrame.from_records(dict_event['adm2_max'])).to_dict(orient='records')
+            dict_event['population_max'] = find_maximum_values(df_grouped_population, pd.DataFrame.from_records(dict_event['population_max'])).to_dict(orient='records')
+            dict_event['population_total'] = [{key: int(value)} for key, value in pd.DataFrame.from_records(dict_event['peak_population']['population']).sum().items() if key != 'ADM0_NAME']
+            # dict_event['population_total'] = [{key: int(value)} for key, value in pd.DataFrame.from_records(dict_event['population_max']).sum().items() if key != 'admin_code']
+
+            if economic_data_available:
+                if 'adm0_eco_max' not in dict_event.keys():
+                    dict_event['adm0_eco_max'] = merged_economic_adm0.to_dict(orient='records')
+                    dict_event['adm1_eco_max'] = merged_economic_adm1.to_dict(orient='records')
+                    dict_event['adm2_eco_max'] = merged_economic_adm2.to_dict(orient='records')
+                    dict_event['economic_max'] = df_grouped_economic.to_dict(orient='records')
+                else:
+                    dict_event['adm0_eco_max'] = find_maximum_values(merged_economic_adm0, pd.DataFrame.from_records(dict_event['adm0_eco_max'])).to_dict(orient='records')
+                    dict_event['adm1_eco_max'] = find_maximum_values(merged_economic_adm1, pd.DataFrame.from_records(dict_event['adm1_eco_max'])).to_dict(orient='records')
+                    dict_event['adm2_eco_max'] = find_maximum_values(merged_economic_adm2, pd.DataFrame.from_records(dict_event['adm2_eco_max'])).to_dict(orient='records')
+                    dict_event['economic_max'] = find_maximum_values(df_grouped_economic, pd.DataFrame.from_records(dict_event['economic_max'])).to_dict(orient='records')
+                dict_event['economic_total'] = [{key: int(value)} for key, value in pd.DataFrame.from_records(dict_event['adm0_eco_max']).sum().items() if key != 'ADM0_NAME']
+                # dict_event['economic_total'] = [{key: int(value)} for key, value in pd.DataFrame.from_records(dict_event['economic_max']).sum().items() if key != 'admin_code']
+
+
+        dict_event = save_json_last_edit(
+            json_path=json_path_event,
+            json_file=json_file_event,
+            json_dict=dict_event
+        )
 
 
 def process_pipeline(
@@ -174,6 +979,14 @@ def process_pipeline(
         password: str = None,
         server: str = None,
         trigger_band_value: int = TRIGGER_BAND_VALUE,
+        cache_folder: str = None,
+        summary: bool = False,
+        confidence_thresholds: list[float] = None,
+        agreement_band: bool = False,
+        country_grid: bool = False,
+        zonal_stats: bool = False,
+        impact_return_periods: bool = False,
+        economic_return_period: bool = False,
 ) -> None:
     """
     Process pipeline
@@ -189,6 +1002,14 @@ def process_pipeline(
     :param password:
     :param server:
     :param trigger_band_value:
+    :param cache_folder: folder of the depth maps cache (no cache if None)
+    :param summary: append the agreement summaries to the countries' daily summary files
+    :param confidence_thresholds: additional agreement thresholds (see process_files_include_exclude)
+    :param agreement_band: add the agreement percentage as a second band of the depth maps
+    :param country_grid: write the depth maps on the grid of the country (see utils.grid)
+    :param zonal_stats: add the flood stats of each admin unit to the day stats (see utils.zonal)
+    :param impact_return_periods: add the return periods of the adm0 and adm1 population impacts to the day stats (see stochastic.query)
+    :param economic_return_period: add the return period of the economic losses to the day stats (see stochastic.query)
     :return:
     """
 
@@ -214,487 +1035,204 @@ def process_pipeline(
         # loop over countries
         for country in list_countries:
 
-            print(f'Processing data for {country}...')
+            with day_diagnostics(country, f'{year}_{month}_{day}'):
+                logger.info(f'Processing data for {country}...')
+
+                # compute the depth maps and impacts of the day
+                products = process_day_products(
+                    country=country,
+                    year=year,
+                    month=month,
+                    day=day,
+                    n_days=n_days,
+                    n_days_since_last_threshold=n_days_since_last_threshold,
+                    to_epsg_3857=to_epsg_3857,
+                    threshold=threshold,
+                    geoserver=geoserver,
+                    username=username,
+                    password=password,
+                    server=server,
+                    trigger_band_value=trigger_band_value,
+                    cache_folder=cache_folder,
+                    summary=summary,
+                    confidence_thresholds=confidence_thresholds,
+                    agreement_band=agreement_band,
+                    country_grid=country_grid,
+                    zonal_stats=zonal_stats,
+                )
+
+                # open, update or close the events of the country
+                update_event_state(
+                    country=country,
+                    year=year,
+                    month=month,
+                    day=day,
+                    products=products,
+                    n_days_since_last_threshold=n_days_since_last_threshold,
+                    trigger_band_value=trigger_band_value,
+                    zonal_stats=zonal_stats,
+                    impact_return_periods=impact_return_periods,
+                    economic_return_period=economic_return_period,
+                )
 
-            # Initialize JSON country file
+        # increment day
+        year, month, day = increment_day(year, month, day, 1)
 
-            # json file for country
-            json_path_country = os.path.join(DATA_FOLDER, country)
-            json_file_country = f'{country}.json'
+    # clean buffer
+    logger.info('Cleaning buffer...', extra={'indent': 3})
+    clean_buffer_impacts(year, month, day, list_countries=LIST_COUNTRIES, n_days=n_days)
 
-            # initialize event for country
-            dict_country = initialize_event(
-                json_path=json_path_country,
-                json_file=json_file_country,
-                json_dict_update={
-                    'total_events_country': 0,
-                    'total_days_country': 0,
-                    'peak_year': {},
-                    'year_by_year': {}
-                }
-            )
 
-            # loop over sub-folders (impacts, raster, etc.)
-            for sub_folder in LIST_SUBFOLDERS_BUFFER:
-                print(f'\tProcessing {sub_folder} data...')
-
-                if sub_folder == IMPACTS_FOLDER:
-                    folder_path = os.path.join(DATA_FOLDER, country, sub_folder)
-                    csv_files = [os.path.join(folder_path, f) for f in os.listdir(folder_path) if
-                                f'rd{year}{month}{day}' in f and f.endswith('.csv') and not f.endswith(
-                                    '_processed.csv')]
-                    economic_data_available = False
-                    for csv_file in csv_files:
-                        print(f'\t\tProcessing {csv_file} ... ', end='')
-                        if 'population' in csv_file:
-                            merged_population_adm0, merged_population_adm1, merged_population_adm2, df_grouped_population = csv2geojson(
-                                csv_file=csv_file,
-                                shp_file=os.path.join(COUNTRIES_FOLDER, f'{country}_adm_shapefile.zip'),
-                                output_file=csv_file.replace('.csv', '.geojson'),
-                                to_epsg_3857=to_epsg_3857,
-                            )
-                            print()
-                        elif 'economic' in csv_file:
-                            merged_economic_adm0, merged_economic_adm1, merged_economic_adm2, df_grouped_economic = csv2geojson(
-                                csv_file=csv_file,
-                                shp_file=os.path.join(COUNTRIES_FOLDER, f'{country}_adm_shapefile.zip'),
-                                output_file=csv_file.replace('.csv', '.geojson'),
-                                to_epsg_3857=to_epsg_3857,
-                            )
-                            economic_data_available = True
-                        else:
-                            raise ValueError('Unknown impact type')
-                        print(f'\033[32m' + '✔' + '\033[0m')
-
-                elif sub_folder == RASTER_FOLDER:
-                    tmp_path = os.path.join(DATA_FOLDER, country, sub_folder, BUFFER_FOLDER)
-                    createFolderIfNotExists(tmp_path)
-
-                    for i_day in range(0, n_days):
-                        year_n, month_n, day_n = increment_day(year, month, day, i_day)
-
-                        # print day
-                        print(f'\t\tProcessing \033[1mday {i_day}\033[0m : ({year_n}-{month_n}-{day_n}) ... ')
-
-                        # create depth map
-                        success, empty, bbox, max_band_value = process_files_include_exclude(
-                            include_str_list=[f'fe{year_n}{month_n}{day_n}', f'rd{year}{month}{day}'],
-                            exclude_str_list=['Agreement', '_depth'],
-                            buffer_path=tmp_path,
-                            postfix=f'_{n_days_since_last_threshold}d_depth.tif',
-                            n_bands=211,
-                            threshold=threshold,
-                            to_epsg_3857=to_epsg_3857,
-                            geoserver=geoserver,
-                            username=username,
-                            password=password,
-                            server=server,
-                        )
+def process_pipeline_parallel(
+        start_date: str,
+        end_date: str = None,
+        n_days: int = 1,
+        n_days_since_last_threshold: int = N_DAYS_SINCE_LAST_THRESHOLD,
+        list_countries: list[str] = LIST_COUNTRIES,
+        to_epsg_3857: bool = True,
+        threshold: float = AGREEMENT_THRESHOLD,
+        geoserver: bool = False,
+        username: str = None,
+        password: str = None,
+        server: str = None,
+        trigger_band_value: int = TRIGGER_BAND_VALUE,
+        n_workers: int = None,
+        download: bool = True,
+        cache_folder: str = None,
+        summary: bool = False,
+        confidence_thresholds: list[float] = None,
+        agreement_band: bool = False,
+        country_grid: bool = False,
+        zonal_stats: bool = False,
+        impact_return_periods: bool = False,
+        economic_return_period: bool = False,
+) -> None:
+    """
+    Process the pipeline for a range of dates, computing the products of the different days (depth maps, stats and
+    impacts) in parallel worker processes, then running the event state machine sequentially over the results
+    :param start_date:
+    :param end_date:
+    :param n_days: number of forecast days per run date (1 for historic data)
+    :param n_days_since_last_threshold:
+    :param list_countries:
+    :param to_epsg_3857:
+    :param threshold:
+    :param geoserver:
+    :param username:
+    :param password:
+    :param server:
+    :param trigger_band_value:
+    :param n_workers: number of worker processes (defaults to the number of cores)
+    :param download: download the data from JBA's sftp before processing
+    :param cache_folder: folder of the depth maps cache (no cache if None)
+    :param summary: append the agreement summaries to the countries' daily summary files
+    :param confidence_thresholds: additional agreement thresholds (see process_files_include_exclude)
+    :param agreement_band: add the agreement percentage as a second band of the depth maps
+    :param country_grid: write the depth maps on the grid of the country (see utils.grid)
+    :param zonal_stats: add the flood stats of each admin unit to the day stats (see utils.zonal)
+    :param impact_return_periods: add the return periods of the adm0 and adm1 population impacts to the day stats (see stochastic.query)
+    :param economic_return_period: add the return period of the economic losses to the day stats (see stochastic.query)
+    :return:
+    """
 
-                        # above threshold
-                        above_threshold = max_band_value >= trigger_band_value
-
-                        if success:
-                            print(f'(\033[1mday {i_day}\033[0m)')
-                        else:
-                            print(f'\t\t\033[31mCould not create depth map for day \033[1m{i_day}\033[0m')
-
-                        # for day 0, check if empty (no depth map)
-                        if i_day == 0:
-
-                            # Initialize JSON year file
-                            # json file for year
-                            json_path_year = os.path.join(DATA_FOLDER, country, EVENTS_FOLDER, year_n)
-                            json_file_year = f'{country}_{year_n}.json'
-
-                            # initialize event for year
-                            dict_year = initialize_event(
-                                json_path=json_path_year,
-                                json_file=json_file_year,
-                                json_dict_update={
-                                    'total_events_year': 0,
-                                    'total_days_year': 0,
-                                    'peak_event': {},
-                                    'event_by_event': {}
-                                }
-                            )
-
-                            # check if empty:
-                            print('\t\t\tNot empty? ', end='')
-
-                            if empty:
-                                print('\033[31m' + '✘' + '\033[0m')
-                            else:
-                                print('\033[32m' + '✔' + '\033[0m')
-
-                            # check if above threshold
-                            threshold_comparison = '≥' if above_threshold else '<'
-                            print('\t\t\tAbove band threshold?' + f' ({max_band_value} {threshold_comparison} {trigger_band_value}) ', end='')
-
-                            #TODO:
-                            # If not above threshold:
-                            #    if ongoing event exists:
-                            #        if 'number_of_days_since_last_threshold' >= n_days_since_last_threshold:
-                            #           close ongoing event:
-                            #               copy 'tmp' event to 'ongoing' event
-                            #               delete 'tmp' event
-                            #        else:
-                            #           if 'tmp' event does not exist:
-                            #              create 'tmp' event as a copy of 'ongoing' event
-                            #           else:
-                            #              update 'tmp' event
-
-                            # Not above threshold
-                            if not(above_threshold):
-                                print('\033[31m' + '✘' + '\033[0m')
-
-                                # check if ongoing event exists
-                                print('\t\t\tOngoing event? ', end='')
-                                if dict_country['ongoing']:
-                                    print('\033[32m' + '✔' + '\033[0m')
-
-                                    # get the json year of the ongoing event
-                                    year_ongoing = dict_country['ongoing_event_year']
-                                    month_ongoing = dict_country['ongoing_event_month']
-                                    day_ongoing = dict_country['ongoing_event_day']
-
-                                    # get the json year of the ongoing event
-                                    json_path_year = os.path.join(DATA_FOLDER, country, EVENTS_FOLDER, year_ongoing)
-                                    json_file_year = f'{country}_{year_ongoing}.json'
-                                    dict_year = jsonFileToDict(json_path_year, json_file_year)
-
-                                    # get the json event of the ongoing event
-                                    json_path_event = os.path.join(DATA_FOLDER, country, EVENTS_FOLDER,
-                                                                   year_ongoing, month_ongoing, day_ongoing)
-                                    json_file_event = f'{year_ongoing}_{month_ongoing}_{day_ongoing}.json'
-                                    dict_event = jsonFileToDict(json_path_event, json_file_event)
-
-                                    # get 'ongoing' and 'tmp' event files
-                                    ongoing_event_file = os.path.join(json_path_event, json_file_event)
-                                    tmp_event_file = ongoing_event_file.replace('.json', '_tmp.json')
-
-                                    # only close the event if the last above threshold day happened more than n days ago
-                                    if dict_event['number_of_days_since_last_threshold'] >= n_days_since_last_threshold:
-
-                                        #TODO: copy temporary json event file
-
-                                        shutil.copy(tmp_event_file, ongoing_event_file)
-                                        os.remove(tmp_event_file)
-
-                                        # load json event file
-                                        dict_event = jsonFileToDict(json_path_event, json_file_event)
-
-                                        # close ongoing event
-                                        print(
-                                            f'\t\t\t\t\033[95mClosing ongoing event that started on {year_ongoing:04}_{month_ongoing:02}_{day_ongoing:02}... \033[0m')
-                                        dict_country = set_ongoing_event(json_path_country, json_file_country, False)
-                                        dict_year = set_ongoing_event(json_path_year, json_file_year, False)
-
-                                        # update jsons
-                                        # TODO: this is where country and year jsons are incremented
-
-                                        # get event start date
-                                        start_date = dict_event['start_date']
-
-                                        dict_year['total_events_year'] += 1
-                                        dict_year['total_days_year'] += dict_event['total_days_event']
-                                        dict_year['event_by_event'][start_date] = {
-                                            'path': os.path.join(DATA_FOLDER, country, EVENTS_FOLDER, year_ongoing, month_ongoing, day_ongoing, json_file_event),
-                                            'event': dict_event
-                                        }
-
-                                        dict_country['total_events_country'] += 1
-                                        dict_country['total_days_country'] += dict_event['total_days_event']
-                                        dict_country['year_by_year'].setdefault(year_ongoing, {})
-                                        dict_country['year_by_year'][year_ongoing][start_date] = dict_year['event_by_event'][start_date]
-
-                                        # TODO: pick up the biggest numbers from the ongoing event and put them in the peak event: flooded area, flooded population, losses, severity_index
-
-                                        dict_country = save_json_last_edit(json_path_country, json_file_country,
-                                                                           dict_country)
-                                        dict_year = save_json_last_edit(json_path_year, json_file_year, dict_year)
-
-                                    else:
-
-                                        if not os.path.exists(tmp_event_file):
-                                            print(f'\t\t\t\t\033[95mCreating temporary json file for the ongoing event that started on {year_ongoing:04}_{month_ongoing:02}_{day_ongoing:02}... \033[0m')
-                                            shutil.copy(ongoing_event_file,tmp_event_file)
-
-                                        # # Check if there is a temporary json file for the event
-                                        # if not os.path.exists(os.path.join(DATA_FOLDER, country, EVENTS_FOLDER, year_ongoing, month_ongoing, day_ongoing, f'{year_ongoing}_{month_ongoing}_{day_ongoing}_temp.json')):
-                                        #     # if there isn't, copy the original json file and load it
-                                        #     shutil.copy(
-                                        #         os.path.join(json_path_event, json_file_event),
-                                        #         os.path.join(json_path_event, json_file_event).replace('.json', '_temp.json'),
-                                        #     )
-
-                                        dict_event = jsonFileToDict(json_path_event, json_file_event)
-
-                                        print(f'\t\t\t\t\033[95mIncrementing the number of days since last day above threshold \033[0m')
-                                        dict_event["number_of_days_since_last_threshold"] += 1
-
-                                        # print number of days since last day above threshold
-                                        print(
-                                            f'\t\t\t\t\033[95mNumber of days since last day above threshold: {dict_event["number_of_days_since_last_threshold"]}\033[0m')
-
-                                        dict_event = save_json_last_edit(
-                                            json_path=json_path_event,
-                                            json_file=json_file_event,
-                                            json_dict=dict_event
-                                        )
-
-                                else:
-                                    print('\033[31m' + '✘' + '\033[0m')
-
-                            # Above threshold
-                            else:
-                                print('\033[32m' + '✔' + '\033[0m')
-
-                                # check if ongoing event exists
-                                print('\t\t\tOngoing event? ', end='')
-
-                                if dict_country['ongoing']:
-                                    print('\033[32m' + '✔' + '\033[0m')
-
-                                else:
-                                    print('\033[31m' + '✘' + '\033[0m')
-
-                                    # create new event
-                                    print(
-                                        f'\t\t\t\t\033[95mOpening new event on {year_n:04}_{month_n:02}_{day_n:02}... \033[0m')
-
-                                    # json file for event
-                                    json_path_event = os.path.join(DATA_FOLDER, country, EVENTS_FOLDER, year_n,
-                                                                   f'{month_n:02}',
-                                                                   f'{day_n:02}')
-                                    json_file_event = f'{year_n}_{month_n:02}_{day_n:02}.json'
-
-                                    # initialize event
-                                    dict_event = initialize_event(
-                                        json_path=json_path_event,
-                                        json_file=json_file_event,
-                                        json_dict_update={
-                                            # 'ongoing': True,
-                                            'start_date': f'{year_n:04}_{month_n:02}_{day_n:02}',
-                                            'total_days_event': 0,
-                                            'last_day_above_threshold': 0,
-                                            'day_by_day': [],  # TODO: add the first day
-                                            # 'stats': {}, #TODO: initialize with the stats of the first day
-                                            'peak_flood': None,
-                                            'peak_population': None,
-                                            'peak_losses': None,
-                                            'adm0_max': None,
-                                            'adm1_max': None,
-                                            'adm2_max': None,
-                                            # TODO: peak day is the day with the highest stats, so the day of the creation, then the day with the highest stats
-                                        },
-                                        ongoing_year=year_n,
-                                        ongoing_month=month_n,
-                                        ongoing_day=day_n
-                                    )
-
-                                    # set ongoing event in country and year jsons
-                                    dict_country = set_ongoing_event(
-                                        json_path=json_path_country,
-                                        json_file=json_file_country,
-                                        ongoing=True,
-                                        ongoing_year=year_n,
-                                        ongoing_month=month_n,
-                                        ongoing_day=day_n
-                                    )
-
-                                    dict_year = set_ongoing_event(
-                                        json_path=json_path_year,
-                                        json_file=json_file_year,
-                                        ongoing=True,
-                                        ongoing_year=year_n,
-                                        ongoing_month=month_n,
-                                        ongoing_day=day_n
-                                    )
-
-                                ### Update ongoing event and copy files
-
-                                # get the json year of the ongoing event
-                                year_ongoing = dict_country['ongoing_event_year']
-                                month_ongoing = dict_country['ongoing_event_month']
-                                day_ongoing = dict_country['ongoing_event_day']
-
-                                # print(f'\t\t\t\tOngoing event: {year_ongoing:04}_{month_ongoing:02}_{day_ongoing:02}')
-
-                                # get the json event of the ongoing event
-                                json_path_event = os.path.join(DATA_FOLDER, country, EVENTS_FOLDER,
-                                                               year_ongoing, month_ongoing, day_ongoing)
-                                json_file_event = f'{year_ongoing}_{month_ongoing}_{day_ongoing}.json'
-                                dict_event = jsonFileToDict(json_path_event, json_file_event)
-
-                                # get 'ongoing' and 'tmp' event files
-                                ongoing_event_file = os.path.join(json_path_event, json_file_event)
-                                tmp_event_file = ongoing_event_file.replace('.json', '_tmp.json')
-
-                                # remove the temporary json file if it exists
-                                if os.path.exists(tmp_event_file):
-                                    os.remove(tmp_event_file)
-
-                                ## Copy files
-
-                                # copy the depth file
-                                depth_file_buffer = \
-                                    [os.path.join(DATA_FOLDER, country, RASTER_FOLDER, BUFFER_FOLDER, f) for f in
-                                     os.listdir(os.path.join(DATA_FOLDER, country, RASTER_FOLDER, BUFFER_FOLDER)) if
-                                     f'rd{year}{month}{day}' in f and 'depth.tif' in f][0]
-                                depth_file = os.path.join(json_path_event, os.path.basename(depth_file_buffer))
-                                shutil.copy(depth_file_buffer, depth_file)
-                                print(f'\t\t\t\t\033[34mCopied {os.path.basename(depth_file)}... \033[0m')
-
-                                # if a file named f'{year_ongoing}_{month_ongoing}_{day_ongoing}_max_depth.tif' does not exists, copy the only depth file and rename it, if not, call reproject_and_maximize_tifs with the two files
-                                max_depth_file = os.path.join(json_path_event, f'{country}_{year_ongoing}_{month_ongoing}_{day_ongoing}_max_depth.tif')
-                                if not os.path.exists(max_depth_file):
-                                    shutil.copy(depth_file, max_depth_file)
-                                    bbox_max = bbox
-                                    print(f'\t\t\t\t\033[34mCreated {os.path.basename(max_depth_file)}... \033[0m')
-                                else:
-                                    # reproject and maximize the two raster files
-                                    #bbox_max = reproject_and_maximize_tifs(tifs_list=[max_depth_file, depth_file], output_file=max_depth_file)
-                                    bbox_max = merge_tifs(tifs_list=[max_depth_file, depth_file], output_file=max_depth_file)
-                                    print(f'\t\t\t\t\033[34mUpdated {os.path.basename(max_depth_file)}... \033[0m')
-
-                                # copy the impact file
-                                impact_files = [os.path.join(DATA_FOLDER, country, IMPACTS_FOLDER, f) for f in
-                                                os.listdir(os.path.join(DATA_FOLDER, country, IMPACTS_FOLDER)) if
-                                                f'rd{year}{month}{day}' in f and '.csv' in f or '.geojson' in f or '.tif' in f]
-                                for impact_file in impact_files:
-                                    shutil.copy(impact_file,
-                                                os.path.join(json_path_event, os.path.basename(impact_file)))
-                                    print(f'\t\t\t\t\033[34mCopied {os.path.basename(impact_file)}... \033[0m')
-
-                                # update ongoing event
-                                print('\t\t\tUpdating ongoing event... ')
-                                # update the json event of the ongoing event
-
-                                # open the raster file
-                                array, meta = tif_2_array(depth_file)
-                                # get the stats
-                                stats = array_2_stats(
-                                    array=array,
-                                    pixel_size_x_m=meta['transform'].a,
-                                    pixel_size_y_m=meta['transform'].e
-                                )
-
-                                # adm breakdown
-                                adm0 = merged_population_adm0.to_dict(orient='records')
-                                adm1 = merged_population_adm1.to_dict(orient='records')
-                                adm2 = merged_population_adm2.to_dict(orient='records')
-
-                                if economic_data_available:
-                                    # economic adm breakdown
-                                    adm0_eco = merged_economic_adm0.to_dict(orient='records')
-                                    adm1_eco = merged_economic_adm1.to_dict(orient='records')
-                                    adm2_eco = merged_economic_adm2.to_dict(orient='records')
-
-                                # update the json event of the ongoing event
-                                dict_event['total_days_event'] += 1
-                                dict_event['number_of_days_since_last_threshold'] = 0
-                                dict_event['max_depth_file'] = os.path.basename(max_depth_file)
-
-                                day_stats = {
-                                    'day': dict_event['total_days_event'],
-                                    'map': os.path.basename(depth_file),
-                                    'bbox': bbox,
-                                    'stats': stats,
-                                    'adm0': adm0,
-                                    'adm1': adm1,
-                                    'adm2': adm2,
-                                    'economic_data_available': economic_data_available,
-                                }
-
-                                if economic_data_available:
-                                    day_stats['adm0_eco'] = adm0_eco
-                                    day_stats['adm1_eco'] = adm1_eco
-                                    day_stats['adm2_eco'] = adm2_eco
-
-                                dict_event['day_by_day'].append(day_stats)
-                                dict_event['bbox_max'] = bbox_max
-
-                                if dict_event['total_days_event'] == 1:
-                                    dict_event['peak_flood'] = {
-                                        'day': dict_event['total_days_event'],
-                                        'stats': stats
-                                    }
-                                    dict_event['peak_population'] = {
-                                        'day': dict_event['total_days_event'],
-                                        'population': merged_population_adm0.to_dict(orient='records')
-                                    }
-                                    if economic_data_available:
-                                        dict_event['peak_economic'] = {
-                                            'day': dict_event['total_days_event'],
-                                            'economic': merged_economic_adm0.to_dict(orient='records')
-                                        }
-                                    dict_event['stats'] = stats
-                                    dict_event['adm0_max'] = merged_population_adm0.to_dict(orient='records')
-                                    dict_event['adm1_max'] = merged_population_adm1.to_dict(orient='records')
-                                    dict_event['adm2_max'] = merged_population_adm2.to_dict(orient='records')
-                                    dict_event['population_max'] = df_grouped_population.to_dict(orient='records')
-                                    dict_event['population_total'] = [{key: int(value)} for key, value in pd.DataFrame.from_records(dict_event['population_max']).sum().items() if key != 'admin_code']
-                                    if economic_data_available:
-                                        dict_event['adm0_eco_max'] = merged_economic_adm0.to_dict(orient='records')
-                                        dict_event['adm1_eco_max'] = merged_economic_adm1.to_dict(orient='records')
-                                        dict_event['adm2_eco_max'] = merged_economic_adm2.to_dict(orient='records')
-                                        dict_event['economic_max'] = df_grouped_economic.to_dict(orient='records')
-                                        dict_event['economic_total'] = [{key: int(value)} for key, value in pd.DataFrame.from_records(dict_event['economic_max']).sum().items() if key != 'admin_code']
-                                else:
-                                    # update the stats of the event: take the maximum value of each stat
-                                    for stat in dict_event['stats']:
-                                        dict_event['stats'][stat] = max(dict_event['stats'][stat], stats[stat])
-                                    # dict_event['stats'] = {**dict_event['stats'],
-                                    # **stats}
-                                    if stats['severity_index_1m'] > dict_event['stats']['severity_index_1m']:
-                                        dict_event['peak_flood'] = {
-                                            'day': dict_event['total_days_event'],
-                                            'stats': stats
-                                        }
-                                        dict_event['stats']['severity_index_1m'] = stats['severity_index_1m']
-                                    # if the sum of the numerical values of adm0 is greater than the previous peak
-                                    if sum_list_dict(adm0) > sum_list_dict(dict_event['peak_population']['population']) : #TODO!!!!!!!
-                                        dict_event['peak_population'] = {
-                                            'day': dict_event['total_days_event'],
-                                            'population': adm0
-                                        }
-
-
-                                    dict_event['adm0_max'] = find_maximum_values(merged_population_adm0, pd.DataFrame.from_records(dict_event['adm0_max'])).to_dict(orient='records')
-                                    dict_event['adm1_max'] = find_maximum_values(merged_population_adm1, pd.DataFrame.from_records(dict_event['adm1_max'])).to_dict(orient='records')
-                                    dict_event['adm2_max'] = find_maximum_values(merged_population_adm2, pd.DataFrame.from_records(dict_event['adm2_max'])).to_dict(orient='records')
-                                    dict_event['population_max'] = find_maximum_values(df_grouped_population, pd.DataFrame.from_records(dict_event['population_max'])).to_dict(orient='records')
-                                    dict_event['population_total'] = [{key: int(value)} for key, value in pd.DataFrame.from_records(dict_event['peak_population']['population']).sum().items() if key != 'ADM0_NAME']
-                                    # dict_event['population_total'] = [{key: int(value)} for key, value in pd.DataFrame.from_records(dict_event['population_max']).sum().items() if key != 'admin_code']
-
-                                    if economic_data_available:
-                                        if 'adm0_eco_max' not in dict_event.keys():
-                                            dict_event['adm0_eco_max'] = merged_economic_adm0.to_dict(orient='records')
-                                            dict_event['adm1_eco_max'] = merged_economic_adm1.to_dict(orient='records')
-                                            dict_event['adm2_eco_max'] = merged_economic_adm2.to_dict(orient='records')
-                                            dict_event['economic_max'] = df_grouped_economic.to_dict(orient='records')
-                                        else:
-                                            dict_event['adm0_eco_max'] = find_maximum_values(merged_economic_adm0, pd.DataFrame.from_records(dict_event['adm0_eco_max'])).to_dict(orient='records')
-                                            dict_event['adm1_eco_max'] = find_maximum_values(merged_economic_adm1, pd.DataFrame.from_records(dict_event['adm1_eco_max'])).to_dict(orient='records')
-                                            dict_event['adm2_eco_max'] = find_maximum_values(merged_economic_adm2, pd.DataFrame.from_records(dict_event['adm2_eco_max'])).to_dict(orient='records')
-                                            dict_event['economic_max'] = find_maximum_values(df_grouped_economic, pd.DataFrame.from_records(dict_event['economic_max'])).to_dict(orient='records')
-                                        dict_event['economic_total'] = [{key: int(value)} for key, value in pd.DataFrame.from_records(dict_event['adm0_eco_max']).sum().items() if key != 'ADM0_NAME']
-                                        # dict_event['economic_total'] = [{key: int(value)} for key, value in pd.DataFrame.from_records(dict_event['economic_max']).sum().items() if key != 'admin_code']
-
-
-                                dict_event = save_json_last_edit(
-                                    json_path=json_path_event,
-                                    json_file=json_file_event,
-                                    json_dict=dict_event
-                                )
+    # Make sure that the data tree structure exists
+    createDataTreeStructure()
 
-        # increment day
-        year, month, day = increment_day(year, month, day, 1)
+    if end_date is None:
+        end_date = dt.datetime.now().strftime('%Y_%m_%d')
+
+    # list of run dates
+    year, month, day = start_date.split('_')
+    n_dates = (dt.datetime.strptime(end_date, '%Y_%m_%d') - dt.datetime.strptime(start_date, '%Y_%m_%d')).days + 1
+    list_dates = [increment_day(year, month, day, i) for i in range(n_dates)]
+
+    # download the data (the sftp connection is the bottleneck, not the cores)
+    if download:
+        for country in list_countries:
+            for year_n, month_n, day_n in list_dates:
+                date = f'{year_n}_{month_n}_{day_n}'
+                try:
+                    download_pipeline(start_date=date, end_date=date, n_days=n_days, list_countries=[country],
+                                      include_str='ens00')  # according to JBA, the first day of forecast, all ensembles are the same
+                except FileNotFoundError:
+                    logger.warning(f'No data available for {country} on {date}')
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+
+        # submit the computation of the products of every (country, date)
+        futures = {
+            (country, date): executor.submit(
+                process_day_products_or_none,
+                country=country,
+                year=date[0],
+                month=date[1],
+                day=date[2],
+                n_days=n_days,
+                n_days_since_last_threshold=n_days_since_last_threshold,
+                to_epsg_3857=to_epsg_3857,
+                threshold=threshold,
+                geoserver=geoserver,
+                username=username,
+                password=password,
+                server=server,
+                trigger_band_value=trigger_band_value,
+                compute_stats=True,
+                cache_folder=cache_folder,
+                summary=summary,
+                confidence_thresholds=confidence_thresholds,
+                agreement_band=agreement_band,
+                country_grid=country_grid,
+                zonal_stats=zonal_stats,
+            )
+            for country in list_countries for date in list_dates
+        }
+
+        # run the event state machine in chronological order, while the next days are still being computed
+        for country in list_countries:
+
+            # json file keeping track of the processed dates
+            json_path = os.path.join(DATA_FOLDER, country)
+            json_file = 'latest_date.json'
+            json_dict = createJSONifNotExists(json_path=json_path, json_file=json_file, json_dict={'latest_date': []})
+
+            for year_n, month_n, day_n in list_dates:
+                logger.info(f'Updating events for {country} ({year_n}-{month_n}-{day_n})...')
+
+                products = futures[(country, (year_n, month_n, day_n))].result()
+
+                if products is None:
+                    logger.warning('No data available for this date')
+                    json_dict['latest_date'].insert(0, "missing_data")
+                    continue
+
+                with day_diagnostics(country, f'{year_n}_{month_n}_{day_n}', stage='events'):
+                    update_event_state(
+                        country=country,
+                        year=year_n,
+                        month=month_n,
+                        day=day_n,
+                        products=products,
+                        n_days_since_last_threshold=n_days_since_last_threshold,
+                        trigger_band_value=trigger_band_value,
+                        zonal_stats=zonal_stats,
+                        impact_return_periods=impact_return_periods,
+                        economic_return_period=economic_return_period,
+                    )
+
+                json_dict['latest_date'].insert(0, f'{year_n}_{month_n}_{day_n}')
+
+            # update json last edited
+            json_dict = save_json_last_edit(
+                json_path=json_path,
+                json_file=json_file,
+                json_dict=json_dict
+            )
 
     # clean buffer
-    print('\t\t\tCleaning buffer...')
-    clean_buffer_impacts(year, month, day, list_countries=LIST_COUNTRIES, n_days=n_days)
+    logger.info('Cleaning buffer...', extra={'indent': 3})
+    year, month, day = increment_day(*list_dates[-1], 1)
+    clean_buffer_impacts(year, month, day, list_countries=list_countries, n_days=n_days)
+
 
 def process_pipeline_historic(
         start_date: str = None,
@@ -708,7 +1246,15 @@ def process_pipeline_historic(
         username: str = None,
         password: str = None,
         server: str = None,
-        depth_band_trigger: int = 5
+        depth_band_trigger: int = 5,
+        cache_folder: str = None,
+        summary: bool = False,
+        confidence_thresholds: list[float] = None,
+        agreement_band: bool = False,
+        country_grid: bool = False,
+        zonal_stats: bool = False,
+        impact_return_periods: bool = False,
+        economic_return_period: bool = False,
 ) -> None:
     """
     Process the pipeline for historic data
@@ -717,6 +1263,14 @@ def process_pipeline_historic(
     :param n_days:
     :param list_countries:
     :param to_epsg_3857:
+    :param cache_folder: folder of the depth maps cache (no cache if None)
+    :param summary: append the agreement summaries to the countries' daily summary files
+    :param confidence_thresholds: additional agreement thresholds (see process_files_include_exclude)
+    :param agreement_band: add the agreement percentage as a second band of the depth maps
+    :param country_grid: write the depth maps on the grid of the country (see utils.grid)
+    :param zonal_stats: add the flood stats of each admin unit to the day stats (see utils.zonal)
+    :param impact_return_periods: add the return periods of the adm0 and adm1 population impacts to the day stats (see stochastic.query)
+    :param economic_return_period: add the return period of the economic losses to the day stats (see stochastic.query)
     :return:
     """
 
@@ -746,7 +1300,7 @@ def process_pipeline_historic(
 
         if json_dict['latest_date'] == []:
             latest_date = None
-            print(f'\n\033[95mNo files in buffer folder\033[0m')
+            logger.info('No files in buffer folder', extra={'color': 'magenta'})
 
             start_date = HISTORICAL_STARTING_DATES[country]  # first date of data collection from JBA's sftp
             end_date = HISTORICAL_STARTING_DATES[country]
@@ -754,7 +1308,7 @@ def process_pipeline_historic(
         else:
 
             latest_date = json_dict['latest_date'][0]
-            print(f'\n\033[95mLatest date in buffer folder: {latest_date}\033[0m')
+            logger.info(f'Latest date in buffer folder: {latest_date}', extra={'color': 'magenta'})
 
             # download data from sftp and run pipeline from the next day, for 1 day and 1 day of forecast (n_days=1)
             year, month, day = latest_date.split('_')
@@ -775,7 +1329,7 @@ def process_pipeline_historic(
                                   list_countries=[country], include_str='ens00')  # according to JBA, the first day of forecast, all ensembles are the same
                 break
             except FileNotFoundError:
-                print(f'{colorize_text("No data available for this date", "red")}')
+                logger.warning('No data available for this date')
 
                 # check if ongoing event
                 # json file for country
@@ -801,7 +1355,7 @@ def process_pipeline_historic(
 
         if days_missing_data > max_days_missing_data:
             error_message = f'Failed to process pipeline because no data available for the last {max_days_missing_data} days'
-            print(f'{colorize_text(error_message, "red")}')
+            logger.error(error_message)
             exit()
 
         # pipeline to process data
@@ -816,7 +1370,15 @@ def process_pipeline_historic(
             username=username,
             password=password,
             server=server,
-            trigger_band_value=depth_band_trigger
+            trigger_band_value=depth_band_trigger,
+            cache_folder=cache_folder,
+            summary=summary,
+            confidence_thresholds=confidence_thresholds,
+            agreement_band=agreement_band,
+            country_grid=country_grid,
+            zonal_stats=zonal_stats,
+            impact_return_periods=impact_return_periods,
+            economic_return_period=economic_return_period,
         )
 
         # update json latest date
@@ -849,8 +1411,30 @@ if __name__ == "__main__":
     parser.add_argument('-t', '--n_days_since_last_threshold', help='Number of days since last threshold', type=int, default=N_DAYS_SINCE_LAST_THRESHOLD)
     parser.add_argument('-at', '--agreement_threshold', help='Agreement threshold', type=float, default=AGREEMENT_THRESHOLD)
     parser.add_argument('-m', '--max_days_missing_data', help='Max days missing data', type=int, default=MAX_DAYS_MISSING_DATA)
+    parser.add_argument('-par', '--parallel', help='Run historic data in parallel worker processes (requires a start date)', action='store_true', default=False)
+    parser.add_argument('-w', '--n_workers', help='Number of worker processes for parallel historic data', type=int, default=None)
+    parser.add_argument('-cache', '--cache', help='Reuse the depth maps already computed from the same ensemble files', action='store_true', default=False)
+    parser.add_argument('-cl', '--confidence_layers', help='Additional agreement thresholds, each producing its own depth map', type=float, nargs='+', default=None)
+    parser.add_argument('-ab', '--agreement_band', help='Add the agreement percentage as a second band of the depth maps', action='store_true', default=False)
+    parser.add_argument('-grid', '--country_grid', help='Write the depth maps on the grid of the country', action='store_true', default=False)
+    parser.add_argument('-zonal', '--zonal_stats', help='Add the flood stats of each admin unit to the day stats (implies --country_grid)', action='store_true', default=False)
+    parser.add_argument('-erp', '--economic_return_period', help='Add the return period of the economic losses to the day stats', action='store_true', default=False)
+    parser.add_argument('-rp', '--impact_return_periods', help='Add the return periods of the adm0 and adm1 population impacts to the day stats', action='store_true', default=False)
+    parser.add_argument('-mmap', '--raster_cache', help='Keep the rasters decoded during the run as memory-mapped arrays', action='store_true', default=False)
+    parser.add_argument('-instr', '--instrument', help=f'Record the wall time, CPU time, memory and I/O of each stage as JSON lines per country and day (in {INSTRUMENT_FOLDER})', action='store_true', default=False)
+    parser.add_argument('-prof', '--profile', help=f'Profile each country and day (in {PROFILE_FOLDER}): sample (stacks sampled for flame graphs) or cprofile', type=str, nargs='?', const='sample', choices=['sample', 'cprofile'], default=None)
+    parser.add_argument('-pi', '--profile_interval', help='Sampling interval of the profiles (seconds)', type=float, default=PROFILE_SAMPLE_INTERVAL)
+    parser.add_argument('-log', '--log_level', help='Level of the messages (DEBUG, INFO, WARNING, ERROR)', type=str, default='INFO')
+    parser.add_argument('-jl', '--log_json', help='Write the messages as JSON lines (with the country and date of each)', action='store_true', default=False)
+    parser.add_argument('-q', '--quiet', help='Only write the warnings and errors (no progress messages)', action='store_true', default=False)
+    parser.add_argument('-summary', '--summary', help='Append the ensemble agreement summaries to the daily summary files (see scripts/sweep.py)', action='store_true', default=False)
     args = parser.parse_args()
 
+    configure_logging(level=args.log_level.upper(), json_output=args.log_json, quiet=args.quiet)
+
+    # the admin units are rasterized once on the grid of the country (see utils.zonal)
+    args.country_grid = args.country_grid or args.zonal_stats
+
     username = args.username
     password = args.password
     server = args.server
@@ -865,45 +1449,71 @@ if __name__ == "__main__":
             if password is None:
                 raise Exception('Geoserver password not provided')
 
-    if not args.historic:
-        process_pipeline(
-            start_date=args.start_date,
-            end_date=args.end_date,
-            n_days=args.n_days,
-            n_days_since_last_threshold=args.n_days_since_last_threshold,
-            threshold=args.agreement_threshold,
-            list_countries=args.list_countries,
-            geoserver=args.geoserver,
-            username=username,
-            password=password,
-            server=server,
-            trigger_band_value=args.depth_band_trigger
-        )
-    else:
-        if args.to_now:
-            # calculate the number of days to run the historic data to now
-            today = dt.datetime.now()
-            start_date = dt.datetime.strptime(args.start_date, '%Y_%m_%d')
-            n_days_to_run = (today - start_date).days
+    cache_folder = DEPTH_CACHE_FOLDER if args.cache else None
+
+    # decode each raster only once per run if required, measure the stages and profile the days if required
+    with raster_cache(enabled=args.raster_cache), instrumentation(enabled=args.instrument), \
+            profiling(enabled=args.profile is not None, mode=args.profile or 'sample', interval=args.profile_interval):
+        if not args.historic:
+            process_pipeline(
+                start_date=args.start_date,
+                end_date=args.end_date,
+                n_days=args.n_days,
+                n_days_since_last_threshold=args.n_days_since_last_threshold,
+                threshold=args.agreement_threshold,
+                list_countries=args.list_countries,
+                geoserver=args.geoserver,
+                username=username,
+                password=password,
+                server=server,
+                trigger_band_value=args.depth_band_trigger,
+                cache_folder=cache_folder,
+                summary=args.summary,
+                confidence_thresholds=args.confidence_layers,
+                agreement_band=args.agreement_band,
+                country_grid=args.country_grid,
+                zonal_stats=args.zonal_stats,
+                impact_return_periods=args.impact_return_periods,
+                economic_return_period=args.economic_return_period,
+            )
+        elif args.parallel:
+            if args.start_date is None:
+                raise Exception('Start date must be provided to run historic data in parallel')
+
+            process_pipeline_parallel(
+                start_date=args.start_date,
+                end_date=args.end_date,
+                n_days=1,  # so that the pipeline does not keep forecasts from the past
+                n_days_since_last_threshold=args.n_days_since_last_threshold,
+                threshold=args.agreement_threshold,
+                list_countries=args.list_countries,
+                geoserver=args.geoserver,
+                username=username,
+                password=password,
+                server=server,
+                trigger_band_value=args.depth_band_trigger,
+                n_workers=args.n_workers,
+                cache_folder=cache_folder,
+                summary=args.summary,
+                confidence_thresholds=args.confidence_layers,
+                agreement_band=args.agreement_band,
+                country_grid=args.country_grid,
+                zonal_stats=args.zonal_stats,
+                impact_return_periods=args.impact_return_periods,
+                economic_return_period=args.economic_return_period,
+            )
         else:
-            n_days_to_run = 1
-
-        process_pipeline_historic(
-            start_date=args.start_date,
-            end_date=args.end_date,
-            n_days_since_last_threshold=args.n_days_since_last_threshold,
-            max_days_missing_data=args.max_days_missing_data,
-            threshold=args.agreement_threshold,
-            list_countries=args.list_countries,
-            geoserver=args.geoserver,
-            username=username,
-            password=password,
-            server=server,
-            depth_band_trigger=args.depth_band_trigger
-        )
+            if args.to_now:
+                # calculate the number of days to run the historic data to now
+                today = dt.datetime.now()
+                start_date = dt.datetime.strptime(args.start_date, '%Y_%m_%d')
+                n_days_to_run = (today - start_date).days
+            else:
+                n_days_to_run = 1
 
-        for i in range(n_days_to_run-1):
             process_pipeline_historic(
+                start_date=args.start_date,
+                end_date=args.end_date,
                 n_days_since_last_threshold=args.n_days_since_last_threshold,
                 max_days_missing_data=args.max_days_missing_data,
                 threshold=args.agreement_threshold,
@@ -912,5 +1522,34 @@ if __name__ == "__main__":
                 username=username,
                 password=password,
                 server=server,
-                depth_band_trigger=args.depth_band_trigger
+                depth_band_trigger=args.depth_band_trigger,
+                cache_folder=cache_folder,
+                summary=args.summary,
+                confidence_thresholds=args.confidence_layers,
+                agreement_band=args.agreement_band,
+                country_grid=args.country_grid,
+                zonal_stats=args.zonal_stats,
+                impact_return_periods=args.impact_return_periods,
+                economic_return_period=args.economic_return_period,
             )
+
+            for i in range(n_days_to_run-1):
+                process_pipeline_historic(
+                    n_days_since_last_threshold=args.n_days_since_last_threshold,
+                    max_days_missing_data=args.max_days_missing_data,
+                    threshold=args.agreement_threshold,
+                    list_countries=args.list_countries,
+                    geoserver=args.geoserver,
+                    username=username,
+                    password=password,
+                    server=server,
+                    depth_band_trigger=args.depth_band_trigger,
+                    cache_folder=cache_folder,
+                    summary=args.summary,
+                    confidence_thresholds=args.confidence_layers,
+                    agreement_band=args.agreement_band,
+                    country_grid=args.country_grid,
+                    zonal_stats=args.zonal_stats,
+                    impact_return_periods=args.impact_return_periods,
+                    economic_return_period=args.economic_return_period,
+                )
@@ -0,0 +1,162 @@
+#####################################################
+# Author: Bertrand Delvaux (2023)                   #
+#                                                   #
+# Script to calibrate the event detection of ARC's  #
+# Flood Explorer over the daily summaries           #
+#                                                   #
+#####################################################
+
+import os
+import itertools
+import argparse
+
+import pandas as pd
+import numpy as np
+
+from constants.constants import DATA_FOLDER, LIST_COUNTRIES, DAILY_SUMMARY_FILE, AGREEMENT_THRESHOLD, \
+    TRIGGER_BAND_VALUE, N_DAYS_SINCE_LAST_THRESHOLD
+
+from utils.summary import load_daily_summary
+from utils.logger import get_logger, configure_logging
+
+logger = get_logger(__name__)
+
+
+def max_band_values(max_count: np.ndarray, n_members: np.ndarray, threshold: float = AGREEMENT_THRESHOLD) -> np.ndarray:
+    """
+    Get the max band value of the depth map of every day, for a given agreement threshold
+    :param max_count: array of shape (n_days, n_bands + 1), see utils.summary.band_max_count
+    :param n_members: array of shape (n_days,)
+    :param threshold:
+    :return: array of shape (n_days,)
+    """
+
+    # bands kept in the depth map (same comparison as in tifs_2_tif_depth)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kept = (max_count > 0) & (max_count / n_members[:, None] >= threshold)
+
+    # highest band kept, 0 if none
+    highest = kept.shape[1] - 1 - np.argmax(kept[:, ::-1], axis=1)
+
+    return np.where(kept.any(axis=1), highest, 0)
+
+
+def detect_events(above_threshold: np.ndarray, n_days_since_last_threshold: int = N_DAYS_SINCE_LAST_THRESHOLD) -> pd.DataFrame:
+    """
+    Detect the events over consecutive days, with the same rules as the event state machine of the pipeline: an event
+    opens on a day above the threshold, and closes once more than n_days_since_last_threshold days in a row are below
+    :param above_threshold: boolean array of shape (n_days,)
+    :param n_days_since_last_threshold:
+    :return: one row per event, with the index of its first and last days above threshold and its number of days
+    """
+
+    days = np.flatnonzero(above_threshold)
+    if len(days) == 0:
+        return pd.DataFrame(columns=['start', 'end', 'total_days_event', 'ongoing'])
+
+    # a new event starts whenever the gap since the previous day above threshold is too long
+    new_event = np.diff(days, prepend=days[0]) - 1 > n_days_since_last_threshold
+    new_event[0] = True
+    event_id = np.cumsum(new_event) - 1
+
+    starts = days[new_event]
+    ends = days[np.r_[new_event[1:], True]]
+
+    df = pd.DataFrame({
+        'start': starts,
+        'end': ends,
+        'total_days_event': np.bincount(event_id),
+    })
+
+    # the last event is still ongoing if not enough days below threshold followed it
+    df['ongoing'] = False
+    df.loc[df.index[-1], 'ongoing'] = len(above_threshold) - 1 - ends[-1] <= n_days_since_last_threshold
+
+    return df
+
+
+def sweep(
+        summary: pd.DataFrame,
+        agreement_thresholds: list[float],
+        trigger_band_values: list[int],
+        n_days_since_last_thresholds: list[int],
+) -> pd.DataFrame:
+    """
+    Evaluate the event detection for every combination of parameters
+    :param summary: output of utils.summary.load_daily_summary
+    :param agreement_thresholds:
+    :param trigger_band_values:
+    :param n_days_since_last_thresholds:
+    :return: one row per combination of parameters
+    """
+
+    # one row per calendar day, so that the days are counted as in the pipeline even if some summaries are missing (the
+    # missing days are below threshold)
+    if len(summary):
+        days = pd.date_range(pd.to_datetime(summary['rd'].iloc[0]), pd.to_datetime(summary['rd'].iloc[-1]), freq='D')
+        n_missing = len(days) - len(summary)
+        if n_missing > 0:
+            logger.warning(f'{n_missing} days without summary between {summary["rd"].iloc[0]} and {summary["rd"].iloc[-1]}, counted as below threshold')
+        summary = summary.drop_duplicates(subset='rd', keep='last')
+        summary = summary.set_index(pd.to_datetime(summary['rd'])).reindex(days)
+        summary['rd'] = summary.index.strftime('%Y%m%d')
+        summary = summary.fillna(0).reset_index(drop=True)
+
+    max_count = summary.filter(regex=r'^band_\d+$').to_numpy()
+    n_members = summary['n_members'].to_numpy()
+
+    rows = []
+    for threshold in agreement_thresholds:
+        max_band_value = max_band_values(max_count, n_members, threshold=threshold)
+
+        for trigger_band_value, n_days_since_last_threshold in itertools.product(trigger_band_values, n_days_since_last_thresholds):
+            events = detect_events(max_band_value >= trigger_band_value, n_days_since_last_threshold)
+
+            rows.append({
+                'agreement_threshold': threshold,
+                'trigger_band_value': trigger_band_value,
+                'n_days_since_last_threshold': n_days_since_last_threshold,
+                'total_events': len(events),
+                'total_days': int(events['total_days_event'].sum()),
+                'mean_days_event': np.round(events['total_days_event'].mean(), 2) if len(events) else 0,
+                'max_days_event': int(events['total_days_event'].max()) if len(events) else 0,
+                'ongoing': bool(events['ongoing'].any()),
+                'first_day': summary['rd'].iloc[0] if len(summary) else None,
+                'last_day': summary['rd'].iloc[-1] if len(summary) else None,
+            })
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Sweep the event detection parameters over the daily summaries')
+    parser.add_argument('-c', '--list_countries', help='List of countries', type=str, nargs='+', default=LIST_COUNTRIES)
+    parser.add_argument('-at', '--agreement_thresholds', help='Agreement thresholds', type=float, nargs='+', default=[AGREEMENT_THRESHOLD])
+    parser.add_argument('-d', '--depth_band_triggers', help='Depth band triggers', type=int, nargs='+', default=[TRIGGER_BAND_VALUE])
+    parser.add_argument('-t', '--n_days_since_last_thresholds', help='Numbers of days since last threshold', type=int, nargs='+', default=[N_DAYS_SINCE_LAST_THRESHOLD])
+    parser.add_argument('-o', '--output_file', help='Output csv file', type=str, default='sweep.csv')
+    parser.add_argument('-log', '--log_level', help='Level of the messages (DEBUG, INFO, WARNING, ERROR)', type=str, default='INFO')
+    args = parser.parse_args()
+
+    configure_logging(level=args.log_level.upper())
+
+    list_df = []
+    for country in args.list_countries:
+        summary_file = os.path.join(DATA_FOLDER, country, DAILY_SUMMARY_FILE)
+        if not os.path.exists(summary_file):
+            logger.warning(f'No daily summary for {country}, run the pipeline with --summary first')
+            continue
+
+        df_country = sweep(
+            summary=load_daily_summary(summary_file),
+            agreement_thresholds=args.agreement_thresholds,
+            trigger_band_values=args.depth_band_triggers,
+            n_days_since_last_thresholds=args.n_days_since_last_thresholds,
+        )
+        df_country.insert(0, 'country', country)
+        list_df.append(df_country)
+
+    if list_df:
+        df = pd.concat(list_df, ignore_index=True)
+        df.to_csv(args.output_file, index=False)
+        logger.info(f'Sweep written to {args.output_file}:\n{df.to_string(index=False)}')
@@ -0,0 +1,148 @@
+import os
+import re
+import json
+
+import pandas as pd
+
+from stochastic.constants import STOCHASTIC_FOLDER, COUNTRY_LIST, COUNTRY_DICT, PARQUET_FOLDER
+
+# e.g. ANA_21_TG_POP_gul_S2_leccalc_wheatsheaf_aep.csv, YLT/ANA_18_TG_GDP_gul_S1_pltcalc.csv
+CSV_PATTERN = re.compile(r'^(?P<thresh>.+?)(?P<gul>_gul)?_S(?P<summary>\d+)_(?P<kind>leccalc_wheatsheaf_aep|aalcalc|pltcalc)\.csv$')
+
+# columns stored as categories
+CATEGORICAL_COLUMNS = ['countrycode', 'geogname1', 'sidx', 'type']
+
+INDEX_FILE = 'index.json'
+
+
+def parquet_file(csv_file):
+    """
+    Get the parquet file of a stochastic csv file (same relative path, in the parquet folder)
+    :param csv_file: e.g. stochastic/tgo/YLT/ANA_18_TG_GDP_gul_S1_pltcalc.csv
+    :return:
+    """
+    relative_path = os.path.relpath(os.path.abspath(csv_file), STOCHASTIC_FOLDER)
+    return os.path.join(PARQUET_FOLDER, f'{os.path.splitext(relative_path)[0]}.parquet')
+
+
+def csv_2_parquet(csv_file):
+    """
+    Convert a stochastic csv file to a typed parquet file (regions, countries and types as categories)
+    :param csv_file:
+    :return: the parquet file
+    """
+
+    df = pd.read_csv(csv_file)
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+
+    output_file = parquet_file(csv_file)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    df.to_parquet(f'{output_file}.tmp', index=False)
+    os.replace(f'{output_file}.tmp', output_file)
+
+    return output_file
+
+
+def is_cached(csv_file):
+    """
+    Check if the parquet file of a csv file is up to date
+    :param csv_file:
+    :return:
+    """
+    output_file = parquet_file(csv_file)
+    return os.path.exists(output_file) and os.path.getmtime(output_file) >= os.path.getmtime(csv_file)
+
+
+def read_table(csv_file):
+    """
+    Read a stochastic csv file, from its parquet file if it is up to date (see build_cache)
+    :param csv_file:
+    :return:
+    """
+    if os.path.exists(csv_file) and is_cached(csv_file):
+        return pd.read_parquet(parquet_file(csv_file))
+    return pd.read_csv(csv_file)
+
+
+def country_csv_files(country):
+    """
+    Get the stochastic csv files of a country, with the threshold, summary level (1: country, 2: regions) and kind
+    of each
+    :param country:
+    :return: list of (csv file, thresh, summary, kind)
+    """
+
+    csv_files = []
+    country_folder = os.path.join(STOCHASTIC_FOLDER, COUNTRY_DICT[country])
+    for folder in [country_folder, os.path.join(country_folder, 'YLT')]:
+        if not os.path.isdir(folder):
+            continue
+        for file in sorted(os.listdir(folder)):
+            match = CSV_PATTERN.match(file)
+            if match is None:
+                continue
+            # the YLT thresholds include the _gul suffix (see YLT_THRESHOLDS)
+            thresh = match['thresh'] + (match['gul'] or '') if match['kind'] == 'pltcalc' else match['thresh']
+            csv_files.append((os.path.join(folder, file), thresh, int(match['summary']), match['kind']))
+
+    return csv_files
+
+
+def build_cache(countries=COUNTRY_LIST):
+    """
+    Convert the (new or modified) stochastic csv files of the countries to parquet, and write the index of the
+    available thresholds and summary levels of each country
+    :param countries:
+    :return: the index
+    """
+
+    index = load_index()
+
+    for country in countries:
+        country_index = {}
+        for csv_file, thresh, summary, kind in country_csv_files(country):
+            if not is_cached(csv_file):
+                csv_2_parquet(csv_file)
+            summaries = country_index.setdefault(kind, {}).setdefault(thresh, [])
+            summaries.append(summary)
+        index[COUNTRY_DICT[country]] = country_index
+
+    os.makedirs(PARQUET_FOLDER, exist_ok=True)
+    index_file = os.path.join(PARQUET_FOLDER, INDEX_FILE)
+    with open(f'{index_file}.tmp', 'w') as f:
+        json.dump(index, f, indent=4)
+    os.replace(f'{index_file}.tmp', index_file)
+
+    return index
+
+
+def load_index():
+    """
+    Load the index of the available thresholds (see build_cache), empty if the cache was not built
+    :return: {iso: {kind: {thresh: [summary levels]}}}
+    """
+    index_file = os.path.join(PARQUET_FOLDER, INDEX_FILE)
+    if not os.path.exists(index_file):
+        return {}
+    with open(index_file, 'r') as f:
+        return json.load(f)
+
+
+def available_thresholds(country, kind):
+    """
+    Get the thresholds of a country available for a kind of file, with their summary levels
+    :param country:
+    :param kind: 'leccalc_wheatsheaf_aep', 'aalcalc' or 'pltcalc'
+    :return: {thresh: [summary levels]}
+    """
+    index = load_index()
+    if COUNTRY_DICT[country] not in index:
+        index = build_cache([country])
+    return index[COUNTRY_DICT[country]].get(kind, {})
+
+
+if __name__ == '__main__':
+    index = build_cache()
+    print(json.dumps(index, indent=4))
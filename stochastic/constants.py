@@ -1,3 +1,8 @@
+import os
+
+# Folder of the stochastic data (the paths do not depend on the working directory)
+STOCHASTIC_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
 #Country and regions list
 COUNTRY_LIST = ['Ghana', 'Ivory Coast', 'Madagascar', 'Malawi', 'Mozambique', 'Togo'] # ['Ivory Coast', 'Madagascar', 'Malawi', 'Mozambique'] # ['Ghana', 'Ivory Coast', 'Madagascar', 'Malawi', 'Mozambique', 'Togo']
 
@@ -25,6 +30,15 @@ REGION_DICT = {
         ]
 }
 
+# Names of the ADM1 units of the impacts (see countries/*_adm_shapefile.zip) which differ from the regions of the
+# leccalc files (geogname1) beyond accents, case and punctuation (see query.normalize_region)
+REGION_NAME_MAPPING = {
+    'Ivory Coast': {
+        "District Autonome d'Abidjan": "Autonome d' Abidjan",
+        'District Autonome de Yamoussoukro': 'Autonome de Yamoussoukro',
+    },
+}
+
 AEP_THRESHOLDS = {
     'Ghana':
         ['ANA_20_GH_POP', 'ANA_21_GH_POP', 'ANA_22_GH_POP'],
@@ -58,4 +72,15 @@ YLT_THRESHOLDS = {
 SELECTED_RP = [2, 5, 20, 100]
 
 # Maximum number of rows for economic loss to be written in the JSON file
-N_ROWS = 100
\ No newline at end of file
+N_ROWS = 100
+
+# Folder of the parquet files converted from the csv files (see columnar.py)
+PARQUET_FOLDER = os.path.join(STOCHASTIC_FOLDER, 'parquet')
+
+# Folder of the generated JSON files (one sub-folder per country) and of their manifest
+JSONS_FOLDER = os.path.join(STOCHASTIC_FOLDER, 'jsons')
+MANIFEST_FILE = 'manifest.json'
+GENERATOR_VERSION = 1  # increment whenever the generators change, to generate the JSON files again
+
+# Folder of the sorted annual losses of the YLTs (see query.py)
+CURVES_FOLDER = os.path.join(STOCHASTIC_FOLDER, 'curves')
@@ -0,0 +1,118 @@
+import os
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from stochastic.constants import SELECTED_RP
+from stochastic.columnar import read_table
+
+from utils.logger import get_logger, configure_logging
+
+logger = get_logger(__name__)
+
+# type of the YLT rows to use, see YLT/README.txt
+SAMPLE_TYPE = '1_analytic_mean'
+
+
+def period_losses(df_plt, n_periods=None, region_column='geogname1', sample_type=SAMPLE_TYPE):
+    """
+    Aggregate a period loss table (pltcalc) into the total and the largest event loss of every region and period
+    :param df_plt: period loss table (event_id, period_no, loss, and region_column if any)
+    :param n_periods: number of simulated periods (years), inferred from the largest period_no if None (the periods
+    without loss are not in the table)
+    :param region_column: column of the regions, the whole table is one region ('all') if it is not in df_plt
+    :param sample_type: type of the rows to use, all the rows if None
+    :return: regions, aggregate losses and occurrence losses (arrays of shape regions x periods)
+    """
+
+    if sample_type is not None and 'type' in df_plt.columns:
+        df_plt = df_plt[df_plt['type'] == sample_type]
+
+    if region_column in df_plt.columns:
+        codes, regions = pd.factorize(df_plt[region_column])
+    else:
+        codes, regions = np.zeros(len(df_plt), dtype=int), pd.Index(['all'])
+
+    periods = df_plt['period_no'].to_numpy()
+    if n_periods is None:
+        n_periods = int(periods.max()) if len(periods) else 1
+
+    loss = df_plt['loss'].to_numpy(dtype=float)
+    cells = codes * n_periods + periods - 1
+
+    # all the regions at once, one cell per (region, period)
+    aggregate = np.bincount(cells, weights=loss, minlength=len(regions) * n_periods)
+    occurrence = np.zeros(len(regions) * n_periods)
+    np.maximum.at(occurrence, cells, loss)
+
+    return regions, aggregate.reshape(len(regions), n_periods), occurrence.reshape(len(regions), n_periods)
+
+
+def exceedance_losses(losses, return_periods):
+    """
+    Get the losses exceeded on average once every return period, from the losses of every period (one row per
+    region). The loss of rank n_periods / return_period (largest first) is interpolated linearly between ranks, and
+    clamped to the largest loss for return periods longer than the simulation
+    :param losses: array of shape regions x periods
+    :param return_periods:
+    :return: array of shape regions x return periods
+    """
+
+    n_periods = losses.shape[1]
+    losses_sorted = -np.sort(-losses, axis=1)
+
+    # (fractional) 0-based rank of each return period
+    ranks = np.clip(n_periods / np.asarray(return_periods, dtype=float) - 1, 0, n_periods - 1)
+    lower = np.floor(ranks).astype(int)
+    upper = np.minimum(lower + 1, n_periods - 1)
+    weight = ranks - lower
+
+    return losses_sorted[:, lower] * (1 - weight) + losses_sorted[:, upper] * weight
+
+
+def exceedance_curves(df_plt, return_periods=SELECTED_RP, n_periods=None, region_column='geogname1', sample_type=SAMPLE_TYPE):
+    """
+    Compute the average annual loss (AAL), and the aggregate (AEP) and occurrence (OEP) exceedance curves of every
+    region of a period loss table (pltcalc)
+    :param df_plt:
+    :param return_periods:
+    :param n_periods: see period_losses
+    :param region_column:
+    :param sample_type:
+    :return: dataframe with one row per region and return period (region, return_period, aal, aep_loss, oep_loss)
+    """
+
+    regions, aggregate, occurrence = period_losses(df_plt, n_periods=n_periods, region_column=region_column, sample_type=sample_type)
+
+    aep = exceedance_losses(aggregate, return_periods)
+    oep = exceedance_losses(occurrence, return_periods)
+    aal = aggregate.mean(axis=1)
+
+    return pd.DataFrame({
+        'region': np.repeat(np.asarray(regions), len(return_periods)),
+        'return_period': np.tile(return_periods, len(regions)),
+        'aal': np.repeat(aal, len(return_periods)),
+        'aep_loss': aep.ravel(),
+        'oep_loss': oep.ravel(),
+    })
+
+
+if __name__ == '__main__':
+
+    # e.g. python -m stochastic.exceedance stochastic/tgo/YLT/ANA_18_TG_GDP_gul_S2_pltcalc.csv -o curves.csv
+    parser = argparse.ArgumentParser(description='Compute the AAL and the AEP/OEP curves of period loss tables (pltcalc)')
+    parser.add_argument('files', help='Period loss tables', nargs='+')
+    parser.add_argument('-o', '--output_file', help='Output csv file (one row per table, region and return period)', type=str, required=True)
+    parser.add_argument('-rp', '--return_periods', help='Return periods (years)', type=float, nargs='+', default=SELECTED_RP)
+    args = parser.parse_args()
+
+    configure_logging()
+
+    df = pd.concat([
+        exceedance_curves(read_table(f_name), return_periods=args.return_periods).assign(file=os.path.basename(f_name))
+        for f_name in args.files
+    ], ignore_index=True)
+    df.to_csv(args.output_file, index=False)
+
+    logger.info(f'Exceedance curves of {len(args.files)} period loss tables written to {args.output_file}')
@@ -1,130 +1,303 @@
 import os
 import json
+import hashlib
+import argparse
+
+from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
 import numpy as np
 
-from constants import *
+from stochastic.constants import STOCHASTIC_FOLDER, COUNTRY_LIST, COUNTRY_DICT, AEP_THRESHOLDS, YLT_THRESHOLDS, N_ROWS, \
+    JSONS_FOLDER, MANIFEST_FILE, GENERATOR_VERSION
 
+from stochastic.columnar import read_table, build_cache
 
-def generate_aal_aep_people_impacted(country):
 
-    json_dict = {}
+def write_json(json_dict, json_file):
+    """
+    Write a JSON file atomically (to a temporary file first), so that a failed run never leaves a truncated file
+    :param json_dict:
+    :param json_file:
+    :return:
+    """
+    os.makedirs(os.path.dirname(json_file), exist_ok=True)
+    with open(f'{json_file}.tmp', 'w', encoding="utf-8") as f:
+        json.dump(json_dict, f, ensure_ascii=False, indent=4)
+    os.replace(f'{json_file}.tmp', json_file)
 
-    for i, thresh in enumerate(AEP_THRESHOLDS[country]):
 
-        json_dict[f'thresh_{i}'] = {}
+def leccalc_2_dict(df, region_column=None):
+    """
+    Pivot a leccalc AEP table (return period -> loss), by region if region_column is given
+    :param df:
+    :param region_column:
+    :return:
+    """
 
-        # Read the AEP (different return periods) for the country
-        rp_csv_country = os.path.join(COUNTRY_DICT[country], f'{thresh}_gul_S1_leccalc_wheatsheaf_aep.csv')
-        df_country = pd.read_csv(rp_csv_country).drop(columns=['countrycode', 'sidx'])
+    # the last row of a (region, return period) wins, as when the rows are read one by one
+    if region_column is None:
+        df = df.drop_duplicates(subset=['return_period'], keep='last')
+        return dict(zip(df['return_period'].astype(int).tolist(), df['loss'].astype(float).tolist()))
 
-        # Create the nested JSON structure
-        result = {}
-        for _, row in df_country.iterrows():
-            if row['return_period'] not in result:
-                result[int(row['return_period'])] = {}
-            result[row['return_period']] = row['loss']
+    df = df.drop_duplicates(subset=[region_column, 'return_period'], keep='last')
 
-        json_dict[f'thresh_{i}']['adm0'] = result
+    # regions (rows) and return periods (columns) in the order of the file
+    df_pivot = df.pivot(index=region_column, columns='return_period', values='loss')
+    df_pivot = df_pivot.reindex(index=df[region_column].unique(), columns=df['return_period'].unique())
 
-        # json_file = os.path.join(country_dict[country], f'population/aep_adm0_thresh_{i}.json')
-        #
-        # # Write the JSON data to the file
-        # with open(json_file, 'w') as f:
-        #     json.dump(result, f, indent=4)
+    return_periods = [str(int(return_period)) for return_period in df_pivot.columns]
+    losses = df_pivot.to_numpy(dtype=float)
+    available = ~np.isnan(losses)
 
-        # Read the AEP (different return periods)
-        rp_csv = os.path.join(COUNTRY_DICT[country], f'{thresh}_gul_S2_leccalc_wheatsheaf_aep.csv')
-        df = pd.read_csv(rp_csv).drop(columns=['sidx'])
+    return {
+        region: {return_period: loss for return_period, loss, ok in zip(return_periods, row.tolist(), row_available) if ok}
+        for region, row, row_available in zip(df_pivot.index, losses, available)
+    }
 
-        # Create the nested JSON structure
-        result = {}
-        for _, row in df.iterrows():
-            if row['geogname1'] not in result:
-                result[row['geogname1']] = {}
-            result[row['geogname1']][str(int(row['return_period']))] = row['loss']
 
-        json_dict[f'thresh_{i}']['adm1'] = result
+def generate_aal_aep_people_impacted(country, output_folder=JSONS_FOLDER):
 
-        # json_file = os.path.join(country_dict[country], f'population/aep_adm1_thresh_{i}.json')
-        #
-        # # Write the JSON data to the file
-        # with open(json_file, 'w') as f:
-        #     json.dump(result, f, indent=4)
+    json_dict = {}
 
-    json_file = os.path.join('jsons', COUNTRY_DICT[country], f'population.json')
+    for i, thresh in enumerate(AEP_THRESHOLDS[country]):
 
-    # Write the JSON data to the file
-    with open(json_file, 'w', encoding="utf-8") as f:
-        json.dump(json_dict, f, ensure_ascii=False, indent=4)
+        json_dict[f'thresh_{i}'] = {}
 
+        # Read the AEP (different return periods) for the country
+        rp_csv_country = os.path.join(STOCHASTIC_FOLDER, COUNTRY_DICT[country], f'{thresh}_gul_S1_leccalc_wheatsheaf_aep.csv')
+        df_country = read_table(rp_csv_country).drop(columns=['countrycode', 'sidx'])
 
-def generate_ylt_economic_loss(country, power_factor=2):
+        json_dict[f'thresh_{i}']['adm0'] = leccalc_2_dict(df_country)
 
-    json_dict = {}
+        # Read the AEP (different return periods)
+        rp_csv = os.path.join(STOCHASTIC_FOLDER, COUNTRY_DICT[country], f'{thresh}_gul_S2_leccalc_wheatsheaf_aep.csv')
+        df = read_table(rp_csv).drop(columns=['sidx'])
 
-    for i, thresh in enumerate(YLT_THRESHOLDS[country]):
+        json_dict[f'thresh_{i}']['adm1'] = leccalc_2_dict(df, region_column='geogname1')
 
-        json_dict[f'thresh_{i}'] = {}
+    json_file = os.path.join(output_folder, COUNTRY_DICT[country], f'population.json')
 
-        for adm_level, adm_file in enumerate([1, 2]):
+    # Write the JSON data to the file
+    write_json(json_dict, json_file)
 
-            json_dict[f'thresh_{i}'][f'adm{adm_level}'] = {}
+    return json_file
 
-            # Read the YLT for the country
-            f_name = os.path.join(COUNTRY_DICT[country], f'YLT/{thresh}_S{adm_file}_pltcalc.csv')
-            df_ylt_all = pd.read_csv(f_name)
 
-            # if geogname in columns, group by geogname first and apply the rest of the code
-            if 'geogname1' in df_ylt_all.columns:
-                regions = df_ylt_all['geogname1'].unique().tolist()
-            else:
-                regions = ['all']
+def ylt_2_compact_curves(df_ylt_all, power_factor=2, n_rows=N_ROWS):
+    """
+    Compact the loss distribution of each region of a YLT to n_rows points, with 'p' values distributed according to
+    a power function. All the regions are sorted in one pass, then interpolated on their (contiguous) slice
+    :param df_ylt_all:
+    :param power_factor:
+    :param n_rows:
+    :return: {region: (loss, p)}, with the single region 'all' if the YLT has no geogname1 column
+    """
 
-            for region in regions:
+    if 'geogname1' in df_ylt_all.columns:
+        codes, regions = pd.factorize(df_ylt_all['geogname1'])
+    else:
+        codes, regions = np.zeros(len(df_ylt_all), dtype=int), pd.Index(['all'])
 
-                if region != 'all':
-                    df_ylt = df_ylt_all[df_ylt_all['geogname1'] == region]
-                else:
-                    df_ylt = df_ylt_all
+    # sort by region, then by loss
+    loss = df_ylt_all['loss'].to_numpy()
+    order = np.lexsort((loss, codes))
+    loss_sorted = loss[order]
+    bounds = np.searchsorted(codes[order], np.arange(len(regions) + 1))
 
-                df_ylt_sorted = df_ylt.sort_values(by=['loss'])
-                loss_sorted = df_ylt_sorted['loss'].values
+    # Create 'p' values between 0 and 1 distributed according to a power function
+    p_values = np.linspace(0, 1, n_rows)
+    p_values = 1 - (1 - p_values) ** power_factor
 
-                df_ylt_sorted['p'] = 1.0 * np.arange(len(df_ylt_sorted)) / float(len(df_ylt_sorted) - 1)
+    curves = {}
+    for code, region in enumerate(regions):
+        loss_region = loss_sorted[bounds[code]:bounds[code + 1]]
+        p = 1.0 * np.arange(len(loss_region)) / float(len(loss_region) - 1)
+        curves[region] = (np.interp(p_values, p, loss_region), p_values)
 
-                # Create a new DataFrame with 'p' values distributed according to a power function
-                p_values = np.linspace(0, 1, N_ROWS)  # Create 'p' values between 0 and 1
-                p_values = 1 - (1 - p_values) ** power_factor  # Apply the power function
+    return curves
 
-                # Create a new DataFrame with equally spaced 'loss' values
-                compact_df = pd.DataFrame()
-                compact_df['p'] = p_values
-                compact_df['loss'] = np.interp(compact_df['p'], df_ylt_sorted['p'], df_ylt_sorted['loss'])
 
-                # Create a list of dictionaries
-                if region != 'all':
-                    json_dict[f'thresh_{i}'][f'adm{adm_level}'][region] = {}
-                    json_dict[f'thresh_{i}'][f'adm{adm_level}'][region]['loss'] = compact_df['loss'].values.tolist()
-                    json_dict[f'thresh_{i}'][f'adm{adm_level}'][region]['p'] = compact_df['p'].values.tolist()
-                else:
-                    json_dict[f'thresh_{i}'][f'adm{adm_level}'] = {}
-                    json_dict[f'thresh_{i}'][f'adm{adm_level}']['loss'] = compact_df['loss'].values.tolist()
-                    json_dict[f'thresh_{i}'][f'adm{adm_level}']['p'] = compact_df['p'].values.tolist()
-                    #json_dict[f'thresh_{i}']['adm0'] = [{'loss': loss, 'p': prob} for loss, prob in zip(loss_sorted, p)]
+def generate_ylt_economic_loss(country, power_factor=2, output_folder=JSONS_FOLDER):
 
-        # Define the output JSON file name
-        json_file = os.path.join('jsons', COUNTRY_DICT[country], f'economic.json')
+    json_dict = {}
 
-        # Write the list of dictionaries to the file
-        with open(json_file, 'w', encoding="utf-8") as f:
-            json.dump(json_dict, f, ensure_ascii=False, indent=4)
+    for i, thresh in enumerate(YLT_THRESHOLDS[country]):
 
+        json_dict[f'thresh_{i}'] = {}
 
+        for adm_level, adm_file in enumerate([1, 2]):
 
+            # Read the YLT for the country (not all the thresholds have both summary levels)
+            f_name = os.path.join(STOCHASTIC_FOLDER, COUNTRY_DICT[country], f'YLT/{thresh}_S{adm_file}_pltcalc.csv')
+            if not os.path.exists(f_name):
+                print(f'\033[33mMissing YLT for {country}: {os.path.relpath(f_name, STOCHASTIC_FOLDER)}\033[0m')
+                continue
+            df_ylt_all = read_table(f_name)
 
-for country in COUNTRY_LIST:
-    generate_aal_aep_people_impacted(country)
-    generate_ylt_economic_loss(country)
+            curves = ylt_2_compact_curves(df_ylt_all, power_factor=power_factor)
 
+            # Create a list of dictionaries
+            if 'geogname1' in df_ylt_all.columns:
+                json_dict[f'thresh_{i}'][f'adm{adm_level}'] = {
+                    region: {'loss': loss.tolist(), 'p': p.tolist()} for region, (loss, p) in curves.items()
+                }
+            else:
+                loss, p = curves['all']
+                json_dict[f'thresh_{i}'][f'adm{adm_level}'] = {'loss': loss.tolist(), 'p': p.tolist()}
+
+    # no economic data at all for the country
+    json_dict = {thresh: adm for thresh, adm in json_dict.items() if adm}
+    if not json_dict:
+        return None
+
+    # Define the output JSON file name (once all the thresholds are processed)
+    json_file = os.path.join(output_folder, COUNTRY_DICT[country], f'economic.json')
+
+    # Write the list of dictionaries to the file
+    write_json(json_dict, json_file)
+
+    return json_file
+
+
+def input_signature(country):
+    """
+    Get the signature of the input files of a country (paths, sizes and contents), of the parameters and of the version
+    of the generators, to tell if its JSON files must be generated again
+    :param country:
+    :return:
+    """
+
+    csv_files = []
+    for thresh in AEP_THRESHOLDS[country]:
+        for adm_file in [1, 2]:
+            csv_files.append(os.path.join(COUNTRY_DICT[country], f'{thresh}_gul_S{adm_file}_leccalc_wheatsheaf_aep.csv'))
+    for thresh in YLT_THRESHOLDS[country]:
+        for adm_file in [1, 2]:
+            csv_files.append(os.path.join(COUNTRY_DICT[country], f'YLT/{thresh}_S{adm_file}_pltcalc.csv'))
+
+    sha = hashlib.sha256(json.dumps({'n_rows': N_ROWS, 'version': GENERATOR_VERSION}).encode())
+    for csv_file in csv_files:
+        sha.update(csv_file.encode())
+        path = os.path.join(STOCHASTIC_FOLDER, csv_file)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                sha.update(f.read())
+        else:
+            sha.update(b'missing')
+
+    return sha.hexdigest()
+
+
+def load_manifest(output_folder=JSONS_FOLDER):
+    """
+    Load the signatures of the inputs of the JSON files of each country (see input_signature), and the JSON files
+    written for them
+    :param output_folder:
+    :return: {iso: {'signature': signature, 'outputs': [JSON file names]}}
+    """
+    manifest_file = os.path.join(output_folder, MANIFEST_FILE)
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file, 'r') as f:
+        return json.load(f)
+
+
+def outputs_valid(country, outputs, output_folder=JSONS_FOLDER):
+    """
+    Check that the JSON files written for a country exist and can be read (e.g. not deleted or truncated since the last
+    run)
+    :param country:
+    :param outputs: names of the JSON files written at the last run (see generate_country)
+    :param output_folder:
+    :return:
+    """
+    for output_file in outputs:
+        json_file = os.path.join(output_folder, COUNTRY_DICT[country], output_file)
+        try:
+            with open(json_file, 'r') as f:
+                json.load(f)
+        except (OSError, ValueError):
+            return False
+    return True
+
+
+def generate_country(country, output_folder=JSONS_FOLDER):
+    """
+    Generate the population and economic JSON files of a country (no economic file if the country has no YLT)
+    :param country:
+    :param output_folder:
+    :return: names of the JSON files written
+    """
+    json_files = [
+        generate_aal_aep_people_impacted(country, output_folder=output_folder),
+        generate_ylt_economic_loss(country, output_folder=output_folder),
+    ]
+    return [os.path.basename(json_file) for json_file in json_files if json_file is not None]
+
+
+def generate_countries(countries=COUNTRY_LIST, output_folder=JSONS_FOLDER, max_workers=None, force=False):
+    """
+    Generate the JSON files of the countries whose inputs or generators changed since the last run (see
+    input_signature), or whose JSON files are missing or corrupted, one country per process
+    :param countries:
+    :param output_folder:
+    :param max_workers: number of processes (number of CPUs if None)
+    :param force: generate all the countries, even if their inputs did not change
+    :return: the generated countries
+    """
+
+    # convert the new or modified csv files (see columnar.py), before the countries are processed in parallel
+    build_cache(countries)
+
+    manifest = load_manifest(output_folder)
+    signatures = {country: input_signature(country) for country in countries}
+    stale = []
+    for country in countries:
+        entry = manifest.get(COUNTRY_DICT[country])
+        if force or not isinstance(entry, dict) or entry.get('signature') != signatures[country] or \
+                not outputs_valid(country, entry.get('outputs', []), output_folder):
+            stale.append(country)
+
+    for country in countries:
+        if country not in stale:
+            print(f'{country}: \033[32mup to date\033[0m')
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {country: executor.submit(generate_country, country, output_folder) for country in stale}
+
+        generated = []
+        for country, future in futures.items():
+            try:
+                outputs = future.result()
+            except Exception as e:
+                print(f'{country}: \033[31mfailed ({e})\033[0m')
+                continue
+            manifest[COUNTRY_DICT[country]] = {'signature': signatures[country], 'outputs': outputs}
+            generated.append(country)
+            print(f'{country}: \033[32mgenerated\033[0m')
+
+    write_json(manifest, os.path.join(output_folder, MANIFEST_FILE))
+
+    return generated
+
+
+if __name__ == "__main__":
+
+    # e.g. python -m stochastic.generate_aal_aep_from_csv -c Togo Ghana
+    parser = argparse.ArgumentParser(description='Generate the AEP and economic loss JSON files of the stochastic data')
+    parser.add_argument('-c', '--countries', help='Countries (names or ISO codes)', nargs='+', default=COUNTRY_LIST)
+    parser.add_argument('-o', '--output_folder', help='Output folder (one sub-folder per country)', type=str, default=JSONS_FOLDER)
+    parser.add_argument('-w', '--max_workers', help='Number of processes', type=int, default=None)
+    parser.add_argument('-f', '--force', help='Generate all the countries, even if their inputs did not change', action='store_true')
+    args = parser.parse_args()
+
+    iso_dict = {iso: country for country, iso in COUNTRY_DICT.items()}
+    countries = [iso_dict.get(country, country) for country in args.countries]
+
+    generate_countries(
+        countries=countries,
+        output_folder=args.output_folder,
+        max_workers=args.max_workers,
+        force=args.force,
+    )
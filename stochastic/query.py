@@ -0,0 +1,285 @@
+import os
+import json
+import unicodedata
+
+from functools import lru_cache
+from typing import NamedTuple
+
+import numpy as np
+
+from stochastic.constants import STOCHASTIC_FOLDER, COUNTRY_DICT, AEP_THRESHOLDS, YLT_THRESHOLDS, CURVES_FOLDER, \
+    REGION_NAME_MAPPING
+from stochastic.columnar import read_table
+from stochastic.exceedance import period_losses
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# regions of the impacts without AEP curve, already reported (see population_return_periods)
+_UNMATCHED_REGIONS = set()
+
+
+def normalize_region(region):
+    """
+    Normalize the name of a region to match the impacts with the stochastic data: no accents, case, spaces or
+    punctuation (e.g. 'Denguélé' and 'Denguele', 'Vallée du Bandama' and 'Valleé du Bandama')
+    :param region:
+    :return:
+    """
+    decomposed = unicodedata.normalize('NFKD', str(region))
+    return ''.join(char for char in decomposed if char.isalnum() and not unicodedata.combining(char)).casefold()
+
+
+class LossCurves(NamedTuple):
+    """
+    Annual losses of every simulated period, sorted, for every region of a YLT (the whole country is the region 'all'),
+    answering the queries by binary search
+    """
+    regions: dict
+    losses: np.ndarray  # regions x periods, sorted in ascending order (memory-mapped)
+
+    @property
+    def n_periods(self) -> int:
+        return self.losses.shape[1]
+
+    def exceedance_probability(self, region, loss):
+        """
+        Probability that the annual loss of a region exceeds a loss
+        :param region:
+        :param loss: loss or array of losses
+        :return:
+        """
+        losses = self.losses[self.regions[region]]
+        return (self.n_periods - np.searchsorted(losses, loss, side='right')) / self.n_periods
+
+    def return_period(self, region, loss):
+        """
+        Return period (years) of an annual loss of a region, inf if it was never exceeded in the simulation
+        :param region:
+        :param loss: loss or array of losses
+        :return:
+        """
+        with np.errstate(divide='ignore'):
+            return 1 / self.exceedance_probability(region, loss)
+
+    def loss_at_probability(self, region, p):
+        """
+        Annual loss of a region exceeded with a probability (the loss of rank n_periods * p, largest first,
+        interpolated between ranks as in exceedance.exceedance_losses)
+        :param region:
+        :param p: probability or array of probabilities
+        :return:
+        """
+        losses = self.losses[self.regions[region]]
+        index = np.clip(self.n_periods - self.n_periods * np.asarray(p, dtype=float), 0, self.n_periods - 1)
+        return np.interp(index, np.arange(self.n_periods), losses)
+
+
+class AepCurves(NamedTuple):
+    """
+    AEP curves (loss at each return period) of every region of a leccalc file, as one array, so that the return
+    periods of the losses of many regions are interpolated at once. The regions are indexed by normalized name (see
+    normalize_region)
+    """
+    regions: dict
+    losses: np.ndarray  # regions x return periods, non-decreasing along the return periods
+    return_periods: np.ndarray
+
+    def return_period(self, regions, losses):
+        """
+        Return periods (years) of losses, interpolated linearly in log(return period) on the curve of their region.
+        A loss of 0 has a return period of 1 year, and a loss above the curve (or of an unknown region) gets nan
+        :param regions: region of each loss
+        :param losses:
+        :return: array of return periods
+        """
+
+        rows = np.array([self.regions.get(normalize_region(region), -1) for region in regions], dtype=int)
+        losses = np.asarray(losses, dtype=float)
+
+        # curves starting at (loss 0, return period 1), all the regions at once
+        curves = np.concatenate([np.zeros((len(self.regions), 1)), self.losses], axis=1)[np.maximum(rows, 0)]
+        log_rps = np.log(np.concatenate([[1.0], self.return_periods]))
+
+        # first point of the curve at or above the loss (the curves have few points)
+        upper = np.minimum((curves < losses[:, None]).sum(axis=1), curves.shape[1] - 1)
+        lower = np.maximum(upper - 1, 0)
+        loss_lower = np.take_along_axis(curves, lower[:, None], axis=1)[:, 0]
+        loss_upper = np.take_along_axis(curves, upper[:, None], axis=1)[:, 0]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = np.where(loss_upper > loss_lower, (losses - loss_lower) / (loss_upper - loss_lower), 1.0)
+        return_periods = np.exp(log_rps[lower] + np.clip(weight, 0, 1) * (log_rps[upper] - log_rps[lower]))
+
+        # beyond the curve, or unknown region
+        return_periods[(losses > curves[:, -1]) | (rows < 0)] = np.nan
+
+        return return_periods
+
+
+@lru_cache(maxsize=None)
+def load_aep_curves(country, thresh, summary=1):
+    """
+    Load the AEP curves of a leccalc file (kept in memory for the whole run)
+    :param country:
+    :param thresh:
+    :param summary: 1 (country, single region 'all') or 2 (regions)
+    :return: None if the file is missing
+    """
+
+    f_name = os.path.join(STOCHASTIC_FOLDER, COUNTRY_DICT[country], f'{thresh}_gul_S{summary}_leccalc_wheatsheaf_aep.csv')
+    if not os.path.exists(f_name):
+        return None
+
+    df = read_table(f_name)
+    if 'geogname1' in df.columns:
+        df = df.assign(region=df['geogname1'].astype(str))
+    else:
+        df = df.assign(region='all')
+
+    df_pivot = df.pivot_table(index='region', columns='return_period', values='loss', aggfunc='last').sort_index(axis=1)
+
+    # losses non-decreasing along the return periods (missing points take the previous loss)
+    losses = np.maximum.accumulate(np.nan_to_num(df_pivot.to_numpy(dtype=float)), axis=1)
+
+    return AepCurves(
+        regions={normalize_region(region): i for i, region in enumerate(df_pivot.index)},
+        losses=losses,
+        return_periods=df_pivot.columns.to_numpy(dtype=float),
+    )
+
+
+def curves_files(country, thresh, summary):
+    """
+    Get the files of the loss curves of a YLT (sorted losses and regions)
+    :param country:
+    :param thresh:
+    :param summary: 1 (country) or 2 (regions)
+    :return:
+    """
+    stem = os.path.join(CURVES_FOLDER, COUNTRY_DICT[country], f'{thresh}_S{summary}')
+    return f'{stem}.npy', f'{stem}.json'
+
+
+def build_loss_curves(country, thresh, summary):
+    """
+    Sort the annual losses of every region of a YLT (pltcalc) and store them, to be memory-mapped by load_loss_curves
+    :param country:
+    :param thresh:
+    :param summary: 1 (country) or 2 (regions)
+    :return: None if the YLT is missing
+    """
+
+    f_name = os.path.join(STOCHASTIC_FOLDER, COUNTRY_DICT[country], f'YLT/{thresh}_S{summary}_pltcalc.csv')
+    if not os.path.exists(f_name):
+        return None
+
+    regions, aggregate, _ = period_losses(read_table(f_name))
+    aggregate.sort(axis=1)
+
+    losses_file, regions_file = curves_files(country, thresh, summary)
+    os.makedirs(os.path.dirname(losses_file), exist_ok=True)
+    np.save(f'{losses_file}.tmp.npy', aggregate)
+    with open(f'{regions_file}.tmp', 'w', encoding='utf-8') as f:
+        json.dump([str(region) for region in regions], f, ensure_ascii=False)
+    os.replace(f'{losses_file}.tmp.npy', losses_file)
+    os.replace(f'{regions_file}.tmp', regions_file)
+
+    return losses_file
+
+
+@lru_cache(maxsize=None)
+def load_loss_curves(country, thresh, summary=1):
+    """
+    Load the loss curves of a YLT, built first if they are missing or older than the YLT
+    :param country:
+    :param thresh:
+    :param summary: 1 (country) or 2 (regions)
+    :return: None if the YLT is missing
+    """
+
+    f_name = os.path.join(STOCHASTIC_FOLDER, COUNTRY_DICT[country], f'YLT/{thresh}_S{summary}_pltcalc.csv')
+    losses_file, regions_file = curves_files(country, thresh, summary)
+
+    if not os.path.exists(losses_file) or (os.path.exists(f_name) and os.path.getmtime(losses_file) < os.path.getmtime(f_name)):
+        if build_loss_curves(country, thresh, summary) is None:
+            return None
+
+    with open(regions_file, 'r', encoding='utf-8') as f:
+        regions = {region: i for i, region in enumerate(json.load(f))}
+
+    return LossCurves(regions=regions, losses=np.load(losses_file, mmap_mode='r'))
+
+
+def economic_return_periods(iso, adm0_losses):
+    """
+    Get the return period of the economic losses of an observed event, for each depth band of the impacts, from the
+    country YLT of the matching threshold (band_1, band_5, band_11 <-> thresh_0, thresh_1, thresh_2)
+    :param iso: country code (e.g. 'tgo')
+    :param adm0_losses: {band: loss} of the whole country
+    :return: {band: return period (years), None if it was never exceeded in the simulation}, only for the bands with
+    a YLT
+    """
+
+    countries = {value: key for key, value in COUNTRY_DICT.items()}
+    if iso not in countries:
+        return {}
+    country = countries[iso]
+
+    return_periods = {}
+    for band, thresh in zip(['band_1', 'band_5', 'band_11'], YLT_THRESHOLDS[country]):
+        if band not in adm0_losses:
+            continue
+        curves = load_loss_curves(country, thresh, summary=1)
+        if curves is None:
+            continue
+        return_period = float(curves.return_period('all', adm0_losses[band]))
+        return_periods[band] = round(return_period, 1) if np.isfinite(return_period) else None
+
+    return return_periods
+
+
+def population_return_periods(iso, adm0, adm1):
+    """
+    Get the return periods of the population impacts of a day, for each depth band, from the AEP curves of the
+    matching threshold (band_1, band_5, band_11 <-> thresh_0, thresh_1, thresh_2)
+    :param iso: country code (e.g. 'tgo')
+    :param adm0: impacts of the country (dataframe with a column per band)
+    :param adm1: impacts of the ADM1 units (dataframe with ADM1_NAME and a column per band), matched with the regions
+    of the AEP curves by normalized name (see normalize_region and REGION_NAME_MAPPING)
+    :return: records of the return periods (years, None if above the curve or if the region has no curve) of adm0 and
+    adm1, None if the country has no AEP curves
+    """
+
+    countries = {value: key for key, value in COUNTRY_DICT.items()}
+    if iso not in countries:
+        return None
+    country = countries[iso]
+
+    adm0_rp = adm0[[column for column in adm0.columns if column.startswith('ADM')]].copy()
+    adm1_rp = adm1[['ADM1_NAME']].copy()
+
+    mapping = REGION_NAME_MAPPING.get(country, {})
+    adm1_regions = [mapping.get(region, region) for region in adm1['ADM1_NAME'].astype(str)]
+
+    for band, thresh in zip(['band_1', 'band_5', 'band_11'], AEP_THRESHOLDS[country]):
+        for df, df_rp, summary, regions in [
+            (adm0, adm0_rp, 1, ['all'] * len(adm0)),
+            (adm1, adm1_rp, 2, adm1_regions),
+        ]:
+            curves = load_aep_curves(country, thresh, summary)
+            if curves is None or band not in df.columns:
+                continue
+            for region in regions:
+                if normalize_region(region) not in curves.regions and (iso, region) not in _UNMATCHED_REGIONS:
+                    _UNMATCHED_REGIONS.add((iso, region))
+                    logger.warning(f'No AEP curve for the region {region} of {iso}, no return period', extra={'indent': 3})
+            return_periods = np.round(curves.return_period(regions, df[band].to_numpy(dtype=float)), 1)
+            # object column, so that the missing return periods stay None (null in the JSON files) instead of nan
+            df_rp[band] = np.array([None if np.isnan(return_period) else float(return_period) for return_period in return_periods], dtype=object)
+
+    return {
+        'adm0': adm0_rp.to_dict(orient='records'),
+        'adm1': adm1_rp.to_dict(orient='records'),
+    }
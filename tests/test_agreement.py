@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+import rasterio
+
+from rasterio.transform import from_origin
+
+from utils.mosaic import mosaic_max_tifs
+from utils.tif import EnsembleAgreement, agreement_2_tif, threshold_agreement_tif
+
+
+def synthetic_agreement(n_members: int = 100, seed: int = 0) -> EnsembleAgreement:
+    """
+    Agreement of an ensemble with every possible count of the most common depth value
+    :param n_members:
+    :param seed:
+    :return:
+    """
+    rng = np.random.default_rng(seed)
+    shape = (40, 50)
+    meta = {
+        'driver': 'GTiff',
+        'dtype': 'uint8',
+        'nodata': 0,
+        'count': 1,
+        'crs': 'EPSG:3857',
+        'transform': from_origin(0.0, 1_000_000.0, 100.0, 100.0),
+        'width': shape[1],
+        'height': shape[0],
+    }
+    most_common_depth = rng.integers(1, 212, size=shape).astype(np.uint8)
+    most_common_depth_count = (np.arange(shape[0] * shape[1]) % (n_members + 1)).reshape(shape).astype(np.uint8)
+    most_common_depth[most_common_depth_count == 0] = 0
+
+    return EnsembleAgreement(most_common_depth, most_common_depth_count, n_members, meta)
+
+
+@pytest.mark.parametrize('n_members', [7, 51, 100])
+def test_threshold_agreement_tif_matches_threshold(tmp_path, n_members):
+    agreement = synthetic_agreement(n_members)
+    tif_file = str(tmp_path / 'depth.tif')
+    agreement_2_tif(agreement.threshold(0.01), agreement.meta, tif_file, to_epsg_3857=False,
+                    agreement_percentage=agreement.percentage())
+
+    # 0.07 * 100 is not 7 in floating point
+    for threshold in [0.07, 0.29, 0.5, 0.57, 0.8, 1.0]:
+        output_file = str(tmp_path / f'depth_{threshold}.tif')
+        empty, max_band_value = threshold_agreement_tif(tif_file, output_file, threshold=threshold)
+
+        expected = agreement.threshold(threshold)
+        with rasterio.open(output_file) as src:
+            np.testing.assert_array_equal(src.read(1), expected)
+            np.testing.assert_array_equal(src.read(2), agreement.percentage())
+        assert empty == (not expected.any())
+        assert max_band_value == expected.max()
+
+
+def test_threshold_agreement_tif_in_place(tmp_path):
+    agreement = synthetic_agreement()
+    tif_file = str(tmp_path / 'depth.tif')
+    agreement_2_tif(agreement.threshold(0.01), agreement.meta, tif_file, to_epsg_3857=False,
+                    agreement_percentage=agreement.percentage())
+
+    threshold_agreement_tif(tif_file, tif_file, threshold=0.5)
+
+    with rasterio.open(tif_file) as src:
+        np.testing.assert_array_equal(src.read(1), agreement.threshold(0.5))
+
+
+def test_threshold_agreement_tif_requires_agreement_band(tmp_path):
+    agreement = synthetic_agreement()
+    tif_file = str(tmp_path / 'depth.tif')
+    agreement_2_tif(agreement.threshold(0.5), agreement.meta, tif_file, to_epsg_3857=False)
+
+    with pytest.raises(ValueError):
+        threshold_agreement_tif(tif_file, str(tmp_path / 'output.tif'), threshold=0.8)
+
+
+def test_mosaic_keeps_agreement_of_max_depth(tmp_path):
+    tifs_list = []
+    for seed in range(3):
+        agreement = synthetic_agreement(seed=seed)
+        tif_file = str(tmp_path / f'depth_{seed}.tif')
+        agreement_2_tif(agreement.threshold(0.01), agreement.meta, tif_file, to_epsg_3857=False,
+                        agreement_percentage=agreement.percentage())
+        tifs_list.append(tif_file)
+
+    output_file = str(tmp_path / 'max_depth.tif')
+    mosaic_max_tifs(tifs_list, output_file, tile_size=16)
+
+    depths, percentages = [], []
+    for tif in tifs_list:
+        with rasterio.open(tif) as src:
+            depths.append(src.read(1))
+            percentages.append(src.read(2))
+    depths, percentages = np.stack(depths), np.stack(percentages)
+
+    # highest agreement among the files with the max depth
+    depth_max = depths.max(axis=0)
+    expected = np.where(depths == depth_max, percentages, 0).max(axis=0)
+
+    with rasterio.open(output_file) as src:
+        assert src.count == 2
+        np.testing.assert_array_equal(src.read(1), depth_max)
+        np.testing.assert_array_equal(src.read(2), expected)
@@ -0,0 +1,51 @@
+import os
+
+import numpy as np
+import pytest
+import rasterio
+
+from benchmarks.benchmark_mosaic import write_synthetic_tif
+from utils.artifacts import place_file
+from utils.tif import reproject_tif, reproject_geotiff, threshold_agreement_tif, EnsembleAgreement, agreement_2_tif
+
+
+def read_bytes(file_path: str) -> bytes:
+    with open(file_path, 'rb') as fp:
+        return fp.read()
+
+
+@pytest.mark.parametrize('rewrite', [
+    lambda tif_file: reproject_tif(tif_file, to_crs='EPSG:4326'),
+    lambda tif_file: reproject_geotiff(tif_file, max_resolution=50),
+])
+def test_rewrite_keeps_placed_file(tmp_path, rewrite):
+    tif_file = str(tmp_path / 'depth.tif')
+    write_synthetic_tif(tif_file, width=100, height=100, res=100.0, left=0.0, top=1_000_000.0, seed=0)
+
+    placed_file = str(tmp_path / 'placed.tif')
+    assert place_file(tif_file, placed_file, mode='hardlink') == 'hardlink'
+    content = read_bytes(placed_file)
+
+    rewrite(tif_file)
+
+    assert read_bytes(placed_file) == content
+    assert not os.path.samefile(tif_file, placed_file)
+    assert not os.path.exists(f'{tif_file}.tmp')
+
+
+def test_threshold_agreement_keeps_placed_file(tmp_path):
+    shape = (20, 30)
+    meta = {'driver': 'GTiff', 'dtype': 'uint8', 'nodata': 0, 'count': 1, 'crs': 'EPSG:3857',
+            'transform': rasterio.transform.from_origin(0.0, 1_000_000.0, 100.0, 100.0), 'width': shape[1], 'height': shape[0]}
+    count = (np.arange(shape[0] * shape[1]) % 5).reshape(shape).astype(np.uint8)
+    agreement = EnsembleAgreement(np.where(count > 0, 10, 0).astype(np.uint8), count, 4, meta)
+
+    tif_file = str(tmp_path / 'depth.tif')
+    agreement_2_tif(agreement.threshold(0.25), meta, tif_file, to_epsg_3857=False, agreement_percentage=agreement.percentage())
+    placed_file = str(tmp_path / 'placed.tif')
+    place_file(tif_file, placed_file, mode='hardlink')
+    content = read_bytes(placed_file)
+
+    threshold_agreement_tif(tif_file, tif_file, threshold=0.75)
+
+    assert read_bytes(placed_file) == content
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from stochastic.exceedance import period_losses, exceedance_losses, exceedance_curves
+
+
+def period_loss_table() -> pd.DataFrame:
+    """
+    Period loss table of 10 periods and 2 regions, the periods 3, 6 and 9 without loss in region a
+    :return:
+    """
+    rows = [
+        # region, period_no, loss
+        ('a', 1, 10.0), ('a', 1, 5.0),
+        ('a', 2, 30.0),
+        ('a', 4, 20.0), ('a', 4, 20.0), ('a', 4, 20.0),
+        ('a', 5, 1.0),
+        ('a', 7, 50.0),
+        ('a', 8, 8.0), ('a', 8, 4.0),
+        ('a', 10, 100.0),
+        ('b', 3, 7.0),
+    ]
+    df = pd.DataFrame(rows, columns=['geogname1', 'period_no', 'loss'])
+    df['event_id'] = np.arange(len(df)) + 1
+    df['type'] = '1_analytic_mean'
+
+    # other samples of the same events are ignored
+    df_sample = df.assign(type='2_sample_mean', loss=df['loss'] * 1000)
+
+    return pd.concat([df, df_sample], ignore_index=True)
+
+
+def test_period_losses():
+    regions, aggregate, occurrence = period_losses(period_loss_table())
+
+    assert list(regions) == ['a', 'b']
+    np.testing.assert_array_equal(aggregate[0], [15, 30, 0, 60, 1, 0, 50, 12, 0, 100])
+    np.testing.assert_array_equal(occurrence[0], [10, 30, 0, 20, 1, 0, 50, 8, 0, 100])
+    np.testing.assert_array_equal(aggregate[1], [0, 0, 7, 0, 0, 0, 0, 0, 0, 0])
+
+
+def test_exceedance_losses():
+    # sorted, largest first: 100, 60, 50, 30, 15, 12, 1, 0, 0, 0
+    aggregate = np.array([[15, 30, 0, 60, 1, 0, 50, 12, 0, 100]], dtype=float)
+
+    # rank 10 / return period - 1, interpolated between ranks and clamped to the largest loss
+    losses = exceedance_losses(aggregate, [1, 2, 4, 5, 10, 20])
+    np.testing.assert_allclose(losses, [[0, 15, 55, 60, 100, 100]])
+
+
+def test_exceedance_curves():
+    df = exceedance_curves(period_loss_table(), return_periods=[2, 5, 10])
+    df = df.set_index(['region', 'return_period'])
+
+    assert df.loc[('a', 2), 'aal'] == pytest.approx(26.8)
+    assert df.loc[('b', 2), 'aal'] == pytest.approx(0.7)
+    assert df.loc['a', 'aep_loss'].tolist() == [15, 60, 100]
+    assert df.loc['a', 'oep_loss'].tolist() == [10, 50, 100]
+    assert df.loc['b', 'aep_loss'].tolist() == [0, 0, 7]
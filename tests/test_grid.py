@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+import rasterio
+
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
+
+from benchmarks.benchmark_mosaic import write_synthetic_tif
+from utils.grid import CountryGrid
+from utils.mosaic import mosaic_max_tifs
+from utils.tif import open_aligned
+
+
+def synthetic_grid(tile_size: int = 64) -> CountryGrid:
+    """
+    Grid of 300x400 pixels of 100 m, the forecasts grid being the same (in EPSG:3857 too)
+    :param tile_size:
+    :return:
+    """
+    transform = from_origin(0.0, 1_000_000.0, 100.0, 100.0)
+    return CountryGrid(country='xyz', src_crs='EPSG:3857', src_transform=transform, src_width=400, src_height=300,
+                       crs='EPSG:3857', transform=transform, width=400, height=300, tile_size=tile_size)
+
+
+def test_window_snapped_outwards_and_clipped():
+    grid = synthetic_grid()
+
+    # pixel edges, with rounding errors
+    assert grid.window((1_000.0 + 1e-9, 990_000.0, 2_000.0 - 1e-9, 995_000.0)) == Window(10, 50, 10, 50)
+    # inside pixels
+    assert grid.window((1_050.0, 990_050.0, 1_950.0, 994_950.0)) == Window(10, 50, 10, 50)
+    # partly outside of the grid
+    assert grid.window((-1_000.0, 990_000.0, 1_000.0, 1_010_000.0)) == Window(0, 0, 10, 100)
+
+
+def test_tile_windows_cover_the_grid():
+    grid = synthetic_grid(tile_size=64)
+    coverage = np.zeros((grid.height, grid.width), dtype=int)
+    for window in grid.tile_windows():
+        coverage[window.toslices()] += 1
+
+    assert (coverage == 1).all()
+
+
+def test_open_aligned_offset_matches_warp(tmp_path):
+    grid = synthetic_grid()
+    meta_ref = grid.meta()
+
+    # a member on the pixels of the grid, overlapping its bottom right corner
+    tif_file = str(tmp_path / 'member.tif')
+    write_synthetic_tif(tif_file, width=120, height=80, res=100.0, left=32_000.0, top=980_000.0, seed=0)
+
+    window = Window(200, 150, 200, 150)
+    with open_aligned(tif_file, meta_ref) as src:
+        assert not isinstance(src, WarpedVRT)
+        array = src.read(1, window=window)
+
+    with rasterio.open(tif_file) as src, WarpedVRT(src, crs=meta_ref['crs'], transform=meta_ref['transform'],
+                                                   width=meta_ref['width'], height=meta_ref['height'],
+                                                   resampling=Resampling.nearest) as vrt:
+        np.testing.assert_array_equal(array, vrt.read(1, window=window))
+
+
+@pytest.mark.parametrize('tile_size', [64, 1024])
+def test_mosaic_on_grid(tmp_path, tile_size):
+    grid = synthetic_grid(tile_size=tile_size)
+    tifs_list = []
+    for i in range(3):
+        tif_file = str(tmp_path / f'depth_{i}.tif')
+        write_synthetic_tif(tif_file, width=grid.width, height=grid.height, res=100.0, left=0.0, top=1_000_000.0, seed=i)
+        tifs_list.append(tif_file)
+
+    output_file = str(tmp_path / 'mosaic.tif')
+    bounds = mosaic_max_tifs(tifs_list, output_file, grid=grid)
+
+    arrays = []
+    for tif in tifs_list:
+        with rasterio.open(tif) as src:
+            arrays.append(src.read(1))
+    with rasterio.open(output_file) as src:
+        assert grid.is_aligned(src)
+        np.testing.assert_allclose(bounds, src.bounds)
+        np.testing.assert_array_equal(src.read(1), np.max(arrays, axis=0))
+
+
+def test_mosaic_off_grid_falls_back_to_union(tmp_path):
+    grid = synthetic_grid()
+    tifs_list = [str(tmp_path / 'depth_0.tif'), str(tmp_path / 'depth_1.tif')]
+    write_synthetic_tif(tifs_list[0], width=grid.width, height=grid.height, res=100.0, left=0.0, top=1_000_000.0, seed=0)
+    write_synthetic_tif(tifs_list[1], width=50, height=50, res=100.0, left=40_000.0, top=1_000_000.0, seed=1)
+
+    output_file = str(tmp_path / 'mosaic.tif')
+    mosaic_max_tifs(tifs_list, output_file, grid=grid)
+
+    with rasterio.open(output_file) as src:
+        assert src.shape == (grid.height, grid.width + 50)
@@ -0,0 +1,50 @@
+import io
+import json
+
+from utils.logger import configure_logging, get_logger, COLORS, RESET
+
+
+def log_lines(json_output: bool = False, color: bool = False) -> list[str]:
+    """
+    Log a few messages of the pipeline and get the output lines
+    :param json_output:
+    :param color: as if written to a terminal
+    :return:
+    """
+    stream = io.StringIO()
+    stream.isatty = lambda: color
+    configure_logging(json_output=json_output, stream=stream)
+
+    logger = get_logger(__name__)
+    logger.info('Processing data for tgo...')
+    logger.info('Copied depth.tif... ', extra={'indent': 4, 'color': 'blue'})
+    logger.info('Not empty? ✔', extra={'indent': 3})
+    logger.warning('No data available for this date')
+
+    configure_logging()
+    return stream.getvalue().splitlines()
+
+
+def test_text_without_colors():
+    assert log_lines() == [
+        'Processing data for tgo...',
+        '\t\t\t\tCopied depth.tif... ',
+        '\t\t\tNot empty? ✔',
+        'No data available for this date',
+    ]
+
+
+def test_text_with_colors():
+    lines = log_lines(color=True)
+
+    assert lines[1] == f'\t\t\t\t{COLORS["blue"]}Copied depth.tif... {RESET}'
+    assert lines[2] == f'\t\t\tNot empty? {COLORS["green"]}✔{RESET}'
+    assert lines[3] == f'{COLORS["red"]}No data available for this date{RESET}'
+
+
+def test_json_without_indentation():
+    entries = [json.loads(line) for line in log_lines(json_output=True)]
+
+    assert [entry['message'] for entry in entries][1:3] == ['Copied depth.tif...', 'Not empty? ✔']
+    assert entries[3]['level'] == 'WARNING'
+    assert 'indent' not in entries[1] and 'color' not in entries[1]
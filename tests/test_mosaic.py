@@ -0,0 +1,142 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+import rasterio
+
+from rasterio.transform import from_origin
+from rasterio.warp import transform_bounds
+
+from benchmarks.benchmark_mosaic import write_synthetic_tif, merge_tifs_full_canvas
+from utils.mosaic import union_grid, mosaic_max_tifs
+
+
+def write_grids(folder: str, resolutions: list[float], size: int = 240) -> list[str]:
+    """
+    Write synthetic depth maps with shifted extents, covering the same area whatever their resolution
+    :param folder:
+    :param resolutions: resolution of each depth map (multiples of the finest one)
+    :param size: width and height at the finest resolution, in pixels
+    :return:
+    """
+
+    tifs_list = []
+    for i, res in enumerate(resolutions):
+        tif_file = os.path.join(folder, f'depth_{i}.tif')
+        n_pixels = int(size * min(resolutions) / res)
+        write_synthetic_tif(tif_file, width=n_pixels, height=n_pixels, res=res, left=i * 4_000.0,
+                            top=1_000_000.0 - i * 2_000.0, seed=i)
+        tifs_list.append(tif_file)
+
+    return tifs_list
+
+
+def numpy_mosaic(tifs_list: list[str]) -> np.ndarray:
+    """
+    Reference mosaic for resolutions multiple of the finest one: the coarse pixels are repeated (nearest neighbour)
+    :param tifs_list:
+    :return:
+    """
+
+    grid = union_grid(tifs_list)
+    transform = grid['transform']
+    array_max = np.zeros((grid['height'], grid['width']), dtype=grid['dtype'])
+    for tif in tifs_list:
+        with rasterio.open(tif) as src:
+            factor = int(round(src.res[0] / transform.a))
+            array = np.repeat(np.repeat(src.read(1), factor, axis=0), factor, axis=1)
+            row_off = int(round((transform.f - src.bounds.top) / -transform.e))
+            col_off = int(round((src.bounds.left - transform.c) / transform.a))
+            block = np.s_[row_off:row_off + array.shape[0], col_off:col_off + array.shape[1]]
+            array_max[block] = np.maximum(array_max[block], array)
+
+    return array_max
+
+
+def edges(tifs_list: list[str]) -> np.ndarray:
+    """
+    Pixels of the mosaic next to a change of value, where resampling the coarse depth maps bilinearly (as the previous
+    merge_tifs did) and with the nearest neighbour may differ
+    :param tifs_list:
+    :return: boolean array of the shape of the mosaic
+    """
+
+    array = numpy_mosaic(tifs_list)
+    changed = np.zeros(array.shape, dtype=bool)
+    changed[1:, :] |= array[1:, :] != array[:-1, :]
+    changed[:, 1:] |= array[:, 1:] != array[:, :-1]
+
+    # within two fine pixels of the changes
+    padded = np.pad(changed, 2)
+    height, width = changed.shape
+    near = np.zeros(changed.shape, dtype=bool)
+    for i in range(5):
+        for j in range(5):
+            near |= padded[i:i + height, j:j + width]
+
+    return near
+
+
+@pytest.mark.parametrize('resolutions', [[100.0] * 4, [100.0, 200.0] * 2, [100.0, 400.0, 100.0, 200.0]])
+@pytest.mark.parametrize('tile_size', [64, 1024])
+def test_mosaic_matches_numpy_reference(tmp_path, resolutions, tile_size):
+    tifs_list = write_grids(str(tmp_path), resolutions)
+    output_file = str(tmp_path / 'mosaic.tif')
+
+    mosaic_max_tifs(tifs_list, output_file, tile_size=tile_size)
+
+    with rasterio.open(output_file) as src:
+        np.testing.assert_array_equal(src.read(1), numpy_mosaic(tifs_list))
+
+
+@pytest.mark.parametrize('resolutions', [[100.0] * 4, [100.0, 200.0] * 2])
+def test_mosaic_matches_merge_tifs(tmp_path, resolutions):
+    tifs_list = write_grids(str(tmp_path), resolutions)
+    output_file = str(tmp_path / 'mosaic.tif')
+    bounds = mosaic_max_tifs(tifs_list, output_file, tile_size=64)
+
+    # the previous merge_tifs resamples the coarse files in place
+    os.makedirs(tmp_path / 'reference')
+    reference_files = [shutil.copy(tif, tmp_path / 'reference') for tif in tifs_list]
+    reference_file = str(tmp_path / 'reference.tif')
+    reference_bounds = merge_tifs_full_canvas(reference_files, reference_file)
+
+    np.testing.assert_allclose(bounds, reference_bounds)
+    with rasterio.open(output_file) as src, rasterio.open(reference_file) as ref:
+        assert src.shape == ref.shape
+        assert src.transform.almost_equals(ref.transform)
+        array, array_ref = src.read(1), ref.read(1)
+
+    if len(set(resolutions)) == 1:
+        np.testing.assert_array_equal(array, array_ref)
+    else:
+        # identical away from the edges of the coarse depth maps
+        different = array != array_ref
+        assert not (different & ~edges(tifs_list)).any()
+
+
+def test_union_grid_transforms_other_crs(tmp_path):
+    tif_3857 = str(tmp_path / 'depth_3857.tif')
+    write_synthetic_tif(tif_3857, width=100, height=100, res=100.0, left=0.0, top=1_000_000.0, seed=0)
+
+    # the same area, in degrees
+    tif_4326 = str(tmp_path / 'depth_4326.tif')
+    with rasterio.open(tif_4326, 'w', driver='GTiff', width=100, height=100, count=1, dtype='uint8', nodata=0,
+                       crs='EPSG:4326', transform=from_origin(0.0, 8.9932, 0.001, 0.001)) as dst:
+        dst.write(np.full((100, 100), 5, dtype=np.uint8), 1)
+
+    grid = union_grid([tif_3857, tif_4326])
+
+    # the resolution of the file in degrees is ignored, and its bounds are in meters
+    assert grid['crs'] == 'EPSG:3857'
+    assert (grid['transform'].a, -grid['transform'].e) == (100.0, 100.0)
+    left, _, right, top = transform_bounds('EPSG:4326', 'EPSG:3857', 0.0, 8.8932, 0.1, 8.9932)
+    assert (grid['transform'].c, grid['transform'].f) == (left, pytest.approx(top))
+    assert grid['width'] == round((right - left) / 100.0)
+
+    output_file = str(tmp_path / 'mosaic.tif')
+    mosaic_max_tifs([tif_3857, tif_4326], output_file)
+    with rasterio.open(output_file) as src:
+        assert src.crs == 'EPSG:3857'
+        assert (src.read(1) == 5).sum() > 0
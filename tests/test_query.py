@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from stochastic.exceedance import exceedance_losses
+from stochastic.query import LossCurves, AepCurves, normalize_region
+
+
+def loss_curves() -> LossCurves:
+    """
+    Annual losses of 10 periods of the whole country
+    :return:
+    """
+    losses = np.sort(np.array([15, 30, 0, 60, 1, 0, 50, 12, 0, 100], dtype=float))
+    return LossCurves(regions={'all': 0}, losses=losses[None, :])
+
+
+def test_loss_curves_return_period():
+    curves = loss_curves()
+
+    # exceeded by 100 and 60 only
+    assert curves.return_period('all', 50) == pytest.approx(5)
+    # exceeded by all the periods with a loss
+    assert curves.return_period('all', 0) == pytest.approx(10 / 7)
+    assert curves.return_period('all', 100) == np.inf
+    np.testing.assert_allclose(curves.exceedance_probability('all', [0.5, 30, 99]), [0.7, 0.3, 0.1])
+
+
+def test_loss_curves_loss_at_probability():
+    curves = loss_curves()
+
+    np.testing.assert_allclose(curves.loss_at_probability('all', [0.1, 0.2, 0.25, 0.5, 1.0]), [100, 60, 55, 15, 0])
+
+    # same losses as the exceedance curves
+    return_periods = np.array([1, 2, 4, 5, 10])
+    np.testing.assert_allclose(curves.loss_at_probability('all', 1 / return_periods),
+                               exceedance_losses(curves.losses, return_periods)[0])
+
+
+def test_aep_curves_return_period():
+    curves = AepCurves(
+        regions={normalize_region('Abidjan'): 0, normalize_region('Denguélé'): 1},
+        losses=np.array([[10, 20, 40], [5, 5, 50]], dtype=float),
+        return_periods=np.array([2, 10, 100], dtype=float),
+    )
+
+    regions = ['Abidjan', 'ABIDJAN', 'Abidjan', 'Abidjan', 'Abidjan', 'Denguele', 'Unknown']
+    losses = [0, 10, 15, 40, 41, 5, 10]
+    return_periods = curves.return_period(regions, losses)
+
+    # log-linear between (10, 2 years) and (20, 10 years)
+    np.testing.assert_allclose(return_periods[:4], [1, 2, np.sqrt(20), 100])
+    # above the curve
+    assert np.isnan(return_periods[4])
+    # first point of the curve reaching the loss
+    assert return_periods[5] == pytest.approx(2)
+    assert np.isnan(return_periods[6])
@@ -0,0 +1,41 @@
+import numpy as np
+
+from utils.summary import append_daily_summary, read_daily_summary, load_daily_summary
+
+
+def test_read_daily_summary_latest(tmp_path):
+    summary_file = str(tmp_path / 'summary.csv')
+    stem = 'for_tgo_ts_rd20230101T0000Z_fe20230101T0000Z_'
+
+    append_daily_summary(summary_file, stem, n_members=3, max_count=np.array([0, 1, 2]))
+    append_daily_summary(summary_file, stem, n_members=5, max_count=np.array([0, 4, 5]))
+
+    n_members, max_count = read_daily_summary(summary_file, stem)
+    assert n_members == 5
+    np.testing.assert_array_equal(max_count, [0, 4, 5])
+    assert read_daily_summary(summary_file, 'for_tgo_ts_rd20230102T0000Z_fe20230102T0000Z_') is None
+
+
+def test_read_daily_summary_from_previous_runs(tmp_path):
+    summary_file = str(tmp_path / 'summary.csv')
+    with open(summary_file, 'w') as fp:
+        fp.write('stem,n_members,band_0,band_1\n')
+        fp.write('for_tgo_ts_rd20230101T0000Z_fe20230101T0000Z_,2,0,1\n')
+        fp.write('for_tgo_ts_rd20230101T0000Z_fe20230101T0000Z_,4,0,3\n')
+
+    n_members, max_count = read_daily_summary(summary_file, 'for_tgo_ts_rd20230101T0000Z_fe20230101T0000Z_')
+    assert n_members == 4
+    np.testing.assert_array_equal(max_count, [0, 3])
+
+
+def test_load_daily_summary_dates(tmp_path):
+    summary_file = str(tmp_path / 'summary.csv')
+    # 'fe' and 'rd' may also appear in the prefix of the file names
+    for stem in ['ref_tgo_rd_rd20230102T0000Z_fe20230102T0000Z_', 'ref_tgo_rd_rd20230101T0000Z_fe20230101T0000Z_',
+                 'ref_tgo_rd_rd20230101T0000Z_fe20230103T0000Z_']:
+        append_daily_summary(summary_file, stem, n_members=2, max_count=np.array([0, 1]))
+
+    df = load_daily_summary(summary_file)
+    assert df['rd'].tolist() == ['20230101', '20230102']
+    assert df['fe'].tolist() == ['20230101', '20230102']
+    assert len(load_daily_summary(summary_file, day_0=False)) == 3
@@ -0,0 +1,129 @@
+import os
+import shutil
+import fcntl
+
+from constants.constants import DATA_FOLDER, ARTIFACT_PLACEMENT, BUFFER_FOLDER, DEPTH_CACHE_FOLDER
+
+# ioctl request to clone a file on copy-on-write filesystems (btrfs, xfs), see linux/fs.h
+FICLONE = 0x40049409
+
+
+def reflink(src: str, dst: str) -> None:
+    """
+    Copy a file by sharing its blocks (copy-on-write), raise OSError if the filesystem does not support it
+    :param src:
+    :param dst:
+    :return:
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+
+
+def is_transient(file_path: str) -> bool:
+    """
+    Check whether a file is removed by the pipeline later on (buffer files, depth cache entries), so that it must not
+    be the target of a symlink
+    :param file_path:
+    :return:
+    """
+    file_path = os.path.abspath(file_path)
+    return BUFFER_FOLDER in file_path.split(os.sep) or \
+        os.path.commonpath([file_path, os.path.abspath(DEPTH_CACHE_FOLDER)]) == os.path.abspath(DEPTH_CACHE_FOLDER)
+
+
+def detach(file_path: str) -> None:
+    """
+    Remove a file before it is rewritten if it shares its content with other files (hardlinks) or was placed read-only
+    (see place_file), so that rewriting it does not modify the other files
+    :param file_path:
+    :return:
+    """
+    if os.path.lexists(file_path) and (os.path.islink(file_path) or os.stat(file_path).st_nlink > 1 or not os.access(file_path, os.W_OK)):
+        os.remove(file_path)
+
+
+def place_file(src: str, dst: str, mode: str = ARTIFACT_PLACEMENT) -> str:
+    """
+    Place a file at a destination without copying its content whenever possible: hardlink, reflink or symlink (which
+    depends on the source not being removed, so transient sources are copied instead, see is_transient), falling back
+    to a copy (e.g. across filesystems). The placed content is never modified: the raster writers replace their output
+    (temporary file and os.replace, see utils.tif) and the other writers detach it first (see detach). The permissions
+    are left as they are, as a hardlink shares them with its source
+    :param src:
+    :param dst:
+    :param mode: 'hardlink', 'reflink', 'symlink' or 'copy'
+    :return: the placement used
+    """
+
+    fallbacks = {
+        'hardlink': ['hardlink', 'reflink', 'copy'],
+        'reflink': ['reflink', 'copy'],
+        'symlink': ['copy'] if is_transient(src) else ['symlink', 'copy'],
+        'copy': ['copy'],
+    }[mode]
+
+    # already placed (renaming a hardlink onto the same file would do nothing)
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return 'hardlink'
+
+    # place under a temporary name first, then replace the destination
+    tmp_dst = f'{dst}.tmp'
+    if os.path.lexists(tmp_dst):
+        os.remove(tmp_dst)
+
+    for placement in fallbacks:
+        if placement == 'copy':
+            shutil.copy(src, tmp_dst)
+            break
+        try:
+            if placement == 'hardlink':
+                os.link(src, tmp_dst)
+            elif placement == 'reflink':
+                reflink(src, tmp_dst)
+            else:
+                os.symlink(os.path.abspath(src), tmp_dst)
+            break
+        except OSError:
+            continue
+
+    os.replace(tmp_dst, dst)
+
+    return placement
+
+
+def disk_usage_report(root: str = DATA_FOLDER) -> dict:
+    """
+    Get the disk usage of a folder, counting the files sharing their content (hardlinks) only once
+    :param root:
+    :return:
+    """
+
+    n_files = 0
+    n_shared = 0
+    apparent_size = 0
+    inodes = {}
+
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            stat = os.lstat(os.path.join(dirpath, filename))
+            n_files += 1
+            apparent_size += stat.st_size
+            if stat.st_nlink > 1:
+                n_shared += 1
+            inodes[(stat.st_dev, stat.st_ino)] = stat.st_blocks * 512
+
+    disk_size = sum(inodes.values())
+
+    return {
+        'root': root,
+        'n_files': n_files,
+        'n_shared_files': n_shared,
+        'apparent_size_gb': round(apparent_size / 1024 ** 3, 3),
+        'disk_size_gb': round(disk_size / 1024 ** 3, 3),
+        'saved_gb': round(max(apparent_size - disk_size, 0) / 1024 ** 3, 3),
+    }
@@ -0,0 +1,142 @@
+import os
+import time
+
+from utils.filename import FileRecord, parse_filename
+
+# coarsest timestamp resolution of the filesystems (e.g. 2 s on FAT), see BufferIndex.refresh
+MTIME_RESOLUTION_NS = 2 * 10 ** 9
+
+
+class BufferIndex:
+    """
+    Index of the files of a folder by run date and forecast date. The names are parsed once (see utils.filename), and
+    the index is only refreshed (parsing the new names only) when the folder has changed since the last refresh
+    """
+
+    def __init__(self, folder: str, country: str = None):
+        self.folder = folder
+        self.country = country
+        self._mtime = None
+        self._listed = None
+        self._records = {}
+        self._malformed = {}
+        # insertion ordered dicts used as ordered sets, so that the files come in the order of os.listdir
+        self._by_rd = {}
+        self._by_rd_fe = {}
+
+    def _add(self, file: str) -> None:
+        record = parse_filename(file, country=self.country)
+        if record is None:
+            self._malformed[file] = None
+            return
+        self._records[file] = record
+        self._by_rd.setdefault(record.rd, {})[file] = None
+        self._by_rd_fe.setdefault((record.rd, record.fe), {})[file] = None
+
+    def _drop(self, file: str) -> None:
+        self._malformed.pop(file, None)
+        record = self._records.pop(file, None)
+        if record is None:
+            return
+        self._by_rd[record.rd].pop(file, None)
+        self._by_rd_fe[(record.rd, record.fe)].pop(file, None)
+
+    def refresh(self) -> 'BufferIndex':
+        """
+        Add the new files and drop the removed ones, if the folder has changed
+        :return:
+        """
+        if not os.path.isdir(self.folder):
+            self._mtime = self._listed = None
+            for file in [*self._records, *self._malformed]:
+                self._drop(file)
+            return self
+
+        # modification time read before listing, so that changes made while listing are caught by the next refresh.
+        # A file added in the same timestamp tick as the previous listing does not change the modification time, so
+        # the folder is listed again as long as its modification time is that recent
+        mtime = os.stat(self.folder).st_mtime_ns
+        if mtime == self._mtime and self._listed - mtime >= MTIME_RESOLUTION_NS:
+            return self
+
+        listed = time.time_ns()
+        files = os.listdir(self.folder)
+        for file in (self._records.keys() | self._malformed.keys()) - set(files):
+            self._drop(file)
+        for file in files:
+            if file not in self._records and file not in self._malformed:
+                self._add(file)
+        self._mtime, self._listed = mtime, listed
+
+        return self
+
+    def records(self) -> list[FileRecord]:
+        """
+        Records of all the files of the folder whose name could be parsed
+        :return:
+        """
+        return list(self._records.values())
+
+    def malformed(self) -> list[str]:
+        """
+        Files of the folder whose name could not be parsed
+        :return:
+        """
+        return list(self._malformed)
+
+    def names(self) -> list[str]:
+        """
+        All the files of the folder
+        :return:
+        """
+        return [*self._records, *self._malformed]
+
+    def files(self, rd: str, fe: str = None, product: str | tuple[str] = None, extensions: tuple[str] = None) -> list[str]:
+        """
+        Files of a run date (and forecast date)
+        :param rd: run date (YYYYMMDD)
+        :param fe: forecast date (YYYYMMDD), any if None
+        :param product: product type(s) of the files (see utils.filename), any if None
+        :param extensions: extensions of the files (e.g. ('.csv',)), any if None
+        :return:
+        """
+        if isinstance(product, str):
+            product = (product,)
+        files = self._by_rd.get(rd, {}) if fe is None else self._by_rd_fe.get((rd, fe), {})
+        return [file for file in files if (product is None or self._records[file].product in product) and
+                (extensions is None or file.endswith(extensions))]
+
+    def members(self, rd: str, fe: str) -> list[str]:
+        """
+        Ensemble members of a run date and forecast date
+        :param rd: run date (YYYYMMDD)
+        :param fe: forecast date (YYYYMMDD)
+        :return:
+        """
+        return self.files(rd, fe, product='member')
+
+    def remove(self, file: str) -> None:
+        """
+        Remove a file of the folder and drop it from the index
+        :param file:
+        :return:
+        """
+        os.remove(os.path.join(self.folder, file))
+        self._drop(file)
+
+
+# indexes of the folders, kept for the whole process
+_INDEXES = {}
+
+
+def get_buffer_index(folder: str, country: str = None) -> BufferIndex:
+    """
+    Get the refreshed index of a folder
+    :param folder:
+    :param country: country of the files of the folder
+    :return:
+    """
+    key = os.path.abspath(folder)
+    if key not in _INDEXES:
+        _INDEXES[key] = BufferIndex(folder, country=country)
+    return _INDEXES[key].refresh()
@@ -0,0 +1,160 @@
+import os
+import json
+import hashlib
+
+from utils.files import createFolderIfNotExists
+from utils.artifacts import place_file
+
+from constants.constants import DEPTH_CACHE_MAX_SIZE, DEPTH_CACHE_VERSION
+
+
+def file_fingerprint(file_path: str) -> list:
+    """
+    Get the fingerprint of a file from its metadata only (name, size and modification time), so that looking up the
+    cache does not read the files (the ensemble members keep the modification time of the sftp server, see utils.sftp)
+    :param file_path:
+    :return:
+    """
+    stat = os.stat(file_path)
+    return [os.path.basename(file_path), stat.st_size, stat.st_mtime_ns]
+
+
+def depth_cache_key(file_list: list[str], threshold: float, n_bands: int, to_crs: str, agreement_band: bool = False, grid: tuple = None) -> str:
+    """
+    Get the key of a depth map in the cache, from the fingerprints of the ensemble files and the parameters of the
+    ensemble agreement (the order of the ensemble files does not matter)
+    :param file_list:
+    :param threshold:
+    :param n_bands:
+    :param to_crs:
+    :param agreement_band:
+    :param grid: grid of the depth map (see utils.grid.CountryGrid)
+    :return:
+    """
+    key = {
+        'version': DEPTH_CACHE_VERSION,
+        'files': sorted(file_fingerprint(file_path) for file_path in file_list),
+        'threshold': threshold,
+        'n_bands': n_bands,
+        'to_crs': to_crs,
+        'agreement_band': agreement_band,
+        'grid': None if grid is None else [str(value) for value in grid],
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def get_cache_entry(cache_folder: str, key: str) -> tuple[str, str]:
+    """
+    Get the paths of the tif file and of the json file of a cache entry
+    :param cache_folder:
+    :param key:
+    :return:
+    """
+    entry_path = os.path.join(cache_folder, key[:2])
+    return os.path.join(entry_path, f'{key}.tif'), os.path.join(entry_path, f'{key}.json')
+
+
+def get_cached_depth(cache_folder: str, key: str, output_file: str, with_summary: bool = False) -> tuple[bool, tuple, int, dict] | None:
+    """
+    Copy a cached depth map to the output file, return None if the key is not in the cache
+    :param cache_folder:
+    :param key:
+    :param output_file:
+    :param with_summary: also return None if the entry has no agreement summary (see utils.summary)
+    :return: empty, bbox, max_band_value, summary (n_members and max_count, None if not stored)
+    """
+    tif_file, json_file = get_cache_entry(cache_folder, key)
+    if not (os.path.exists(tif_file) and os.path.exists(json_file)):
+        return None
+
+    with open(json_file, 'r') as fp:
+        json_dict = json.load(fp)
+
+    if with_summary and json_dict.get('summary') is None:
+        return None
+
+    place_file(tif_file, output_file)
+
+    # mark the entry as recently used
+    os.utime(json_file)
+
+    return json_dict['empty'], tuple(json_dict['bbox']), json_dict['max_band_value'], json_dict.get('summary')
+
+
+def put_cached_depth(
+        cache_folder: str,
+        key: str,
+        output_file: str,
+        empty: bool,
+        bbox: tuple,
+        max_band_value: int,
+        summary: tuple[int, list] = None,
+        max_size: int = DEPTH_CACHE_MAX_SIZE,
+) -> None:
+    """
+    Store a depth map in the cache, then evict the least recently used entries if the cache is too large
+    :param cache_folder:
+    :param key:
+    :param output_file:
+    :param empty:
+    :param bbox:
+    :param max_band_value:
+    :param summary: agreement summary of the ensemble (n_members, max_count), see utils.summary
+    :param max_size: maximum size of the cache, in bytes
+    :return:
+    """
+    tif_file, json_file = get_cache_entry(cache_folder, key)
+    createFolderIfNotExists(os.path.dirname(tif_file))
+
+    # write the json to a temporary file first (the tif is placed atomically), so that an interrupted run never leaves a
+    # partial entry
+    place_file(output_file, tif_file)
+    with open(f'{json_file}.tmp', 'w') as fp:
+        json.dump({
+            'empty': bool(empty),
+            'bbox': [float(coordinate) for coordinate in bbox],
+            'max_band_value': int(max_band_value),
+            'summary': None if summary is None else {
+                'n_members': int(summary[0]),
+                'max_count': [int(count) for count in summary[1]],
+            },
+        }, fp)
+    os.replace(f'{json_file}.tmp', json_file)
+
+    evict_cache(cache_folder, max_size=max_size)
+
+
+def evict_cache(cache_folder: str, max_size: int = DEPTH_CACHE_MAX_SIZE) -> None:
+    """
+    Remove the least recently used entries of the cache until its size is below max_size
+    :param cache_folder:
+    :param max_size: maximum size of the cache, in bytes
+    :return:
+    """
+    # the entries may be removed at the same time by another process (e.g. parallel workers), they are then skipped
+    entries = []
+    for entry_path in os.scandir(cache_folder):
+        if not entry_path.is_dir():
+            continue
+        try:
+            for entry in os.scandir(entry_path.path):
+                if entry.name.endswith('.json'):
+                    tif_file = entry.path.replace('.json', '.tif')
+                    stat = entry.stat()
+                    size = stat.st_size + (os.path.getsize(tif_file) if os.path.exists(tif_file) else 0)
+                    entries.append((stat.st_mtime, size, entry.path, tif_file))
+        except FileNotFoundError:
+            continue
+
+    total_size = sum(size for _, size, _, _ in entries)
+
+    # oldest entries first
+    for _, size, json_file, tif_file in sorted(entries):
+        if total_size <= max_size:
+            break
+        for file in [json_file, tif_file]:
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+        total_size -= size
@@ -0,0 +1,93 @@
+import os
+
+from utils.buffer import BufferIndex, get_buffer_index
+
+from constants.constants import DATA_FOLDER, RASTER_FOLDER, BUFFER_FOLDER, IMPACTS_FOLDER
+
+
+class Catalog:
+    """
+    Catalog of the buffer and impacts files of the data tree, through the index of each folder (see utils.buffer)
+    """
+
+    def __init__(self, root: str = DATA_FOLDER):
+        self.root = root
+
+    def index(self, folder: str, country: str = None) -> BufferIndex:
+        """
+        Get the refreshed index of a folder (see utils.buffer)
+        :param folder:
+        :param country: country of the files of the folder
+        :return:
+        """
+        return get_buffer_index(folder, country=country)
+
+    def buffer_path(self, country: str) -> str:
+        """
+        Buffer folder of a country
+        :param country:
+        :return:
+        """
+        return os.path.join(self.root, country, RASTER_FOLDER, BUFFER_FOLDER)
+
+    def impacts_path(self, country: str) -> str:
+        """
+        Impacts folder of a country
+        :param country:
+        :return:
+        """
+        return os.path.join(self.root, country, IMPACTS_FOLDER)
+
+    def buffer(self, country: str) -> BufferIndex:
+        """
+        Index of the buffer folder of a country
+        :param country:
+        :return:
+        """
+        return self.index(self.buffer_path(country), country=country)
+
+    def impacts(self, country: str) -> BufferIndex:
+        """
+        Index of the impacts folder of a country
+        :param country:
+        :return:
+        """
+        return self.index(self.impacts_path(country), country=country)
+
+    def members(self, country: str, rd: str, fe: str) -> list[str]:
+        """
+        Ensemble members of a run date and forecast date in the buffer folder of a country
+        :param country:
+        :param rd: run date (YYYYMMDD)
+        :param fe: forecast date (YYYYMMDD)
+        :return:
+        """
+        return self.buffer(country).members(rd, fe)
+
+    def impact_files(self, country: str, rd: str, extensions: tuple[str] = ('.csv', '.geojson', '.tif')) -> list[str]:
+        """
+        Impact files (paths) of a run date in the impacts folder of a country
+        :param country:
+        :param rd: run date (YYYYMMDD)
+        :param extensions:
+        :return:
+        """
+        products = ('population_impacts', 'economic_impacts')
+        return [os.path.join(self.impacts_path(country), file) for file in
+                self.impacts(country).files(rd, product=products, extensions=extensions)]
+
+
+# catalogs of the data trees, kept for the whole process
+_CATALOGS = {}
+
+
+def get_catalog(root: str = DATA_FOLDER) -> Catalog:
+    """
+    Get the catalog of a data tree
+    :param root:
+    :return:
+    """
+    key = os.path.abspath(root)
+    if key not in _CATALOGS:
+        _CATALOGS[key] = Catalog(root)
+    return _CATALOGS[key]
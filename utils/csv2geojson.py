@@ -6,8 +6,14 @@ import json
 from utils.geodataframe import gdf_to_geotiff
 from utils.tif import reproject_tif
 from utils.dataframe import agg_threshold
+from utils.artifacts import detach
+from utils.instrument import instrumented
+from utils.logger import get_logger
 
+logger = get_logger(__name__)
 
+
+@instrumented()
 def csv2geojson(csv_file, shp_file, output_file, geotiff:bool = False, to_epsg_3857: bool = True, decimals=2):
     """
     Convert csv to geojson
@@ -21,6 +27,10 @@ def csv2geojson(csv_file, shp_file, output_file, geotiff:bool = False, to_epsg_3
     example: csv2geojson.py --csv for_moz_ts_rd20230210T0000Z_population_impacts.csv --shp moz_adm_shapefile.zip --out for_moz_ts_rd20230210T0000Z_population_impacts.geojson
     """
 
+    # previous outputs may share their content with the event folders (see utils.artifacts)
+    for postfix in ['.geojson', '.tif', '_processed.csv', '_adm2_processed.csv', '_adm1_processed.csv', '_adm0_processed.csv', '_grouped_processed.csv']:
+        detach(output_file.replace('.geojson', postfix))
+
     # Load the shapefile
     shapefile = gpd.read_file(shp_file)
 
@@ -42,7 +52,7 @@ def csv2geojson(csv_file, shp_file, output_file, geotiff:bool = False, to_epsg_3
     merged = pd.merge(df_grouped, shapefile, left_on='admin_code', right_on='ADM2_CODE')
     if merged.empty:
         # print message to let the user know that the ADM2_CODE was not present in the file
-        print('WARNING - ADM2_CODE was not present in the file')
+        logger.warning('ADM2_CODE was not present in the file')
         merged = pd.merge(df_grouped, shapefile, left_on='admin_code', right_on='ADM1_CODE')
 
     # Convert the columns from float to int in the merged DataFrame
@@ -69,7 +79,7 @@ def csv2geojson(csv_file, shp_file, output_file, geotiff:bool = False, to_epsg_3
             if to_epsg_3857:
                 reproject_tif(output_file, to_crs='EPSG:3857')
         else:
-            print('GeoDataFrame is empty')
+            logger.warning('GeoDataFrame is empty')
     else:
         gdf.to_file(output_file, driver='GeoJSON')
 
@@ -3,9 +3,11 @@ import datetime as dt
 import copy
 
 from utils.json import createJSONifNotExists, jsonFileToDict, dictToJSONFile
+from utils.instrument import instrumented
 
 from constants.constants import DICT_DEFAULT_VALUES
 
+@instrumented()
 def initialize_event(json_path: str, json_file: str, json_dict_update: dict, ongoing_year: str = None, ongoing_month: str = None, ongoing_day: str = None) -> dict:
     """
     Initialize an event
@@ -42,6 +44,7 @@ def initialize_event(json_path: str, json_file: str, json_dict_update: dict, ong
 
     return json_dict
 
+@instrumented()
 def set_ongoing_event(json_path, json_file, ongoing: bool, ongoing_year: str = None, ongoing_month: str = None, ongoing_day: str = None) -> dict:
     """
     Set an ongoing event
@@ -69,6 +72,7 @@ def set_ongoing_event(json_path, json_file, ongoing: bool, ongoing_year: str = N
 
     return json_dict
 
+@instrumented()
 def save_json_last_edit(json_path, json_file, json_dict) -> dict:
     """
     Save last edit
@@ -0,0 +1,78 @@
+import re
+
+from typing import NamedTuple
+
+# JBA file names, e.g. for_tgo_ts_rd20230108T0000Z_fe20230110T0000Z_ens07.tif (ensemble member),
+# for_tgo_ts_rd20230108T0000Z_fe20230110T0000Z__3d_depth.tif (depth map) or
+# for_tgo_ts_rd20230108T0000Z_population_impacts.csv (impacts)
+FILENAME_PATTERN = re.compile(
+    r'^(?P<prefix>.*?)'
+    r'rd(?P<rd>\d{8})(?:T\d{4}Z)?'
+    r'(?:_fe(?P<fe>\d{8})(?:T\d{4}Z)?)?'
+    r'(?:_ens(?P<ensemble>\d+))?'
+    r'(?P<suffix>.*)$'
+)
+
+# prefix of the file names: optional product prefix (e.g. for_), country code, source (e.g. ts_)
+PREFIX_PATTERN = re.compile(r'^(?:[a-z]+_)?(?P<country>[a-z]{3})_[a-z]+_$')
+
+
+class FileRecord(NamedTuple):
+    """
+    Fields of a file name: country, run date (rdYYYYMMDD), forecast date (feYYYYMMDD), ensemble member (ensNN) and
+    product type ('member', 'depth', 'agreement', 'population_impacts', 'economic_impacts' or 'other')
+    """
+    file: str
+    country: str | None
+    rd: str
+    fe: str | None
+    ensemble: int | None
+    product: str
+
+
+def product_type(file: str, fe: str | None, suffix: str) -> str:
+    """
+    Get the product type of a file from its name
+    :param file:
+    :param fe: forecast date
+    :param suffix: end of the file name, after the dates and the ensemble member
+    :return:
+    """
+    if 'Agreement' in file:
+        return 'agreement'
+    if '_depth' in suffix:
+        return 'depth'
+    if 'impacts' in suffix:
+        if 'population' in suffix:
+            return 'population_impacts'
+        if 'economic' in suffix:
+            return 'economic_impacts'
+        return 'other'
+    if fe is not None and suffix.endswith('.tif'):
+        return 'member'
+    return 'other'
+
+
+def parse_filename(file: str, country: str = None) -> FileRecord | None:
+    """
+    Parse a JBA file name
+    :param file: file name (without folder)
+    :param country: country of the file if it cannot be read from its name (e.g. the country of its folder)
+    :return: None if the name does not have a run date (malformed)
+    """
+
+    match = FILENAME_PATTERN.match(file)
+    if match is None:
+        return None
+
+    prefix = PREFIX_PATTERN.match(match['prefix'])
+    ensemble = match['ensemble']
+
+    return FileRecord(
+        file=file,
+        country=prefix['country'] if prefix is not None else country,
+        rd=match['rd'],
+        fe=match['fe'],
+        ensemble=int(ensemble) if ensemble is not None else None,
+        product=product_type(file, match['fe'], match['suffix']),
+    )
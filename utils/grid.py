@@ -0,0 +1,173 @@
+import os
+import json
+
+from functools import lru_cache
+from typing import NamedTuple
+
+import numpy as np
+import rasterio
+import geopandas as gpd
+
+from rasterio.transform import from_origin
+from rasterio.warp import calculate_default_transform
+from rasterio.windows import Window, from_bounds
+
+from utils.logger import get_logger
+
+from constants.constants import DATA_FOLDER, COUNTRIES_FOLDER, TIF_RESOLUTION, GRID_FILE, GRID_TILE_SIZE
+
+logger = get_logger(__name__)
+
+
+class CountryGrid(NamedTuple):
+    """
+    Canonical grid of a country: the bounds of its shapefile at the resolution of the forecasts (src_*), and the same
+    area in EPSG:3857 (crs, transform, width, height), on which all the depth maps of the country can be written
+    """
+    country: str
+    src_crs: str
+    src_transform: rasterio.Affine
+    src_width: int
+    src_height: int
+    crs: str
+    transform: rasterio.Affine
+    width: int
+    height: int
+    tile_size: int
+
+    def meta(self, dtype: str = 'uint8', src: bool = False) -> dict:
+        """
+        Metadata of a single band tif file on the EPSG:3857 grid
+        :param dtype:
+        :param src: on the grid of the forecasts instead
+        :return:
+        """
+        return {
+            'driver': 'GTiff',
+            'dtype': dtype,
+            'nodata': 0,
+            'count': 1,
+            'crs': self.src_crs if src else self.crs,
+            'transform': self.src_transform if src else self.transform,
+            'width': self.src_width if src else self.width,
+            'height': self.src_height if src else self.height,
+        }
+
+    def window(self, bounds: tuple, src: bool = False) -> Window:
+        """
+        Window of the EPSG:3857 grid covering bounds (left, bottom, right, top), clipped to the grid
+        :param bounds:
+        :param src: window of the grid of the forecasts instead (bounds in its crs)
+        :return: raise rasterio.errors.WindowError if the bounds are outside of the grid
+        """
+        transform, width, height = (self.src_transform, self.src_width, self.src_height) if src else (self.transform, self.width, self.height)
+        window = from_bounds(*bounds, transform=transform)
+
+        # snapped outwards to whole pixels (the tolerance absorbs the rounding errors of the transforms)
+        col_start, row_start = int(np.floor(window.col_off + 1e-6)), int(np.floor(window.row_off + 1e-6))
+        col_stop, row_stop = int(np.ceil(window.col_off + window.width - 1e-6)), int(np.ceil(window.row_off + window.height - 1e-6))
+
+        return Window(col_start, row_start, col_stop - col_start, row_stop - row_start).intersection(Window(0, 0, width, height))
+
+    def tile_windows(self) -> list[Window]:
+        """
+        Tiles of the EPSG:3857 grid, row by row
+        :return:
+        """
+        return [
+            Window(col_off, row_off, min(self.tile_size, self.width - col_off), min(self.tile_size, self.height - row_off))
+            for row_off in range(0, self.height, self.tile_size)
+            for col_off in range(0, self.width, self.tile_size)
+        ]
+
+    def is_aligned(self, src: rasterio.DatasetReader) -> bool:
+        """
+        Check if an open tif file is on the EPSG:3857 grid
+        :param src:
+        :return:
+        """
+        return src.crs == self.crs and src.transform.almost_equals(self.transform) and src.shape == (self.height, self.width)
+
+
+def compute_country_grid(country: str, resolution: float = TIF_RESOLUTION, tile_size: int = GRID_TILE_SIZE) -> CountryGrid:
+    """
+    Compute the grid of a country from the bounds of its shapefile, snapped outwards to the resolution
+    :param country:
+    :param resolution: resolution of the forecasts, in degrees
+    :param tile_size:
+    :return:
+    """
+
+    gdf = gpd.read_file(os.path.join(COUNTRIES_FOLDER, f'{country}_adm_shapefile.zip'))
+    left, bottom, right, top = gdf.to_crs('EPSG:4326').total_bounds
+
+    # snap to the pixels of the forecasts
+    left, bottom = np.floor(left / resolution) * resolution, np.floor(bottom / resolution) * resolution
+    right, top = np.ceil(right / resolution) * resolution, np.ceil(top / resolution) * resolution
+    src_width, src_height = int(np.round((right - left) / resolution)), int(np.round((top - bottom) / resolution))
+
+    transform, width, height = calculate_default_transform('EPSG:4326', 'EPSG:3857', src_width, src_height, left, bottom, right, top)
+
+    return CountryGrid(
+        country=country,
+        src_crs='EPSG:4326',
+        src_transform=from_origin(left, top, resolution, resolution),
+        src_width=src_width,
+        src_height=src_height,
+        crs='EPSG:3857',
+        transform=transform,
+        width=width,
+        height=height,
+        tile_size=tile_size,
+    )
+
+
+def save_country_grid(grid: CountryGrid, grid_file: str) -> None:
+    """
+    Save the grid of a country to a json file
+    :param grid:
+    :param grid_file:
+    :return:
+    """
+    json_dict = grid._asdict()
+    json_dict['src_transform'] = list(grid.src_transform)[:6]
+    json_dict['transform'] = list(grid.transform)[:6]
+
+    with open(f'{grid_file}.tmp', 'w') as fp:
+        json.dump(json_dict, fp, indent=4)
+    os.replace(f'{grid_file}.tmp', grid_file)
+
+
+def load_country_grid(grid_file: str) -> CountryGrid:
+    """
+    Load the grid of a country from a json file
+    :param grid_file:
+    :return:
+    """
+    with open(grid_file, 'r') as fp:
+        json_dict = json.load(fp)
+
+    json_dict['src_transform'] = rasterio.Affine(*json_dict['src_transform'])
+    json_dict['transform'] = rasterio.Affine(*json_dict['transform'])
+
+    return CountryGrid(**json_dict)
+
+
+@lru_cache(maxsize=None)
+def get_country_grid(country: str) -> CountryGrid:
+    """
+    Get the grid of a country, computed once and persisted in its data folder
+    :param country:
+    :return:
+    """
+    grid_file = os.path.join(DATA_FOLDER, country, GRID_FILE)
+
+    if os.path.exists(grid_file):
+        return load_country_grid(grid_file)
+
+    logger.info(f'Computing the grid of {country}... ', extra={'indent': 3, 'color': 'blue'})
+    grid = compute_country_grid(country)
+    os.makedirs(os.path.dirname(grid_file), exist_ok=True)
+    save_country_grid(grid, grid_file)
+
+    return grid
@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import resource
+import functools
+
+from contextlib import contextmanager
+
+from constants.constants import INSTRUMENT_FOLDER
+
+# folder of the JSON lines of the spans, None if disabled (see instrumentation)
+INSTRUMENT_OUTPUT_FOLDER = None
+
+# spans open in this process, innermost last
+_STACK = []
+
+
+@contextmanager
+def instrumentation(enabled: bool = True, folder: str = INSTRUMENT_FOLDER):
+    """
+    Record the spans opened within the context (see span) as JSON lines, one file per (country, day):
+    folder/<country>/<YYYY_MM_DD>.jsonl, and folder/pipeline.jsonl for the spans outside of a country and day. The
+    worker processes forked within the context record their spans too
+    :param enabled:
+    :param folder:
+    :return:
+    """
+    global INSTRUMENT_OUTPUT_FOLDER
+
+    if not enabled or INSTRUMENT_OUTPUT_FOLDER is not None:
+        yield
+        return
+
+    os.makedirs(folder, exist_ok=True)
+    INSTRUMENT_OUTPUT_FOLDER = folder
+    try:
+        yield
+    finally:
+        INSTRUMENT_OUTPUT_FOLDER = None
+
+
+def read_io() -> dict:
+    """
+    Bytes read and written by the process so far (/proc/self/io, empty if not available): rchar and wchar count all
+    the reads and writes, read_bytes and write_bytes only those which reached the storage
+    :return:
+    """
+    try:
+        with open('/proc/self/io', 'r') as f:
+            return {key: int(value) for key, value in (line.split(':') for line in f)}
+    except OSError:
+        return {}
+
+
+def read_rss_mb() -> float | None:
+    """
+    Resident set size of the process (MB), None if not available
+    :return:
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError):
+        return None
+
+
+class span:
+    """
+    Measure a stage of the pipeline: wall time, CPU time, resident memory (current and peak of the process) and bytes
+    read/written, written as a JSON line when the span closes. The country and the day of the span are inherited from
+    the enclosing spans if not given. Nothing is measured when the instrumentation is disabled
+    """
+
+    def __init__(self, name: str, country: str = None, date: str = None, **attributes):
+        """
+        :param name: name of the stage
+        :param country:
+        :param date: day (YYYY_MM_DD)
+        :param attributes: additional fields of the JSON line (JSON serializable)
+        """
+        self.name = name
+        self.country = country
+        self.date = date
+        self.attributes = attributes
+        self.enabled = False
+
+    def __enter__(self) -> 'span':
+        if INSTRUMENT_OUTPUT_FOLDER is None:
+            return self
+
+        self.enabled = True
+        self.parent = _STACK[-1] if _STACK else None
+        if self.parent is not None:
+            self.country = self.country or self.parent.country
+            self.date = self.date or self.parent.date
+        _STACK.append(self)
+
+        self.io = read_io()
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        if not self.enabled:
+            return False
+
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        io = read_io()
+        _STACK.remove(self)
+
+        record = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'span': self.name,
+            'parent': self.parent.name if self.parent is not None else None,
+            'depth': len(_STACK),
+            'country': self.country,
+            'date': self.date,
+            'pid': os.getpid(),
+            'wall_s': round(wall, 4),
+            'cpu_s': round(cpu, 4),
+            'rss_mb': round(read_rss_mb() or 0, 1),
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),  # KB on Linux
+            'read_bytes': io.get('rchar', 0) - self.io.get('rchar', 0),
+            'write_bytes': io.get('wchar', 0) - self.io.get('wchar', 0),
+            'disk_read_bytes': io.get('read_bytes', 0) - self.io.get('read_bytes', 0),
+            'disk_write_bytes': io.get('write_bytes', 0) - self.io.get('write_bytes', 0),
+            'error': exc_type.__name__ if exc_type is not None else None,
+            **self.attributes,
+        }
+
+        write_record(record)
+
+        return False
+
+
+def write_record(record: dict) -> None:
+    """
+    Append a record to the JSON lines file of its country and day
+    :param record:
+    :return:
+    """
+
+    if record['country'] is not None and record['date'] is not None:
+        jsonl_file = os.path.join(INSTRUMENT_OUTPUT_FOLDER, record['country'], f'{record["date"]}.jsonl')
+    else:
+        jsonl_file = os.path.join(INSTRUMENT_OUTPUT_FOLDER, 'pipeline.jsonl')
+    os.makedirs(os.path.dirname(jsonl_file), exist_ok=True)
+
+    # a single write per line, in append mode, so that the lines of concurrent processes are not interleaved
+    with open(jsonl_file, 'a') as f:
+        f.write(json.dumps(record, default=str) + '\n')
+
+
+def instrumented(name: str = None):
+    """
+    Decorator recording every call of a function as a span (see span)
+    :param name: name of the span (name of the function if None)
+    :return:
+    """
+
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if INSTRUMENT_OUTPUT_FOLDER is None:
+                return func(*args, **kwargs)
+            with span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -1,6 +1,11 @@
 import os
 import json
 
+from utils.instrument import instrumented
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
 def createJSONifNotExists(json_path: str, json_file: str, json_dict: dict) -> dict:
     """
     Create a JSON file if it does not exist
@@ -10,18 +15,19 @@ def createJSONifNotExists(json_path: str, json_file: str, json_dict: dict) -> di
     """
     path = os.path.join(json_path, json_file)
     if not os.path.exists(json_path):
-        print(f'\t\t\t\t\033[34mCreating folder {json_path}...\033[0m')
+        logger.info(f'Creating folder {json_path}...', extra={'indent': 4, 'color': 'blue'})
         os.makedirs(json_path, exist_ok=True)
     if not os.path.exists(path):
         with open(path, 'w') as fp:
             json.dump(json_dict, fp)
-            print(f'\t\t\t\t\033[34mCreating file {json_file}...\033[0m')
+            logger.info(f'Creating file {json_file}...', extra={'indent': 4, 'color': 'blue'})
             return json_dict
     else:
         with open(path, 'r') as fp:
             json_dict = json.load(fp)
             return json_dict
 
+@instrumented()
 def jsonFileToDict(json_path: str, json_file: str) -> dict:
     """
     Get a JSON file and return a dictionary
@@ -33,6 +39,7 @@ def jsonFileToDict(json_path: str, json_file: str) -> dict:
     with open(path, 'r') as fp:
         return json.load(fp)
 
+@instrumented()
 def dictToJSONFile(json_path: str, json_file: str, json_dict: dict) -> None:
     """
     Get a dictionary and write it to a JSON file
@@ -0,0 +1,206 @@
+import re
+import sys
+import json
+import time
+import logging
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from constants.constants import LOGGER_NAME, LOG_PROGRESS_INTERVAL
+
+# ANSI escape codes of the colored messages (see utils.string_format)
+ANSI_PATTERN = re.compile(r'\x1b\[[0-9;]*m')
+
+# colors of the text messages (extra={'color': ...}), and by level and status mark when the message has none
+COLORS = {
+    'red': '\033[31m',
+    'green': '\033[32m',
+    'blue': '\033[34m',
+    'magenta': '\033[95m',
+    'bold': '\033[1m',
+}
+RESET = '\033[0m'
+LEVEL_COLORS = {
+    logging.WARNING: 'red',
+    logging.ERROR: 'red',
+    logging.CRITICAL: 'red',
+}
+MARK_COLORS = {
+    '✔': 'green',
+    '✘': 'red',
+}
+
+# fields added to the log records within a context (e.g. country and date), see log_context
+_CONTEXT = ContextVar('log_context', default={})
+
+
+class ContextFilter(logging.Filter):
+    """
+    Add the fields of the current log context to the records
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.context = _CONTEXT.get()
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    """
+    Messages indented by step of the pipeline (extra={'indent': n}, one tab per step), colored only when written to a
+    terminal: with their color (extra={'color': ...}, see COLORS), otherwise by level, and the status marks ✔ and ✘
+    """
+
+    def __init__(self, color: bool = True):
+        super().__init__()
+        self.color = color
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = ANSI_PATTERN.sub('', record.getMessage())
+
+        if self.color:
+            color = getattr(record, 'color', None) or LEVEL_COLORS.get(record.levelno)
+            if color is not None:
+                message = f'{COLORS[color]}{message}{RESET}'
+            else:
+                for mark, mark_color in MARK_COLORS.items():
+                    message = message.replace(mark, f'{COLORS[mark_color]}{mark}{RESET}')
+
+        message = '\t' * getattr(record, 'indent', 0) + message
+        if record.exc_info:
+            message = f'{message}\n{self.formatException(record.exc_info)}'
+        return message
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record: time, level, logger, message (without colors), fields of the log
+    context and fields of the record (extra={'fields': {...}})
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': ANSI_PATTERN.sub('', record.getMessage()).strip(),
+            **getattr(record, 'context', {}),
+            **getattr(record, 'fields', {}),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class StreamHandler(logging.StreamHandler):
+    """
+    Stream handler which only flushes the warnings and errors (the stream is flushed at exit anyway), so that each
+    message does not cost a system call when the output is a pipe
+    """
+
+    def __init__(self, stream=None, flush_level: int = logging.WARNING):
+        super().__init__(stream)
+        self.flush_level = flush_level
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+            if record.levelno >= self.flush_level:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+
+def configure_logging(level: str | int = logging.INFO, json_output: bool = False, quiet: bool = False, stream=None) -> logging.Logger:
+    """
+    Configure the logger of the pipeline (replacing its previous configuration)
+    :param level: e.g. 'DEBUG', 'INFO', 'WARNING'
+    :param json_output: one JSON object per line instead of the text messages
+    :param quiet: only the warnings and errors, no progress messages (no I/O in the loops)
+    :param stream: output stream (stdout if None)
+    :return:
+    """
+
+    stream = stream or sys.stdout
+
+    handler = StreamHandler(stream)
+    handler.addFilter(ContextFilter())
+    handler.setFormatter(JsonFormatter() if json_output else TextFormatter(color=stream.isatty()))
+
+    logger = logging.getLogger(LOGGER_NAME)
+    for previous_handler in list(logger.handlers):
+        logger.removeHandler(previous_handler)
+    logger.addHandler(handler)
+    logger.setLevel(max(logging.WARNING, logging.getLevelName(level) if isinstance(level, str) else level) if quiet else level)
+    logger.propagate = False
+
+    return logger
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Get the logger of a module, under the logger of the pipeline (configured with the default text output if it was not
+    configured yet)
+    :param name: e.g. __name__
+    :return:
+    """
+    if not logging.getLogger(LOGGER_NAME).handlers:
+        configure_logging()
+    return logging.getLogger(f'{LOGGER_NAME}.{name}')
+
+
+@contextmanager
+def log_context(**fields):
+    """
+    Add fields (e.g. country, date) to the records logged within the context
+    :param fields:
+    :return:
+    """
+    token = _CONTEXT.set({**_CONTEXT.get(), **fields})
+    try:
+        yield
+    finally:
+        _CONTEXT.reset(token)
+
+
+class Progress:
+    """
+    Rate-limited progress of a loop: the first and last steps, and at most one message every interval seconds in
+    between. Nothing is done (not even reading the clock) if the level is disabled, e.g. in quiet mode
+    """
+
+    def __init__(self, logger: logging.Logger, message: str, total: int, interval: float = LOG_PROGRESS_INTERVAL,
+                 level: int = logging.INFO, indent: int = 0):
+        """
+        :param logger:
+        :param message: message of the progress, followed by (step/total)
+        :param total: number of steps
+        :param interval: minimum time between two messages (seconds)
+        :param level:
+        :param indent: see TextFormatter
+        """
+        self.logger = logger
+        self.message = message
+        self.total = total
+        self.interval = interval
+        self.level = level
+        self.indent = indent
+        self.enabled = logger.isEnabledFor(level)
+        self.last = None
+
+    def update(self, step: int) -> None:
+        """
+        Report a step (from 1 to total)
+        :param step:
+        :return:
+        """
+        if not self.enabled:
+            return
+
+        now = time.monotonic()
+        if self.last is not None and step < self.total and now - self.last < self.interval:
+            return
+        self.last = now
+
+        self.logger.log(self.level, f'{self.message} ({step}/{self.total})',
+                        extra={'indent': self.indent, 'fields': {'step': step, 'total': self.total}})
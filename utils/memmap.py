@@ -0,0 +1,160 @@
+import os
+import uuid
+import shutil
+import hashlib
+import tempfile
+
+import numpy as np
+import rasterio
+
+from contextlib import contextmanager
+
+from constants.constants import RASTER_CACHE_MAX_SIZE
+
+# folder of the run-scoped raster cache, None if disabled (see raster_cache)
+RASTER_CACHE_FOLDER = None
+
+# maximum size of the raster cache, in bytes (see raster_cache)
+RASTER_CACHE_SIZE_LIMIT = RASTER_CACHE_MAX_SIZE
+
+
+@contextmanager
+def raster_cache(enabled: bool = True, folder: str = None, max_size: int = RASTER_CACHE_MAX_SIZE):
+    """
+    Keep the rasters decoded within the context as memory-mapped .npy files, so that reading the same tif file again
+    (e.g. for the stats, then for the max depth map) does not decompress it again. The least recently used arrays are
+    removed once the cache is larger than max_size, and the cache is removed on exit
+    :param enabled:
+    :param folder: parent folder of the cache (system temporary folder if None)
+    :param max_size: maximum size of the cache, in bytes
+    :return:
+    """
+    global RASTER_CACHE_FOLDER, RASTER_CACHE_SIZE_LIMIT
+
+    if not enabled or RASTER_CACHE_FOLDER is not None:
+        yield
+        return
+
+    RASTER_CACHE_FOLDER = tempfile.mkdtemp(prefix='raster_cache_', dir=folder)
+    RASTER_CACHE_SIZE_LIMIT = max_size
+    try:
+        yield
+    finally:
+        shutil.rmtree(RASTER_CACHE_FOLDER, ignore_errors=True)
+        RASTER_CACHE_FOLDER = None
+        RASTER_CACHE_SIZE_LIMIT = RASTER_CACHE_MAX_SIZE
+
+
+def cached_array_file(tif_file: str) -> str:
+    """
+    Get the path of the .npy file of a tif file in the cache, keyed by its path and modification time
+    :param tif_file:
+    :return:
+    """
+    stat = os.stat(tif_file)
+    key = hashlib.sha1(f'{os.path.abspath(tif_file)}:{stat.st_mtime_ns}:{stat.st_size}'.encode()).hexdigest()
+    return os.path.join(RASTER_CACHE_FOLDER, f'{key}.npy')
+
+
+def get_cached_array(tif_file: str) -> np.ndarray | None:
+    """
+    Get the memory-mapped bands of a tif file if they are in the cache
+    :param tif_file:
+    :return: array of shape (bands, height, width), None if the cache is disabled or the file is not in it
+    """
+    if RASTER_CACHE_FOLDER is None:
+        return None
+
+    # the arrays may be evicted at any time, also by another process (e.g. parallel workers)
+    array_file = cached_array_file(tif_file)
+    try:
+        array = np.load(array_file, mmap_mode='r')
+    except FileNotFoundError:
+        return None
+
+    # mark the array as recently used (see evict_raster_cache)
+    try:
+        os.utime(array_file)
+    except FileNotFoundError:
+        pass
+
+    return array
+
+
+def read_cached_array(tif_file: str) -> tuple[np.ndarray, dict]:
+    """
+    Read all the bands of a tif file, through the cache if it is enabled
+    :param tif_file:
+    :return: array of shape (bands, height, width), metadata
+    """
+
+    with rasterio.open(tif_file) as src:
+        meta = src.meta
+
+        if RASTER_CACHE_FOLDER is None:
+            return src.read(), meta
+
+        array = get_cached_array(tif_file)
+        if array is None:
+            array = src.read()
+            array_file = cached_array_file(tif_file)
+            # temporary file unique to the process and call, so that parallel workers never write the same one
+            tmp_file = f'{array_file}.{os.getpid()}.{uuid.uuid4().hex}.tmp.npy'
+            np.save(tmp_file, array)
+            os.replace(tmp_file, array_file)
+            evict_raster_cache(keep=array_file)
+
+    return array, meta
+
+
+def evict_raster_cache(keep: str = None) -> None:
+    """
+    Remove the least recently used arrays of the cache until it is smaller than its maximum size (see raster_cache).
+    The arrays already memory-mapped stay readable until they are closed
+    :param keep: array file never removed (e.g. the one just written)
+    :return:
+    """
+
+    # the arrays may be removed at the same time by another process, they are then skipped
+    entries = []
+    for entry in os.scandir(RASTER_CACHE_FOLDER):
+        if not entry.name.endswith('.npy') or entry.name.endswith('.tmp.npy'):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        # the copies are hard links to the same array (see copy_cached)
+        entries.append((stat.st_mtime, stat.st_size / stat.st_nlink, entry.path))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, array_file in sorted(entries):
+        if total_size <= RASTER_CACHE_SIZE_LIMIT:
+            break
+        if array_file == keep:
+            continue
+        try:
+            os.remove(array_file)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+
+def copy_cached(tif_file: str, copy_file: str) -> None:
+    """
+    Register a copy of a tif file in the cache (to be called right after copying it), so that reading the copy does
+    not decompress it again
+    :param tif_file:
+    :param copy_file:
+    :return:
+    """
+    if RASTER_CACHE_FOLDER is None:
+        return
+
+    array_file = cached_array_file(tif_file)
+    copy_array_file = cached_array_file(copy_file)
+    if os.path.exists(array_file) and not os.path.exists(copy_array_file):
+        try:
+            os.link(array_file, copy_array_file)
+        except (FileNotFoundError, FileExistsError):
+            pass
@@ -0,0 +1,174 @@
+import os
+
+import numpy as np
+import rasterio
+
+from contextlib import ExitStack
+
+from rasterio.transform import from_origin
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import Resampling, transform_bounds
+from rasterio.windows import Window
+
+from utils.memmap import get_cached_array
+from utils.grid import CountryGrid
+
+
+def union_grid(tifs_list: list[str]) -> dict:
+    """
+    Get the grid covering all the tif files, at the finest resolution, from their headers only. The grid is in the crs
+    of the first file: the bounds of the files in another crs are transformed to it, and their resolution (in other
+    units) is not taken into account
+    :param tifs_list:
+    :return: metadata of the grid (crs, transform, width, height, dtype)
+    """
+
+    res = None
+    bounds = (float('inf'), float('inf'), float('-inf'), float('-inf'))
+
+    for tif in tifs_list:
+        with rasterio.open(tif) as src:
+            if res is None:
+                res, crs, dtype = src.res, src.crs, src.dtypes[0]
+            if src.crs == crs:
+                res = tuple(min(r, s) for r, s in zip(res, src.res))
+                src_bounds = tuple(src.bounds)
+            else:
+                src_bounds = transform_bounds(src.crs, crs, *src.bounds)
+            bounds = (
+                min(bounds[0], src_bounds[0]),
+                min(bounds[1], src_bounds[1]),
+                max(bounds[2], src_bounds[2]),
+                max(bounds[3], src_bounds[3]),
+            )
+
+    width = int(np.round((bounds[2] - bounds[0]) / res[0]))
+    height = int(np.round((bounds[3] - bounds[1]) / res[1]))
+
+    return {
+        'crs': crs,
+        'transform': from_origin(bounds[0], bounds[3], *res),
+        'width': width,
+        'height': height,
+        'dtype': dtype,
+    }
+
+
+def grid_window(src: rasterio.DatasetReader, grid: dict) -> Window | None:
+    """
+    Get the window of the grid covered by a tif file, if the file is aligned on the grid (same crs and resolution)
+    :param src:
+    :param grid:
+    :return: None if the file is not aligned on the grid
+    """
+
+    transform = grid['transform']
+    if src.crs != grid['crs'] or not np.allclose(src.res, (transform.a, -transform.e)):
+        return None
+
+    return Window(
+        col_off=int(np.round((src.bounds.left - transform.c) / transform.a)),
+        row_off=int(np.round((transform.f - src.bounds.top) / -transform.e)),
+        width=src.width,
+        height=src.height,
+    )
+
+
+def mosaic_max_tifs(tifs_list: list[str], output_file: str, tile_size: int = 1024, grid: CountryGrid = None) -> tuple:
+    """
+    Merge tif files into one, taking the maximum of each pixel. The output grid covers all the files at the finest
+    resolution, and is processed tile by tile: only the windows of the files intersecting a tile are read, so that
+    the memory used does not depend on the size or number of the files. Files at another resolution are resampled
+    (nearest neighbour) while they are read. If all the files have the agreement percentage band (see
+    utils.tif.EnsembleAgreement), the output keeps the agreement of the depth value kept for each pixel (the highest one
+    if several files have this depth). The output file is replaced atomically, so it can be one of the inputs
+    :param tifs_list:
+    :param output_file:
+    :param tile_size:
+    :param grid: grid of the country (see utils.grid): if all the files are on it, the output is on it too and is
+    processed by its tiles
+    :return: bounds of the output
+    """
+
+    country_grid, grid = grid, None
+    if country_grid is not None:
+        with ExitStack() as stack:
+            sources = [stack.enter_context(rasterio.open(tif)) for tif in tifs_list]
+            if all(country_grid.is_aligned(src) for src in sources):
+                grid = country_grid.meta(dtype=sources[0].dtypes[0])
+                tiles = country_grid.tile_windows()
+
+    if grid is None:
+        grid = union_grid(tifs_list)
+        tiles = [
+            Window(col_off, row_off, min(tile_size, grid['width'] - col_off), min(tile_size, grid['height'] - row_off))
+            for row_off in range(0, grid['height'], tile_size)
+            for col_off in range(0, grid['width'], tile_size)
+        ]
+    grid_full = Window(0, 0, grid['width'], grid['height'])
+
+    tmp_file = f'{output_file}.tmp'
+
+    with ExitStack() as stack:
+        # window of each file in the output grid
+        inputs = []
+        count = 2
+        for tif in tifs_list:
+            src = stack.enter_context(rasterio.open(tif))
+            count = min(count, src.count)
+            window = grid_window(src, grid)
+            if window is None:
+                src = stack.enter_context(WarpedVRT(src, crs=grid['crs'], transform=grid['transform'], width=grid['width'],
+                                                    height=grid['height'], resampling=Resampling.nearest))
+                window = grid_full
+                cached = None
+            else:
+                # already decoded during the run (see utils.memmap)
+                cached = get_cached_array(tif)
+            inputs.append((src, window, cached))
+
+        profile = {
+            'driver': 'GTiff',
+            'dtype': grid['dtype'],
+            'nodata': 0,
+            'width': grid['width'],
+            'height': grid['height'],
+            'count': count,
+            'crs': grid['crs'],
+            'transform': grid['transform'],
+            'compress': 'lzw',
+            'tiled': True,
+        }
+
+        with rasterio.open(tmp_file, 'w', **profile) as dst:
+            for tile in tiles:
+                array_max = np.zeros((tile.height, tile.width), dtype=grid['dtype'])
+                agreement = np.zeros((tile.height, tile.width), dtype=grid['dtype'])
+
+                for src, window, cached in inputs:
+                    # part of the tile covered by the file, in the output grid
+                    row_start, row_stop = max(tile.row_off, window.row_off), min(tile.row_off + tile.height, window.row_off + window.height)
+                    col_start, col_stop = max(tile.col_off, window.col_off), min(tile.col_off + tile.width, window.col_off + window.width)
+                    if row_start >= row_stop or col_start >= col_stop:
+                        continue
+
+                    if cached is not None:
+                        array = cached[:count, row_start - window.row_off:row_stop - window.row_off, col_start - window.col_off:col_stop - window.col_off]
+                    else:
+                        array = src.read(list(range(1, count + 1)), window=Window(col_start - window.col_off, row_start - window.row_off, col_stop - col_start, row_stop - row_start))
+
+                    block = np.s_[row_start - tile.row_off:row_stop - tile.row_off, col_start - tile.col_off:col_stop - tile.col_off]
+                    if count == 2:
+                        keep = (array[0] > array_max[block]) | ((array[0] == array_max[block]) & (array[1] > agreement[block]))
+                        agreement[block] = np.where(keep, array[1], agreement[block])
+                    np.maximum(array_max[block], array[0], out=array_max[block])
+
+                dst.write(array_max, 1, window=tile)
+                if count == 2:
+                    dst.write(agreement, 2, window=tile)
+
+            bounds = dst.bounds
+
+    os.replace(tmp_file, output_file)
+
+    return tuple(bounds)
@@ -0,0 +1,177 @@
+import os
+import io
+import signal
+import pstats
+import cProfile
+import threading
+
+from collections import Counter
+from contextlib import contextmanager
+
+from utils.logger import get_logger
+
+from constants.constants import PROFILE_FOLDER, PROFILE_SAMPLE_INTERVAL
+
+logger = get_logger(__name__)
+
+# profiling settings, None if disabled (see profiling)
+PROFILE_SETTINGS = None
+
+# number of functions in the text summaries
+N_TOP_FUNCTIONS = 50
+
+
+@contextmanager
+def profiling(enabled: bool = True, mode: str = 'sample', interval: float = PROFILE_SAMPLE_INTERVAL, folder: str = PROFILE_FOLDER):
+    """
+    Profile the processing of each country and day within the context (see profile_day). Nothing is installed when
+    disabled
+    :param enabled:
+    :param mode: 'sample' (wall-clock sampling of the stacks, low overhead) or 'cprofile' (every function call)
+    :param interval: sampling interval (seconds)
+    :param folder: folder of the profiles
+    :return:
+    """
+    global PROFILE_SETTINGS
+
+    if not enabled or PROFILE_SETTINGS is not None:
+        yield
+        return
+
+    if mode not in ('sample', 'cprofile'):
+        raise ValueError(f'Invalid profiling mode {mode}, valid values are sample and cprofile')
+
+    os.makedirs(folder, exist_ok=True)
+    PROFILE_SETTINGS = {'mode': mode, 'interval': interval, 'folder': folder}
+    try:
+        yield
+    finally:
+        PROFILE_SETTINGS = None
+
+
+def frame_name(frame) -> str:
+    """
+    Name of the function of a frame in the collapsed stacks: function (file:first line)
+    :param frame:
+    :return:
+    """
+    code = frame.f_code
+    filename = code.co_filename
+    if os.path.isabs(filename) and filename.startswith(os.getcwd()):
+        filename = os.path.relpath(filename)
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'
+
+
+class StackSampler:
+    """
+    Sampling profiler of the main thread: a real-time timer interrupts the process every interval seconds, and the stack
+    being executed is counted. Time spent waiting (e.g. on the sftp server) is sampled too, and the samples taken
+    in C code (e.g. GDAL) are attributed to the Python function which called it
+    """
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self._previous_handler = None
+
+    def _sample(self, signum, frame) -> None:
+        stack = []
+        while frame is not None:
+            stack.append(frame_name(frame))
+            frame = frame.f_back
+        # root first (the frame interrupted by the timer is the innermost one)
+        self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self) -> None:
+        self._previous_handler = signal.signal(signal.SIGALRM, self._sample)
+        # restart the system calls interrupted by the timer (e.g. in GDAL or the sftp sockets)
+        signal.siginterrupt(signal.SIGALRM, False)
+        signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+
+    def stop(self) -> None:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, self._previous_handler or signal.SIG_DFL)
+
+    def write_collapsed(self, output_file: str) -> None:
+        """
+        Write the stacks in the collapsed format of flamegraph.pl, speedscope or inferno: one line per stack, frames
+        separated by ';', followed by the number of samples
+        :param output_file:
+        :return:
+        """
+        with open(output_file, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+    def summary(self, n_top: int = N_TOP_FUNCTIONS) -> str:
+        """
+        Functions with the most samples, in their own code (self) and with their callees (total)
+        :param n_top:
+        :return:
+        """
+
+        self_samples, total_samples = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            self_samples[frames[-1]] += count
+            for frame in set(frames):
+                total_samples[frame] += count
+
+        n_samples = max(sum(self.stacks.values()), 1)
+        lines = [f'{n_samples} samples every {self.interval * 1000:g} ms ({n_samples * self.interval:.1f} s)', '',
+                 f'{"self":>8} {"total":>8}  function']
+        for frame, count in total_samples.most_common(n_top):
+            lines.append(f'{self_samples[frame] / n_samples:8.1%} {count / n_samples:8.1%}  {frame}')
+
+        return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def profile_day(country: str, date: str, stage: str = None):
+    """
+    Profile the processing of a country and day if profiling is enabled (see profiling), and write its profile to the
+    profile folder: <country>/<YYYY_MM_DD>.collapsed (stacks for flame graphs) and .txt (top functions) in sample mode,
+    <country>/<YYYY_MM_DD>.prof (pstats) and .txt in cprofile mode
+    :param country:
+    :param date: day (YYYY_MM_DD)
+    :param stage: suffix of the files (_<stage>), if the day is processed in several parts (e.g. by different processes)
+    :return:
+    """
+
+    if PROFILE_SETTINGS is None:
+        yield
+        return
+
+    # the timer signals are only delivered to the main thread
+    if PROFILE_SETTINGS['mode'] == 'sample' and threading.current_thread() is not threading.main_thread():
+        logger.warning(f'Cannot profile {country} on {date} outside of the main thread', extra={'indent': 3})
+        yield
+        return
+
+    stem = os.path.join(PROFILE_SETTINGS['folder'], country, date if stage is None else f'{date}_{stage}')
+    os.makedirs(os.path.dirname(stem), exist_ok=True)
+
+    if PROFILE_SETTINGS['mode'] == 'sample':
+        sampler = StackSampler(interval=PROFILE_SETTINGS['interval'])
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            sampler.write_collapsed(f'{stem}.collapsed')
+            with open(f'{stem}.txt', 'w') as f:
+                f.write(sampler.summary())
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(f'{stem}.prof')
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(N_TOP_FUNCTIONS)
+            with open(f'{stem}.txt', 'w') as f:
+                f.write(summary.getvalue())
+
+    logger.info(f'Profile of {country} on {date} written to {stem}.*', extra={'indent': 3})
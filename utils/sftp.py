@@ -11,7 +11,16 @@ from utils.files import createFolderIfNotExists
 
 from utils.date import increment_day
 
-from utils.string_format import colorize_text
+
+from utils.artifacts import detach
+
+from utils.filename import parse_filename
+
+from utils.instrument import span
+
+from utils.logger import get_logger, log_context
+
+logger = get_logger(__name__)
 
 @datetree
 def download_pipeline(
@@ -40,41 +49,54 @@ def download_pipeline(
 
     # date message
     date_msg = f'{year}_{month}_{day}'
-    print(colorize_text(f'\n{date_msg}\n{"*" * len(date_msg)}\n', 'bold'))
+    logger.info(f'{date_msg}\n{"*" * len(date_msg)}', extra={'color': 'bold'})
 
     with pysftp.Connection(host=HOSTNAME, username=USERNAME, password=PASSWORD, cnopts=cnopts) as sftp:
 
         for country in list_countries:
-            print(f'Fetching data for {country}...')
-
-            for sub_folder in LIST_SUBFOLDERS_BUFFER:
-                print(f'\tFetching {sub_folder} data...')
-
-                path_sftp = os.path.join(country, sub_folder, year, month, day)
-
-                if sub_folder == IMPACTS_FOLDER:
-                    path = os.path.join(DATA_FOLDER, country, sub_folder)
-                    sftp.get_d(path_sftp, path, preserve_mtime=False)
-
-                elif sub_folder == RASTER_FOLDER:
-                    buffer_path = os.path.join(DATA_FOLDER, country, sub_folder, BUFFER_FOLDER)
-                    createFolderIfNotExists(buffer_path)
-
-                    for i_day in range(0, n_days):
-                        year_n, month_n, day_n = increment_day(year, month, day, i_day)
-
-                        # include string
-                        include_str_day = f'fe{year_n}{month_n}{day_n}'
-
-                        # get list of files
-                        list_files = [tif.filename for tif in sftp.listdir_attr(path_sftp) if
-                                      include_str_day in tif.filename and include_str in tif.filename and exclude_str not in tif.filename]
-
-                        # download files to temp folder
-                        print(f'\t\t\tDownloading {len(list_files)} from the sftp server ({colorize_text(include_str_day, "bold")}) ... ', end='')
-                        try:
-                            for i, file in enumerate(list_files):
-                                sftp.get(os.path.join(path_sftp, file), os.path.join(buffer_path, file))
-                            print(colorize_text('✔', 'green'))
-                        except:
-                            print(colorize_text('✘', 'red'))
\ No newline at end of file
+            with span('sftp_download', country=country, date=date_msg), log_context(country=country, date=date_msg):
+                logger.info(f'Fetching data for {country}...')
+
+                for sub_folder in LIST_SUBFOLDERS_BUFFER:
+                    logger.info(f'Fetching {sub_folder} data...', extra={'indent': 1})
+
+                    path_sftp = os.path.join(country, sub_folder, year, month, day)
+
+                    if sub_folder == IMPACTS_FOLDER:
+                        path = os.path.join(DATA_FOLDER, country, sub_folder)
+                        # previous downloads may share their content with the event folders (see utils.artifacts)
+                        for file in sftp.listdir(path_sftp):
+                            detach(os.path.join(path, file))
+                        with span('sftp_get_impacts'):
+                            sftp.get_d(path_sftp, path, preserve_mtime=False)
+
+                    elif sub_folder == RASTER_FOLDER:
+                        buffer_path = os.path.join(DATA_FOLDER, country, sub_folder, BUFFER_FOLDER)
+                        createFolderIfNotExists(buffer_path)
+
+                        # ensemble members on the server, by forecast date (the names are parsed once, see utils.filename)
+                        members = {}
+                        for tif in sftp.listdir_attr(path_sftp):
+                            record = parse_filename(tif.filename, country=country)
+                            if record is not None and record.product == 'member' and include_str in tif.filename and \
+                                    (not exclude_str or exclude_str not in tif.filename):
+                                members.setdefault(record.fe, []).append(tif.filename)
+
+                        for i_day in range(0, n_days):
+                            year_n, month_n, day_n = increment_day(year, month, day, i_day)
+
+                            # include string
+                            include_str_day = f'fe{year_n}{month_n}{day_n}'
+
+                            # get list of files
+                            list_files = members.get(f'{year_n}{month_n}{day_n}', [])
+
+                            # download files to temp folder
+                            message = f'Downloading {len(list_files)} from the sftp server ({include_str_day}) ... '
+                            try:
+                                with span('sftp_get_members', fe=f'{year_n}{month_n}{day_n}', n_files=len(list_files)):
+                                    for i, file in enumerate(list_files):
+                                        sftp.get(os.path.join(path_sftp, file), os.path.join(buffer_path, file), preserve_mtime=True)
+                                logger.info(f'{message}✔', extra={'indent': 3})
+                            except:
+                                logger.error(f'{message}✘', extra={'indent': 3}, exc_info=True)
\ No newline at end of file
@@ -0,0 +1,96 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.filename import parse_filename
+
+# latest agreement summary of each ensemble, by summary file: filled as the summaries are appended, and from the csv
+# file (once) for the summaries appended before the run
+_SUMMARIES: dict[str, dict[str, tuple[int, np.ndarray]]] = {}
+_LOADED_SUMMARY_FILES: set[str] = set()
+
+
+def band_max_count(most_common_depth: np.ndarray, most_common_depth_count: np.ndarray, n_bands: int = 211) -> np.ndarray:
+    """
+    Get, for each band, the highest number of ensemble members agreeing on that band over all the pixels. The band
+    with the highest value whose count is above threshold * n_members is the max band value of the depth map, whatever
+    the agreement threshold.
+    :param most_common_depth:
+    :param most_common_depth_count:
+    :param n_bands:
+    :return: array of shape (n_bands + 1,)
+    """
+
+    max_count = np.zeros(n_bands + 1, dtype=np.int64)
+
+    # only the pixels where at least one member is not empty
+    flooded = most_common_depth_count > 0
+    np.maximum.at(max_count, most_common_depth[flooded].astype(np.int64), most_common_depth_count[flooded])
+
+    return max_count
+
+
+def append_daily_summary(summary_file: str, stem: str, n_members: int, max_count: np.ndarray) -> None:
+    """
+    Append the agreement summary of an ensemble to a csv file
+    :param summary_file:
+    :param stem: stem of the ensemble files (containing the rdYYYYMMDD and feYYYYMMDD dates)
+    :param n_members: number of non-empty ensemble members
+    :param max_count: output of band_max_count
+    :return:
+    """
+
+    df = pd.DataFrame([[stem, n_members, *max_count]],
+                      columns=['stem', 'n_members', *[f'band_{band}' for band in range(len(max_count))]])
+
+    df.to_csv(summary_file, mode='a', header=not os.path.exists(summary_file), index=False)
+
+    _SUMMARIES.setdefault(summary_file, {})[stem] = n_members, np.asarray(max_count, dtype=np.int64)
+
+
+def read_daily_summary(summary_file: str, stem: str) -> tuple[int, np.ndarray] | None:
+    """
+    Get the latest agreement summary of an ensemble from a csv file, None if there is none. The summaries appended
+    during the run are kept in memory, and the csv file is only read once, the first time another summary is requested
+    :param summary_file:
+    :param stem: stem of the ensemble files
+    :return: n_members, max_count
+    """
+
+    summaries = _SUMMARIES.setdefault(summary_file, {})
+
+    if stem not in summaries and summary_file not in _LOADED_SUMMARY_FILES and os.path.exists(summary_file):
+        df = pd.read_csv(summary_file).drop_duplicates(subset='stem', keep='last')
+        max_counts = df.filter(regex=r'^band_\d+$').to_numpy(dtype=np.int64)
+        for other_stem, n_members, max_count in zip(df['stem'], df['n_members'], max_counts):
+            # the summaries appended during the run are the latest ones
+            summaries.setdefault(other_stem, (int(n_members), max_count))
+        _LOADED_SUMMARY_FILES.add(summary_file)
+
+    return summaries.get(stem)
+
+
+def load_daily_summary(summary_file: str, day_0: bool = True) -> pd.DataFrame:
+    """
+    Load the agreement summaries of a country, keeping the latest summary of every ensemble
+    :param summary_file:
+    :param day_0: only keep the day 0 summaries (i.e. rdYYYYMMDD and feYYYYMMDD are the same)
+    :return: dataframe sorted by rd, fe
+    """
+
+    df = pd.read_csv(summary_file)
+    df = df.drop_duplicates(subset='stem', keep='last')
+
+    # run date and forecast date of each ensemble (see utils.filename)
+    records = [parse_filename(stem) for stem in df['stem']]
+    dates = pd.DataFrame({
+        'rd': [record.rd if record is not None else None for record in records],
+        'fe': [record.fe if record is not None else None for record in records],
+    }, index=df.index)
+    df = pd.concat([dates, df], axis=1)
+
+    if day_0:
+        df = df[df['rd'] == df['fe']]
+
+    return df.sort_values(by=['rd', 'fe']).reset_index(drop=True)
@@ -1,21 +1,38 @@
 #TODO: next implementation: for the reference resolution, check the non-null pixels that overlap at at least threshold (0.8)
 
 import os.path
+import logging
 
 import shutil
 import rasterio
 import copy
 import numpy as np
 
+from typing import NamedTuple
+from contextlib import contextmanager, ExitStack
+
 from rasterio.warp import calculate_default_transform, reproject, Resampling
-from rasterio.windows import Window
+from rasterio.windows import Window, transform as window_transform
+from rasterio.transform import array_bounds
+from rasterio.errors import WindowError
+from rasterio.vrt import WarpedVRT
 from rasterio.transform import from_bounds
 from rasterio.crs import CRS
 
 from utils.files import get_file_stem_until_post
+from utils.cache import depth_cache_key, get_cached_depth, put_cached_depth
+from utils.summary import band_max_count, append_daily_summary, read_daily_summary
+from utils.mosaic import mosaic_max_tifs
+from utils.grid import CountryGrid
+from utils.memmap import read_cached_array
+from utils.artifacts import detach
+from utils.instrument import instrumented
+from utils.logger import get_logger, Progress
 
 from constants.constants import AGREEMENT_THRESHOLD
 
+logger = get_logger(__name__)
+
 def tif_2_array(tif_file: str) -> tuple[np.ndarray, dict]:
     """
     Get a tif file and return an array and the metadata
@@ -23,33 +40,124 @@ def tif_2_array(tif_file: str) -> tuple[np.ndarray, dict]:
     :return:
     """
 
-    with rasterio.open(tif_file) as src:
-        array = src.read()
-        meta = src.meta
+    # decoded only once per run if the raster cache is enabled (see utils.memmap)
+    return read_cached_array(tif_file)
+
+def tif_is_empty(src: rasterio.DatasetReader) -> bool:
+    """
+    Check if the first band of an open tif file only contains zeros, reading as little as possible: the maximum from the
+    GDAL statistics if available, otherwise the rows of blocks one by one, skipping the sparse ones (i.e. not written in the
+    file) and stopping at the first non-empty block
+    :param src:
+    :return:
+    """
+
+    # GDAL statistics, e.g. computed by gdalinfo -stats
+    maximum = src.tags(1).get('STATISTICS_MAXIMUM')
+    if maximum is not None:
+        return float(maximum) == 0
+
+    sparse_is_empty = src.nodata in (None, 0)
+    block_height, block_width = src.block_shapes[0]
+    n_block_cols = int(np.ceil(src.width / block_width))
+
+    # one row of blocks at a time (reading the blocks one by one is slower than decompressing the whole band)
+    for row, row_off in enumerate(range(0, src.height, block_height)):
+        if sparse_is_empty and all(src.get_tag_item(f'BLOCK_OFFSET_{col}_{row}', 'TIFF', bidx=1) in (None, '0') for col in range(n_block_cols)):
+            continue
+
+        if np.any(src.read(1, window=Window(0, row_off, src.width, min(block_height, src.height - row_off))) != 0):
+            return False
+
+    return True
+
+
+def tif_max(src: rasterio.DatasetReader) -> int:
+    """
+    Get the maximum of the first band of an open tif file, from the GDAL statistics if available
+    :param src:
+    :return:
+    """
+
+    maximum = src.tags(1).get('STATISTICS_MAXIMUM')
+    if maximum is not None:
+        return int(float(maximum))
+
+    return int(np.max(src.read(1)))
+
+
+@instrumented()
+def empty_tif(output_file: str, meta: dict, to_epsg_3857: bool = True, grid: CountryGrid = None) -> tuple:
+    """
+    Write an empty tif file on the grid of meta (reprojected to EPSG:3857 if required), without any pixel data: all
+    the blocks are sparse, and read as 0
+    :param output_file:
+    :param meta:
+    :param to_epsg_3857:
+    :param grid: if provided (and to_epsg_3857), the grid of the output (see utils.grid)
+    :return: bbox
+    """
+
+    meta = copy.deepcopy(meta)
+    meta.update({
+        'driver': 'GTiff',
+        'count': 1,
+        'nodata': 0,
+        'compress': 'lzw',
+        'tiled': True,
+    })
+
+    if to_epsg_3857 and grid is not None:
+        meta.update({
+            'crs': grid.crs,
+            'transform': grid.transform,
+            'width': grid.width,
+            'height': grid.height,
+        })
+    elif to_epsg_3857:
+        # same grid as reproject_tif
+        transform_ref, width_ref, height_ref = meta['transform'], meta['width'], meta['height']
+        left, bottom, right, top = transform_ref.c, transform_ref.f + transform_ref.e * height_ref, transform_ref.c + transform_ref.a * width_ref, transform_ref.f
+        transform, width, height = calculate_default_transform(meta['crs'], 'EPSG:3857', width_ref, height_ref, left, bottom, right, top)
+        meta.update({
+            'crs': 'EPSG:3857',
+            'transform': transform,
+            'width': width,
+            'height': height,
+        })
 
-    return array, meta
+    with rasterio.open(output_file, 'w', sparse_ok=True, **meta) as dst:
+        pass
 
-def reproject_tif(tif_file: str, to_crs: str | CRS | dict) -> tuple:
+    return dst.bounds
+
+
+@instrumented()
+def reproject_tif(tif_file: str, to_crs: str | CRS | dict, grid: CountryGrid = None) -> tuple:
     """
     Convert a tif file to a CRS
     :param to_crs:
     :param tif_file:
     :param output_file:
+    :param grid: if provided, the tif file is reprojected onto this grid instead of its own extent (see utils.grid)
     :return:
     """
 
-    # copy the file to a temporary file
+    # write to a temporary file replacing the tif file, so that the files sharing its content are not modified (see
+    # utils.artifacts.place_file)
     tmp_file = f'{tif_file}.tmp'
-    shutil.copyfile(tif_file, tmp_file)
 
-    with rasterio.open(tmp_file) as src:
+    with rasterio.open(tif_file) as src:
 
         transform_ref = src.transform
         width_ref = src.width
         height_ref = src.height
         left, bottom, right, top = transform_ref.c, transform_ref.f + transform_ref.e * height_ref, transform_ref.c + transform_ref.a * width_ref, transform_ref.f
 
-        transform, width, height = calculate_default_transform(src.crs, to_crs, width_ref, height_ref, left, bottom, right, top)
+        if grid is not None:
+            to_crs, transform, width, height = grid.crs, grid.transform, grid.width, grid.height
+        else:
+            transform, width, height = calculate_default_transform(src.crs, to_crs, width_ref, height_ref, left, bottom, right, top)
         kwargs = src.meta.copy()
         kwargs.update({
             'crs': to_crs,
@@ -60,7 +168,7 @@ def reproject_tif(tif_file: str, to_crs: str | CRS | dict) -> tuple:
             'tiled': True,
         })
 
-        with rasterio.open(tif_file, 'w', **kwargs) as dst:
+        with rasterio.open(tmp_file, 'w', **kwargs) as dst:
             for i in range(1, src.count + 1):
                 reproject(
                     source=rasterio.band(src, i),
@@ -69,11 +177,11 @@ def reproject_tif(tif_file: str, to_crs: str | CRS | dict) -> tuple:
                     src_crs=src.crs,
                     dst_transform=transform,
                     dst_crs=to_crs,
-                    resampling=Resampling.bilinear
+                    # the depth bands and the agreement percentages are classes, not interpolated
+                    resampling=Resampling.nearest
                 )
 
-    # remove the temporary file
-    os.remove(tmp_file)
+    os.replace(tmp_file, tif_file)
 
     bbox = dst.bounds
 
@@ -82,11 +190,11 @@ def reproject_tif(tif_file: str, to_crs: str | CRS | dict) -> tuple:
 
 def reproject_tif_resolution(tif_file, target_resolution):
 
-    # copy the file to a temporary file
+    # write to a temporary file replacing the tif file, so that the files sharing its content are not modified (see
+    # utils.artifacts.place_file)
     tmp_file = f'{tif_file}.tmp'
-    shutil.copyfile(tif_file, tmp_file)
 
-    with rasterio.open(tmp_file) as src:
+    with rasterio.open(tif_file) as src:
         # Retrieve metadata from the source file
         src_crs = src.crs
         src_transform = src.transform
@@ -124,7 +232,7 @@ def reproject_tif_resolution(tif_file, target_resolution):
         #         resampling=Resampling.bilinear  # Choose a resampling method
         #         )
 
-        with rasterio.open(tif_file, 'w', **kwargs) as dst:
+        with rasterio.open(tmp_file, 'w', **kwargs) as dst:
             for i in range(1, src.count + 1):
                 reproject(
                     source=rasterio.band(src, i),
@@ -136,9 +244,9 @@ def reproject_tif_resolution(tif_file, target_resolution):
                     resampling=Resampling.bilinear
                 )
 
-        # remove the temporary file
-        os.remove(tmp_file)
+    os.replace(tmp_file, tif_file)
 
+@instrumented()
 def reproject_geotiff(tif_file: str, max_resolution: int = 16000, msg_max_resolution: str =''):
     """
     Reproject a GeoTIFF file to a maximum resolution
@@ -148,21 +256,20 @@ def reproject_geotiff(tif_file: str, max_resolution: int = 16000, msg_max_resolu
     :return:
     """
 
-    # copy the file to a temporary file
+    # write to a temporary file replacing the tif file, so that the files sharing its content are not modified (see
+    # utils.artifacts.place_file)
     tmp_file = f'{tif_file}.tmp'
-    shutil.copyfile(tif_file, tmp_file)
 
-    with rasterio.open(tmp_file) as src:
+    with rasterio.open(tif_file) as src:
         # Calculate the target resolution
         src_transform, src_width, src_height = src.transform, src.width, src.height
         max_dimension = max(src_width, src_height)
 
         if max_dimension > max_resolution:
             if msg_max_resolution is None:
-                msg_max_resolution = 'Resolution too high, it needs to be downsized to a maximum of {max_resolution} px per dimension ... '
-                print(f'\t\t\t\033[31m{msg_max_resolution} \033[0m', end='')
-            else:
-                print(f'\033[32m' + '✔' + '\033[0m', end='')
+                msg_max_resolution = f'Resolution too high, it needs to be downsized to a maximum of {max_resolution} px per dimension'
+                logger.warning(msg_max_resolution, extra={'indent': 3})
+            logger.debug(f'Downsizing {os.path.basename(tif_file)} ({src_width}x{src_height})', extra={'indent': 3})
             target_resolution = max_dimension / max_resolution
             dst_transform = rasterio.Affine(src_transform.a*target_resolution, src_transform.b, src_transform.c, src_transform.d, src_transform.e*target_resolution, src_transform.f)
             dst_width = src_width // target_resolution
@@ -184,7 +291,7 @@ def reproject_geotiff(tif_file: str, max_resolution: int = 16000, msg_max_resolu
         })
 
         # Reproject the dataset
-        with rasterio.open(tif_file, 'w', **kwargs) as dst:
+        with rasterio.open(tmp_file, 'w', **kwargs) as dst:
             for i in range(1, src.count + 1):
                 reproject(
                     source=rasterio.band(src, i),
@@ -196,8 +303,7 @@ def reproject_geotiff(tif_file: str, max_resolution: int = 16000, msg_max_resolu
                     resampling = Resampling.bilinear
                 )
 
-    # remove the temporary file
-    os.remove(tmp_file)
+    os.replace(tmp_file, tif_file)
 
     return msg_max_resolution
 
@@ -236,373 +342,90 @@ def crop_array_tif_meta(array: np.ndarray, meta: dict) -> tuple[dict, rasterio.A
 
     return meta, transform, width, height
 
-def merge_tifs(tifs_list, output_file, to_epsg_3857=True):
-    # Read the first GeoTiff to get the resolution and spatial extent
-    with rasterio.open(tifs_list[0]) as src:
-        res = src.res
-        bounds = src.bounds
-        dtype = src.dtypes[0]
-
-    # Find the highest resolution and spatial extent that covers both GeoTiffs
-    for tif in tifs_list[1:]:
-        with rasterio.open(tif) as src_temp:
-            print(f'Found GeoTiff {tif} with resolution {src_temp.res} and spatial extent {src_temp.bounds}')
-            res = tuple(min(r, s) for r, s in zip(res, src_temp.res))
-
-    for tif in tifs_list:
-        with rasterio.open(tif) as src:
-            # if resolution is not the highest resolution, reproject the GeoTiffs to the highest resolution
-            if any(r > s for r, s in zip(src.res, res)):
-                print(f'Reprojecting GeoTiff {tif} from resolution {src.res} to resolution {res}')
-                reproject_tif_resolution(tif, target_resolution=res)
-
-    # Get spatial extent of all GeoTiffs
-    bounds = (
-        float('inf'),float('inf'),float('-inf'),float('-inf')
-    )
-    for tif in tifs_list:
-        with rasterio.open(tif) as src_temp:
-            bounds = (
-                min(bounds[0], src_temp.bounds[0]),
-                min(bounds[1], src_temp.bounds[1]),
-                max(bounds[2], src_temp.bounds[2]),
-                max(bounds[3], src_temp.bounds[3])
-            )
-
-    print(f'Using resolution {res} and spatial extent {bounds}')
-
-    # dst_shape as the max extent
-    dst_shape = (int(np.round((bounds[3] - bounds[1]) / res[1])), int(np.round((bounds[2] - bounds[0]) / res[0])))
-    transform = rasterio.transform.from_bounds(*bounds, dst_shape[1], dst_shape[0])
-
-    # Initialize the destination arrays
-    array_dst = np.zeros(dst_shape, dtype=dtype)
-    array_max = np.zeros(dst_shape, dtype=dtype)
-
-    # Process each GeoTiff
-    for tif in tifs_list:
-        with rasterio.open(tif) as src:
-            array = src.read(1)
-
-            # Calculate the spatial intersection
-            #window_float = rasterio.windows.from_bounds(*src.bounds, transform=transform)
-
-            # Rounding then casting to int to avoid rasterio error
-            #window = rasterio.windows.Window(int(np.round(window_float.col_off)), int(np.round(window_float.row_off)), int(np.round(window_float.width)), int(np.round(window_float.height)))
-
-            window = Window(
-                col_off = int(np.round((src.bounds.left - bounds[0]) / res[0])),
-                row_off = int(np.round((bounds[3] - src.bounds.top) / res[1])),
-                width = src.width,
-                height = src.height
-            )
-
-            # "Place" the array inside the destination array
-            array_dst[window.row_off:window.row_off+window.height, window.col_off:window.col_off+window.width] = array
-
-            # Take the maximum of each pixel
-            array_max = np.maximum(array_max, array_dst)
-
-    # Write the output GeoTiff
-    with rasterio.open(tifs_list[1]) as src:
-        # update profile
-        profile = {
-            'driver': 'GTiff',
-            'dtype': dtype,
-            'nodata': 0,
-            'width': dst_shape[1],
-            'height': dst_shape[0],
-            'count': 1,
-            'crs': {'init': 'EPSG:3857'},
-            'transform': rasterio.transform.from_bounds(*bounds, width=dst_shape[1], height=dst_shape[0]),
-            'compress': 'lzw',
-            'tiled': True,
-        }
-        with rasterio.open(output_file, 'w', **profile) as dst:
-            dst.write(array_max, 1)
-
-    # Return the output spatial extent
-    return bounds
-
-def reproject_and_maximize_geotiffs(tifs_list: list[str], output_file: str, to_epsg_3857: bool = True):
-    # Open the GeoTIFF files and read their metadata
-    datasets = []
-    for path in tifs_list:
-        dataset = rasterio.open(path)
-        datasets.append(dataset)
-
-    src_crs = datasets[0].crs
-    dtype = datasets[0].dtypes[0]
-    src_transform = datasets[0].transform
-
-    # Calculate the minimum bounding area
-    min_left = min(dataset.bounds.left for dataset in datasets)
-    min_bottom = min(dataset.bounds.bottom for dataset in datasets)
-    max_right = max(dataset.bounds.right for dataset in datasets)
-    max_top = max(dataset.bounds.top for dataset in datasets)
-
-    # Calculate minimum pixel size
-    min_pixel_size = min(dataset.res[0] for dataset in datasets)
-
-    # Calculate the size of the output array
-    dst_width = int((max_right - min_left) / min_pixel_size)
-    dst_height = int((max_top - min_bottom) / min_pixel_size)
-
-    # Initialize the array of max values
-    array_dst = np.empty((dst_height, dst_width), dtype=dtype)
-    array_max = np.empty((dst_height, dst_width), dtype=dtype)
-
-    # Create an empty array to store the reprojected data
-    #dst_data = np.zeros((1, dst_height, dst_width), dtype=dtype)
-
-    # Reproject each GeoTIFF onto the minimum covering area
-    for i, dataset in enumerate(datasets):
-        src_data = dataset.read(1)
-
-        # # Calculate the transform for the minimum bounding area
-        # dst_transform, dst_width, dst_height = calculate_default_transform(
-        #     src_crs,
-        #     src_crs,
-        #     # dst_width=dst_width,
-        #     # dst_height=dst_height,
-        #     width=dataset.width,
-        #     height=dataset.height,
-        #     left=dataset.bounds.left, bottom=dataset.bounds.bottom, right=dataset.bounds.right, top=dataset.bounds.top,
-        #     resolution=min_pixel_size
-        # )
-
-        # # Calculate the transform for the minimum bounding area
-        # dst_transform, _, _ = calculate_default_transform(
-        #     src_crs,
-        #     src_crs,
-        #     dst_width,
-        #     dst_height,
-        #     min_left,
-        #     min_bottom,
-        #     max_right,
-        #     max_top
-        # )
-
-        src_width = dataset.width
-        src_height = dataset.height
-
-        dst_transform = dataset.transform.scale((src_width / dst_width), (src_height / dst_height))
-
-        reproject(src_data, array_dst, src_transform=dataset.transform, src_crs=dataset.crs,
-                  dst_transform=dst_transform, dst_crs=dataset.crs,
-                  resampling=Resampling.nearest)
-
-        # Create the output GeoTIFF file
-        profile = {
-            'driver': 'GTiff',
-            'dtype': rasterio.uint8,
-            'nodata': 0,
-            'width': dst_width,
-            'height': dst_height,
-            'count': 1,
-            'crs': src_crs,
-            'transform': dst_transform,
-            'compress': 'lzw',
-            'tiled': True,
-        }
-
-        with rasterio.open(output_file.replace('.tif',f'_test_{i}.tif'), 'w', **profile) as dst:
-            dst.write(array_dst, 1)
-
-        # Read the reprojected data
-        array_max = np.maximum(array_max, array_dst)
-
-    # Calculate the maximum value for each pixel
-    #max_data = np.max(dst_data, axis=0)
-
-    # Create the output GeoTIFF file
-    profile = {
-        'driver': 'GTiff',
-        'dtype': rasterio.uint8,
-        'nodata': 0,
-        'width': dst_width,
-        'height': dst_height,
-        'count': 1,
-        'crs': src_crs,
-        'transform': dst_transform,
-        'compress': 'lzw',
-        'tiled': True,
-    }
-
-    with rasterio.open(output_file, 'w', **profile) as dst:
-        dst.write(array_max, 1)
-
-    # Close all datasets
-    for dataset in datasets:
-        dataset.close()
+@instrumented()
+def merge_tifs(tifs_list, output_file, to_epsg_3857=True, grid: CountryGrid = None):
+    """
+    Merge tif files into one, taking the maximum of each pixel (see utils.mosaic.mosaic_max_tifs)
+    :param tifs_list:
+    :param output_file: can be one of the tifs_list
+    :param to_epsg_3857: unused, the output is in the crs of the tifs
+    :param grid: grid of the country, processed by its tiles if the tifs are on it (see utils.grid)
+    :return: bounds of the output
+    """
+    return mosaic_max_tifs(tifs_list, output_file, grid=grid)
 
-    return (min_left, min_bottom, max_right, max_top)
 
-def reproject_and_maximize_tifs(tifs_list: list[str], output_file: str, to_epsg_3857: bool = True):
-    # Initialize variables to store the spatial extent
-    min_x, min_y, max_x, max_y = float('inf'), float('inf'), float('-inf'), float('-inf')
+def stack_2_mode_count(stacked: np.ndarray, n_bands: int = 211, max_block_process_size: int = 1000) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Get the most common non-zero depth value of each pixel of an ensemble stack, and its count
+    :param stacked: array of shape (n_members, height, width)
+    :param n_bands:
+    :param max_block_process_size:
+    :return: most_common_depth, most_common_depth_count
+    """
 
-    # Initialize reference metadata
-    meta_ref = None
-    array_ref = None
-    transform_ref = None
-    width_ref = 0
-    height_ref = 0
+    most_common_depth = np.zeros(stacked.shape[1:], dtype=stacked.dtype)
+    most_common_depth_count = np.zeros(stacked.shape[1:], dtype=np.min_scalar_type(stacked.shape[0]))
 
-    # Iterate over the files to find the common extent
-    for tif_file in tifs_list:
-        with rasterio.open(tif_file) as src:
-            bounds = src.bounds
-            meta = src.meta
-            array = src.read(1)
-            transform = src.transform
-            height, width = array.shape
-            #meta, transform, width, height = crop_array_tif_meta(array, meta)
-
-            min_x = min(min_x, transform.c)
-            min_y = min(min_y, transform.f + transform.e * height)
-            max_x = max(max_x, transform.c + transform.a * width)
-            max_y = max(max_y, transform.f)
-
-            dtype = src.dtypes[0]
-
-            if meta_ref is None:
-                meta_ref = copy.deepcopy(meta)
-                transform_ref = copy.deepcopy(transform)
-                crs_ref = copy.deepcopy(src.crs)
-                array_ref = np.empty((height, width), dtype=meta_ref['dtype'])
-                width_ref = width
-                height_ref = height
-            else:
-                # take the maximum extent
-                transform_ref_c = min(transform_ref.c, transform.c)
-                transform_ref_f = max(transform_ref.f, transform.f)
-                transform_ref = rasterio.Affine(transform_ref.a, transform_ref.b, transform_ref_c, transform_ref.d,
-                                                transform_ref.e, transform_ref_f)
-                width_ref = max(width_ref, width)
-                height_ref = max(height_ref, height)
-                array_ref = np.empty((height_ref, width_ref), dtype=meta_ref['dtype'])
-                # update the reference metadata
-                meta_ref.update({
-                    'transform': transform_ref,
-                    'width': width_ref,
-                    'height': height_ref,
-                    'crs': crs_ref,
-                })
-
-    # Create a bounding box with the common extent
-    bbox = (min_x, min_y, max_x, max_y)
-    left, bottom, right, top = transform_ref.c, transform_ref.f + transform_ref.e * height_ref, transform_ref.c + transform_ref.a * width_ref, transform_ref.f
-
-    # Reprojection parameters
-    if to_epsg_3857:
-        dst_crs = 'EPSG:3857'
-    else:
-        dst_crs = 'EPSG:4326'  # Specify the desired CRS
-    dst_transform, dst_width, dst_height = calculate_default_transform(src.crs, dst_crs, width_ref, height_ref, left, bottom, right, top)
+    n_i, n_j = int(np.ceil(stacked.shape[1] / max_block_process_size)), int(np.ceil(stacked.shape[2] / max_block_process_size))
+    progress = Progress(logger, 'Processing sub-block', n_i * n_j, level=logging.DEBUG, indent=5)
 
-    # Initialize the array of max values
-    array_dst = np.empty((dst_height, dst_width), dtype=dtype)
-    array_max = np.empty((dst_height, dst_width), dtype=dtype)
+    for i in range(n_i):
+        for j in range(n_j):
+            progress.update(i * n_j + j + 1)
+            block = np.s_[i*max_block_process_size:(i+1)*max_block_process_size, j*max_block_process_size:(j+1)*max_block_process_size]
+            stacked_partition = stacked[(slice(None), *block)]
 
-    # Output folder for the reprojected files
-    output_folder = ""
-
-    # Iterate over the files
-    for tif_file in tifs_list:
-        with rasterio.open(tif_file) as src:
-            # Reproject the raster to the common extent
-            reprojected = rasterio.open(
-                output_folder + output_file,
-                'w',
-                driver='GTiff',
-                height=dst_height,
-                width=dst_width,
-                count=1,
-                dtype=src.dtypes[0],
-                crs=dst_crs,
-                transform=dst_transform
-            )
-            reproject(
-                source=rasterio.band(src, 1),
-                destination=array_dst,
-                src_transform=src.transform,
-                src_crs=src.crs,
-                dst_transform=dst_transform,
-                dst_crs=dst_crs,
-                resampling=Resampling.nearest
-            )
-
-            # Read the reprojected data
-            array_max = np.maximum(array_max, array_dst)
-
-            reprojected.close()
-
-
-    # Write the output file with the maximum pixel values
-    with rasterio.open(output_file, 'w', driver='GTiff', height=dst_height, width=dst_width, count=1,
-                       dtype=dtype, crs=dst_crs, transform=dst_transform, compress='lzw', tiled=True) as dst:
-        dst.write(array_max, 1)
+            # Get the count of each depth value for each pixel
+            counts = np.apply_along_axis(lambda x: np.bincount(x[x != 0], minlength=n_bands + 1), axis=0, arr=stacked_partition)
 
-    return bbox
+            # Get the most common depth value for each pixel and its count
+            most_common_depth[block] = np.argmax(counts, axis=0)
+            most_common_depth_count[block] = np.max(counts, axis=0)
 
+    return most_common_depth, most_common_depth_count
 
 
-def tifs_2_tif_depth(
-        folder_path: str,
-        tifs_list: list[str],
-        postfix: str,
-        post_stem: str = 'ens',
-        threshold: float = AGREEMENT_THRESHOLD,
-        n_bands: int = 211,
-        max_block_process_size: int = 1000,
-        max_resolution: int = 16000,
-        to_epsg_3857: bool = True
-) -> tuple[str, bool, tuple, int]:
+@instrumented()
+def tifs_2_reference_meta(folder_path: str, tifs_list: list[str], max_resolution: int = 16000, grid: CountryGrid = None) -> tuple[dict, list[str]]:
     """
-    Get a list of tifs and return a tif with the depth
+    Get the reference grid of an ensemble (i.e. the largest extent of its non-empty members), from the headers of the
+    members and without decompressing them whenever possible (see tif_is_empty)
     :param folder_path:
     :param tifs_list:
-    :param postfix:
-    :param post_stem:
-    :param threshold:
-    :param n_bands:
-    :param max_block_process_size:
-    :param to_epsg_3857:
-    :return:
+    :param max_resolution:
+    :param grid: if provided, the reference grid is the window of the grid of the forecasts of the country covering the
+    members (if they are at its resolution), so that the members are read by window (see open_aligned)
+    :return: reference metadata, list of the non-empty members
     """
 
-    # Check that the tifs_list all have the same stem
-    stem_set = set(get_file_stem_until_post(tif_file, post_stem) for tif_file in tifs_list)
-    assert len(stem_set) == 1, f'\033[31mStems of tifs are not the same: {stem_set}\033[0m'
-
     # Initialize reference metadata
     meta_ref = None
-    array_ref = None
     transform_ref = None
 
-    # Initialize boolean empty
-    empty = True
-
-    # Initialize message for different resolutions
-    msg_different_resolutions = None
+    # Initialize message for the resolution cap
     msg_max_resolution = None
 
+    # Non-empty members
+    members = []
+
     # Read the metadata of all the tifs and store the reference metadata for the one with the highest resolution
     for tif_file in tifs_list:
 
         if len(tifs_list) > 1:
-            # sanity check: compress and max_resolution
-            msg_max_resolution = reproject_geotiff(os.path.join(folder_path, tif_file), max_resolution=max_resolution, msg_max_resolution=msg_max_resolution)
+            # sanity check: max_resolution (from the header only, the file is only rewritten if it is too large)
+            with rasterio.open(os.path.join(folder_path, tif_file)) as src:
+                too_large = max(src.width, src.height) > max_resolution
+            if too_large:
+                msg_max_resolution = reproject_geotiff(os.path.join(folder_path, tif_file), max_resolution=max_resolution, msg_max_resolution=msg_max_resolution)
 
         with rasterio.open(os.path.join(folder_path, tif_file)) as src:
             meta = src.meta
-            crs = src.crs
-
-            array = src.read(1)
 
             # check if it's empty
-            if np.any(array != 0):
+            if not tif_is_empty(src):
+                members.append(tif_file)
+
                 #meta, transform, width, height = crop_array_tif_meta(array, meta)
                 transform = src.transform
                 width = src.width
@@ -612,7 +435,6 @@ def tifs_2_tif_depth(
                     meta_ref = copy.deepcopy(meta)
                     transform_ref = copy.deepcopy(transform)
                     crs_ref = copy.deepcopy(src.crs)
-                    array_ref = np.empty((height, width), dtype=meta_ref['dtype'])
                     width_ref = width
                     height_ref = height
                 else:
@@ -622,7 +444,6 @@ def tifs_2_tif_depth(
                     transform_ref = rasterio.Affine(transform_ref.a, transform_ref.b, transform_ref_c, transform_ref.d, transform_ref.e, transform_ref_f)
                     width_ref = max(width_ref, width)
                     height_ref = max(height_ref, height)
-                    array_ref = np.empty((height_ref, width_ref), dtype=meta_ref['dtype'])
                     # update the reference metadata
                     meta_ref.update({
                         'transform': transform_ref,
@@ -631,184 +452,513 @@ def tifs_2_tif_depth(
                         'crs': crs_ref,
                     })
 
-    # close the msg_max_resolution printing message
-    if msg_max_resolution is not None:
-        print()
-
     if meta_ref is None:
         meta_ref = copy.deepcopy(meta)
         crs_ref = copy.deepcopy(src.crs)
-        array_ref = np.empty((meta_ref['height'], meta_ref['width']), dtype=meta_ref['dtype'])
+    elif grid is not None and meta_ref['crs'] == grid.src_crs and \
+            np.allclose((meta_ref['transform'].a, -meta_ref['transform'].e), (grid.src_transform.a, -grid.src_transform.e)):
+        try:
+            window = grid.window(array_bounds(meta_ref['height'], meta_ref['width'], meta_ref['transform']), src=True)
+        except WindowError:
+            logger.warning(f'The members are outside of the grid of {grid.country}', extra={'indent': 3})
+        else:
+            meta_ref.update({
+                'transform': window_transform(window, grid.src_transform),
+                'width': window.width,
+                'height': window.height,
+            })
 
-    print(f'\t\t\tReference resolution: , {meta_ref["width"]}x{meta_ref["height"]}')
+    logger.info(f'Reference resolution: {meta_ref["width"]}x{meta_ref["height"]}', extra={'indent': 3})
 
+    return meta_ref, members
 
-    # Extract the pixel values from each dataset and store them in a numpy array:
-    arrays = []
-    for tif_file in tifs_list:
-        with rasterio.open(os.path.join(folder_path, tif_file)) as src:
-            #TODO: check if same resolution, if not transform first then append
 
-            array = src.read(1)
+class OffsetReader:
+    """
+    Reader of a tif file on the same pixel grid as the reference grid but with another extent: the windows of the
+    reference grid are read at an offset in the file, the pixels outside of the file are 0
+    """
 
-            # check if it's empty
-            if np.any(array != 0):
+    def __init__(self, src: rasterio.DatasetReader, row_off: int, col_off: int):
+        self.src = src
+        self.row_off = row_off
+        self.col_off = col_off
 
-                # if reference values are not set, set them
-                meta = src.meta
-                if meta_ref is None:
-                    meta_ref = copy.deepcopy(meta)
-                    crs_ref = copy.deepcopy(src.crs)
+    def read(self, band: int, window: Window) -> np.ndarray:
+        array = np.zeros((window.height, window.width), dtype=self.src.dtypes[band - 1])
 
-                # Check if the resolution, coordinates and affine transformation coefficients are different from the reference
-                elif src.meta['transform'] != meta_ref['transform'] or src.meta['height'] != meta_ref['height'] or src.meta['width'] != meta_ref['width']:
-
-                    if msg_different_resolutions is None:
-                        msg_different_resolutions = f'\t\t\t\t\033[31mWarning: The TIF files that you are trying to combine come from different resolutions and/or regions. ✘' # \n{meta_ref}\n{meta}
-                        print(msg_different_resolutions, end='')
-                    else:
-                        # Add ✘ for every file that has a different resolution
-                        print('✘', end='')
-
-                    # Reproject the array to the reference system
-                    dest = np.empty_like(array_ref)
-                    transform, width, height = calculate_default_transform(src.crs, crs_ref, src.width, src.height,
-                                                                           *src.bounds)
-                    kwargs = src.meta.copy()
-                    kwargs.update({
-                        'crs': crs_ref,
-                        'transform': transform,
-                        'width': width,
-                        'height': height
-                    })
-                    reproject(source=rasterio.band(src, 1),
-                              destination=dest,
-                              src_transform=src.transform,
-                              src_crs=src.crs,
-                              dst_transform=transform,
-                              dst_crs=crs_ref,
-                              resampling=Resampling.bilinear)
-
-                    # Add the reprojected array to the list
-                    arrays.append(dest)
-
-                # Otherwise, add the array to the list without transforming it
-                else:
-                    arrays.append(array)
+        # part of the window covered by the file, in the reference grid
+        row_start, row_stop = max(window.row_off, self.row_off), min(window.row_off + window.height, self.row_off + self.src.height)
+        col_start, col_stop = max(window.col_off, self.col_off), min(window.col_off + window.width, self.col_off + self.src.width)
+        if row_start < row_stop and col_start < col_stop:
+            array[row_start - window.row_off:row_stop - window.row_off, col_start - window.col_off:col_stop - window.col_off] = \
+                self.src.read(band, window=Window(col_start - self.col_off, row_start - self.row_off, col_stop - col_start, row_stop - row_start))
 
-    # print empty line to close the message in case of different resolutions
-    if msg_different_resolutions is not None:
-        print('\033[0m')
+        return array
 
-    # Create the output file name
-    output_file = os.path.join(folder_path, f'{stem_set.pop()}{postfix}')
 
-    # if arrays is empty, copy the first ensemble file to the output file
-    if not arrays or len(arrays) == 1:
-        if not arrays:
-            print(f'\t\t\t\tAll files are empty, copying first file to output file: {tifs_list[0]}')
-        elif len(arrays) == 1:
-            print(f'\t\t\t\tOnly one file is not empty, copying it to output file: {tifs_list[0]}')
-            empty = False
+def grid_offset(src: rasterio.DatasetReader, meta_ref: dict) -> tuple[int, int] | None:
+    """
+    Get the offset (row, col) of a tif file in the reference grid, if both are on the same pixel grid
+    :param src:
+    :param meta_ref:
+    :return: None if the file is not on the pixels of the reference grid
+    """
+    transform = meta_ref['transform']
+    if src.crs != meta_ref['crs'] or not np.allclose((src.transform.a, src.transform.e), (transform.a, transform.e)) or \
+            src.transform.b != 0 or src.transform.d != 0:
+        return None
 
-        shutil.copy(os.path.join(folder_path, tifs_list[0]), output_file)
+    row_off, col_off = (src.transform.f - transform.f) / transform.e, (src.transform.c - transform.c) / transform.a
+    if abs(row_off - round(row_off)) > 1e-3 or abs(col_off - round(col_off)) > 1e-3:
+        return None
 
-        # open the file to get the bbox
-        with rasterio.open(output_file) as src:
-            bbox = src.bounds
+    return int(round(row_off)), int(round(col_off))
 
-        if to_epsg_3857:
-            bbox = reproject_tif(output_file, to_crs='EPSG:3857')
 
-        max_band_value = np.max(array)
+@contextmanager
+def open_aligned(tif_file: str, meta_ref: dict):
+    """
+    Open a tif file on the reference grid: members on the same pixels are read by window (see OffsetReader), members on
+    another grid are warped lazily (nearest neighbour, so that the depth bands are not mixed) while they are read
+    :param tif_file:
+    :param meta_ref:
+    :return:
+    """
+    with rasterio.open(tif_file) as src:
+        offset = grid_offset(src, meta_ref)
+        if offset == (0, 0) and src.height == meta_ref['height'] and src.width == meta_ref['width']:
+            yield src
+        elif offset is not None:
+            yield OffsetReader(src, *offset)
+        else:
+            with WarpedVRT(src, crs=meta_ref['crs'], transform=meta_ref['transform'], width=meta_ref['width'],
+                           height=meta_ref['height'], resampling=Resampling.nearest) as vrt:
+                yield vrt
 
-        return output_file, empty, bbox, max_band_value
 
-    # Stack the arrays into a single numpy array
-    stacked = np.stack(arrays)
+class EnsembleAgreement(NamedTuple):
+    """
+    Most common depth value of the non-empty ensemble members and its count, for each pixel. Any agreement threshold can
+    be applied to it without reading the ensemble files again
+    """
+    most_common_depth: np.ndarray
+    most_common_depth_count: np.ndarray
+    n_members: int
+    meta: dict
+
+    def threshold(self, threshold: float = AGREEMENT_THRESHOLD) -> np.ndarray:
+        """
+        Keep only the most common depth values with a probability above the threshold
+        :param threshold:
+        :return:
+        """
+        if self.n_members == 0:
+            return np.zeros_like(self.most_common_depth)
+
+        probability = self.most_common_depth_count / self.n_members
+
+        return np.where(probability >= threshold, self.most_common_depth, 0).astype(self.most_common_depth.dtype)
+
+    def percentage(self) -> np.ndarray:
+        """
+        Agreement percentage of the most common depth value, rounded down so that comparing it to a whole percentage
+        gives the same result as the threshold above
+        :return:
+        """
+        if self.n_members == 0:
+            return np.zeros(self.most_common_depth_count.shape, dtype=np.uint8)
+
+        return (self.most_common_depth_count.astype(np.uint16) * 100 // self.n_members).astype(np.uint8)
+
+
+@instrumented()
+def members_2_agreement(
+        folder_path: str,
+        members: list[str],
+        meta_ref: dict,
+        n_bands: int = 211,
+        max_block_process_size: int = 1000,
+) -> EnsembleAgreement:
+    """
+    Get the most common depth value of the non-empty members and its count, on the reference grid
+    :param folder_path:
+    :param members: non-empty members (see tifs_2_reference_meta)
+    :param meta_ref:
+    :param n_bands:
+    :param max_block_process_size:
+    :return:
+    """
 
-    # Clip values above n_bands
-    stacked = np.clip(stacked, 0, n_bands)
+    shape = (meta_ref['height'], meta_ref['width'])
+    most_common_depth = np.zeros(shape, dtype=meta_ref['dtype'])
+    most_common_depth_count = np.zeros(shape, dtype=np.min_scalar_type(len(members)))
+
+    if not members:
+        return EnsembleAgreement(most_common_depth, most_common_depth_count, 0, meta_ref)
+
+    with ExitStack() as stack:
+        datasets = [stack.enter_context(open_aligned(os.path.join(folder_path, tif_file), meta_ref)) for tif_file in members]
+
+        # warn for the members on a different grid
+        n_different_resolutions = sum(isinstance(dataset, WarpedVRT) for dataset in datasets)
+        if n_different_resolutions:
+            logger.warning(f'The TIF files that you are trying to combine come from different resolutions and/or regions. {"✘" * n_different_resolutions}',
+                           extra={'indent': 4})
+
+        # Read the members block by block, so that only one block of the ensemble is in memory
+        n_cols = len(range(0, shape[1], max_block_process_size))
+        progress = Progress(logger, 'Processing block', len(range(0, shape[0], max_block_process_size)) * n_cols, indent=4)
+        for i, row_off in enumerate(range(0, shape[0], max_block_process_size)):
+            for j, col_off in enumerate(range(0, shape[1], max_block_process_size)):
+                progress.update(i * n_cols + j + 1)
+                window = Window(col_off, row_off, min(max_block_process_size, shape[1] - col_off), min(max_block_process_size, shape[0] - row_off))
+                block = np.s_[row_off:row_off + window.height, col_off:col_off + window.width]
+
+                # Stack the blocks into a single numpy array and clip values above n_bands
+                stacked = np.clip(np.stack([dataset.read(1, window=window) for dataset in datasets]), 0, n_bands)
+
+                if len(members) == 1:
+                    most_common_depth[block] = stacked[0]
+                    most_common_depth_count[block] = stacked[0] != 0
+                    continue
+
+                # Get the most common depth value for each pixel and its count
+                most_common_depth[block], most_common_depth_count[block] = stack_2_mode_count(
+                    stacked=stacked,
+                    n_bands=n_bands,
+                    max_block_process_size=max_block_process_size,
+                )
 
-    # initialize the ensemble agreement array
-    ensemble_agreement = np.zeros_like(stacked[0])
+    return EnsembleAgreement(most_common_depth, most_common_depth_count, len(members), meta_ref)
 
-    # initialize max count
-    max_count = 0
 
-    for i in range(int(np.ceil(stacked.shape[1] / max_block_process_size))):
-        for j in range(int(np.ceil(stacked.shape[2] / max_block_process_size))):
-            print(f'\t\t\t\tProcessing block ({i + 1}/{int(np.ceil(stacked.shape[1] / max_block_process_size))} ; {j+1}/{int(np.ceil(stacked.shape[2] / max_block_process_size))}) ({(i + 1) * max_block_process_size}/{stacked.shape[1]}) ; ({(j+1)*max_block_process_size}/{stacked.shape[2]})')
-            stacked_partition = stacked[:, i*max_block_process_size:(i+1)*max_block_process_size, j*max_block_process_size:(j+1)*max_block_process_size]
+@instrumented()
+def agreement_2_tif(
+        ensemble_agreement: np.ndarray,
+        meta_ref: dict,
+        output_file: str,
+        to_epsg_3857: bool = True,
+        agreement_percentage: np.ndarray = None,
+        grid: CountryGrid = None,
+) -> tuple[bool, tuple, int]:
+    """
+    Write an ensemble agreement array to a geotiff file
+    :param ensemble_agreement:
+    :param meta_ref:
+    :param output_file:
+    :param to_epsg_3857:
+    :param agreement_percentage: if provided, written as a second band (see EnsembleAgreement.percentage)
+    :param grid: if provided (and to_epsg_3857), the grid of the output (see utils.grid)
+    :return: empty, bbox, max_band_value
+    """
 
+    # Check if the ensemble agreement array is empty
+    empty = not np.any(ensemble_agreement != 0)
 
-            # Get the count of each depth value for each pixel
-            counts = np.apply_along_axis(lambda x: np.bincount(x[x != 0], minlength=n_bands + 1), axis=0, arr=stacked_partition)
+    # update meta to compress and tile
+    meta = copy.deepcopy(meta_ref)
+    meta.update({
+        'compress': 'lzw',
+        'tiled': True,
+        'count': 1 if agreement_percentage is None else 2,
+    })
 
-            # Get the most common depth value for each pixel and its count
-            most_common_depth = np.argmax(counts, axis=0)
-            most_common_depth_count = np.max(counts, axis=0)
+    # Write the resulting raster to a new geotiff file
+    with rasterio.open(output_file, 'w', **meta) as dst:
+        logger.info(f'Write the resulting raster to a new geotiff file: {output_file}', extra={'indent': 4})
+        dst.write(ensemble_agreement, 1)
+        if agreement_percentage is not None:
+            dst.write(agreement_percentage, 2)
+
+    bbox = dst.bounds
+
+    if to_epsg_3857:
+        bbox = reproject_tif(output_file, to_crs='EPSG:3857', grid=grid)
+
+    max_band_value = np.max(ensemble_agreement)
 
-            # Update max count
-            max_count = np.max([max_count, np.max(most_common_depth_count)])
+    return empty, bbox, max_band_value
+
+
+def threshold_agreement_tif(tif_file: str, output_file: str, threshold: float = AGREEMENT_THRESHOLD) -> tuple[bool, int]:
+    """
+    Apply a higher agreement threshold to a depth map written with its agreement percentage band, without the ensemble.
+    Both bands are reprojected with the nearest pixel (see reproject_tif), so every pixel keeps the depth band and the
+    agreement percentage of a pixel of the ensemble
+    :param tif_file:
+    :param output_file: replaced atomically, so it can be tif_file
+    :param threshold: must be above the threshold the depth map was written with
+    :return: empty, max_band_value
+    """
+
+    with rasterio.open(tif_file) as src:
+        if src.count != 2:
+            raise ValueError(f'No agreement percentage band in {tif_file}')
+        depth, percentage = src.read(1), src.read(2)
+        meta = src.meta
 
-            # Calculate the probability of the most common depth value for each pixel
-            probability = most_common_depth_count / stacked_partition.shape[0]
+    # the percentage is rounded down (see EnsembleAgreement.percentage), so comparing it to the whole percentage of
+    # the threshold gives the same result as EnsembleAgreement.threshold
+    depth = np.where(percentage >= round(threshold * 100), depth, 0).astype(depth.dtype)
 
-            # Keep only the most common depth values with a probability above the threshold
-            ensemble_agreement_partition = np.where(probability >= threshold, most_common_depth, 0)
+    tmp_file = f'{output_file}.tmp'
+    with rasterio.open(tmp_file, 'w', **meta) as dst:
+        dst.write(depth, 1)
+        dst.write(percentage, 2)
+    os.replace(tmp_file, output_file)
 
-            # Write the array sub_section to ensemble_agreement
-            ensemble_agreement[i*max_block_process_size:(i+1)*max_block_process_size, j*max_block_process_size:(j+1)*max_block_process_size] = ensemble_agreement_partition
+    return not np.any(depth != 0), np.max(depth)
 
-    # Print max agreement
-    print(f'\t\t\t\tMax agreement: {max_count}/{stacked.shape[0]} ({max_count/stacked.shape[0]*100:.2f}%), ', end='')
-    if max_count / stacked.shape[0] * 100 < threshold * 100:
-        print(f"\033[31m{'below the threshold'}\033[0m")  # 31 for red color
+
+def members_2_tif_depths(
+        folder_path: str,
+        members: list[str],
+        meta_ref: dict,
+        output_files: dict[float, str],
+        stem: str,
+        n_bands: int = 211,
+        to_epsg_3857: bool = True,
+        summary_file: str = None,
+        grid: CountryGrid = None,
+) -> dict[float, tuple[str, bool, tuple, int]]:
+    """
+    Write the depth maps of an ensemble with no or a single non-empty member, whatever the agreement threshold: an empty
+    placeholder written without pixel data, or the non-empty member itself
+    :param folder_path:
+    :param members: non-empty members (see tifs_2_reference_meta)
+    :param meta_ref:
+    :param output_files: output file for each agreement threshold
+    :param stem:
+    :param n_bands:
+    :param to_epsg_3857:
+    :param summary_file:
+    :param grid: if provided (and to_epsg_3857), the grid of the output (see utils.grid)
+    :return: output file, empty, bbox and max_band_value for each agreement threshold
+    """
+
+    output_file = next(iter(output_files.values()))
+
+    if not members:
+        logger.info('All files are empty, writing an empty output file', extra={'indent': 4})
+        bbox = empty_tif(output_file, meta_ref, to_epsg_3857=to_epsg_3857, grid=grid)
+        max_band_value = 0
+        max_count = np.zeros(n_bands + 1, dtype=np.int64)
     else:
-        print(f"\033[32m{'above the threshold'}\033[0m")  # 32 for green color
+        logger.info(f'Only one file is not empty, copying it to output file: {members[0]}', extra={'indent': 4})
+        with rasterio.open(os.path.join(folder_path, members[0])) as src:
+            max_band_value = tif_max(src)
+            if summary_file is not None:
+                member = np.clip(src.read(1), 0, n_bands)
+                max_count = band_max_count(member, (member != 0).astype(np.uint8), n_bands=n_bands)
 
+        shutil.copy(os.path.join(folder_path, members[0]), output_file)
 
-    # Check if the ensemble agreement array is empty
-    if np.any(ensemble_agreement != 0):
+        # open the file to get the bbox
+        with rasterio.open(output_file) as src:
+            bbox = src.bounds
 
-        empty = False
+        if to_epsg_3857:
+            bbox = reproject_tif(output_file, to_crs='EPSG:3857', grid=grid)
 
-        # Crop the array to the reference resolution
-        #TODO: correct the following line to crop appropriately
-        #meta_ref, transform, width, height = crop_array_tif_meta(ensemble_agreement, meta_ref)
+    if summary_file is not None:
+        append_daily_summary(summary_file=summary_file, stem=stem, n_members=len(members), max_count=max_count)
 
-        print(f'\t\t\t\tCropping the array to the reference resolution: {width}x{height}')
+    # the same depth map for every threshold
+    for other_output_file in list(output_files.values())[1:]:
+        shutil.copy(output_file, other_output_file)
 
-        # Reproject the array to the reference system
-        dest = np.empty((height, width), dtype=meta_ref['dtype'])
-        reproject(source=ensemble_agreement,
-                  destination=dest,
-                  src_transform=transform,
-                  src_crs=crs_ref,
-                  dst_transform=transform,
-                  dst_crs=crs_ref,
-                  resampling=Resampling.bilinear)
+    return {threshold: (other_output_file, not members, bbox, max_band_value) for threshold, other_output_file in output_files.items()}
 
-        ensemble_agreement = dest
 
-    # update meta to compress and tile
-    meta_ref.update({
-        'compress': 'lzw',
-        'tiled': True,
-    })
+@instrumented()
+def tifs_2_tif_depths(
+        folder_path: str,
+        tifs_list: list[str],
+        postfixes: dict[float, str],
+        post_stem: str = 'ens',
+        n_bands: int = 211,
+        max_block_process_size: int = 1000,
+        max_resolution: int = 16000,
+        to_epsg_3857: bool = True,
+        summary_file: str = None,
+        agreement_band: bool = False,
+        grid: CountryGrid = None,
+) -> dict[float, tuple[str, bool, tuple, int]]:
+    """
+    Get a list of tifs and return one tif with the depth per agreement threshold. The ensemble members are read and
+    their most common depth value counted only once, whatever the number of thresholds
+    :param folder_path:
+    :param tifs_list:
+    :param postfixes: postfix of the output file for each agreement threshold
+    :param post_stem:
+    :param n_bands:
+    :param max_block_process_size:
+    :param max_resolution:
+    :param to_epsg_3857:
+    :param summary_file: if provided, append the agreement summary of the ensemble to this csv (see utils.summary)
+    :param agreement_band: add the agreement percentage as a second band of the depth maps
+    :param grid: if provided (and to_epsg_3857), the grid of the depth maps (see utils.grid)
+    :return: output file, empty, bbox and max_band_value for each agreement threshold
+    """
 
-    # Write the resulting raster to a new geotiff file
-    with rasterio.open(output_file, 'w', **meta_ref) as dst:
-        print(f'\t\t\t\tWrite the resulting raster to a new geotiff file: {output_file}')
-        dst.write(ensemble_agreement, 1)
+    # Check that the tifs_list all have the same stem
+    stem_set = set(get_file_stem_until_post(tif_file, post_stem) for tif_file in tifs_list)
+    assert len(stem_set) == 1, f'Stems of tifs are not the same: {stem_set}'
+    stem = next(iter(stem_set))
+
+    # previous outputs may share their content with the event folders (see utils.artifacts)
+    for postfix in postfixes.values():
+        detach(os.path.join(folder_path, f'{stem}{postfix}'))
+
+    meta_ref, members = tifs_2_reference_meta(folder_path, tifs_list, max_resolution=max_resolution, grid=grid)
+
+    # all members empty or only one non-empty: no ensemble agreement to compute
+    if len(members) < 2 and not agreement_band:
+        return members_2_tif_depths(
+            folder_path=folder_path,
+            members=members,
+            meta_ref=meta_ref,
+            output_files={threshold: os.path.join(folder_path, f'{stem}{postfix}') for threshold, postfix in postfixes.items()},
+            stem=stem,
+            n_bands=n_bands,
+            to_epsg_3857=to_epsg_3857,
+            summary_file=summary_file,
+            grid=grid,
+        )
 
-    bbox = dst.bounds
+    agreement = members_2_agreement(
+        folder_path=folder_path,
+        members=members,
+        meta_ref=meta_ref,
+        n_bands=n_bands,
+        max_block_process_size=max_block_process_size,
+    )
 
-    if to_epsg_3857:
-        bbox = reproject_tif(output_file, to_crs='EPSG:3857')
+    if summary_file is not None:
+        append_daily_summary(
+            summary_file=summary_file,
+            stem=stem,
+            n_members=agreement.n_members,
+            max_count=band_max_count(agreement.most_common_depth, agreement.most_common_depth_count, n_bands=n_bands),
+        )
 
-    max_band_value = np.max(ensemble_agreement)
+    # Max count
+    max_count = np.max(agreement.most_common_depth_count)
+
+    agreement_percentage = agreement.percentage() if agreement_band else None
+
+    outputs = {}
+    for threshold, postfix in postfixes.items():
+        output_file = os.path.join(folder_path, f'{stem}{postfix}')
+
+        # Print max agreement
+        if agreement.n_members > 0:
+            comparison = 'below the threshold ✘' if max_count / agreement.n_members * 100 < threshold * 100 else 'above the threshold ✔'
+            logger.info(f'Max agreement: {max_count}/{agreement.n_members} ({max_count/agreement.n_members*100:.2f}%), {comparison}',
+                        extra={'indent': 4, 'fields': {'max_agreement': max_count / agreement.n_members, 'threshold': threshold}})
+
+        outputs[threshold] = output_file, *agreement_2_tif(
+            ensemble_agreement=agreement.threshold(threshold),
+            meta_ref=agreement.meta,
+            output_file=output_file,
+            to_epsg_3857=to_epsg_3857,
+            agreement_percentage=agreement_percentage,
+            grid=grid,
+        )
+
+    return outputs
+
+
+@instrumented()
+def tifs_2_tif_depth(
+        folder_path: str,
+        tifs_list: list[str],
+        postfix: str,
+        post_stem: str = 'ens',
+        threshold: float = AGREEMENT_THRESHOLD,
+        n_bands: int = 211,
+        max_block_process_size: int = 1000,
+        max_resolution: int = 16000,
+        to_epsg_3857: bool = True,
+        cache_folder: str = None,
+        summary_file: str = None,
+        agreement_band: bool = False,
+        grid: CountryGrid = None,
+) -> tuple[str, bool, tuple, int]:
+    """
+    Get a list of tifs and return a tif with the depth
+    :param folder_path:
+    :param tifs_list:
+    :param postfix:
+    :param post_stem:
+    :param threshold:
+    :param n_bands:
+    :param max_block_process_size:
+    :param to_epsg_3857:
+    :param cache_folder: if provided, reuse the depth map computed from the same ensemble files and parameters
+    :param summary_file: if provided, append the agreement summary of the ensemble to this csv (see utils.summary)
+    :param agreement_band: add the agreement percentage as a second band of the depth map
+    :param grid: if provided (and to_epsg_3857), the grid of the depth map (see utils.grid)
+    :return:
+    """
+
+    # Check that the tifs_list all have the same stem
+    stem_set = set(get_file_stem_until_post(tif_file, post_stem) for tif_file in tifs_list)
+    assert len(stem_set) == 1, f'Stems of tifs are not the same: {stem_set}'
+    stem = next(iter(stem_set))
+
+    if cache_folder is not None:
+        # the key must be computed before the ensemble files are modified in place (see reproject_geotiff)
+        output_file = os.path.join(folder_path, f'{stem}{postfix}')
+        key = depth_cache_key(
+            file_list=[os.path.join(folder_path, tif_file) for tif_file in tifs_list],
+            threshold=threshold,
+            n_bands=n_bands,
+            to_crs='EPSG:3857' if to_epsg_3857 else None,
+            agreement_band=agreement_band,
+            grid=grid,
+        )
+
+        # the agreement summary is stored in the entry, so that the daily summary also gets a row on cache hits
+        cached = get_cached_depth(cache_folder, key, output_file, with_summary=summary_file is not None)
+        if cached is not None:
+            logger.info(f'Depth map found in cache: {key}', extra={'indent': 3})
+            empty, bbox, max_band_value, summary = cached
+            if summary_file is not None:
+                append_daily_summary(summary_file=summary_file, stem=stem, n_members=summary['n_members'],
+                                     max_count=np.array(summary['max_count'], dtype=np.int64))
+            return output_file, empty, bbox, max_band_value
+
+        output_file, empty, bbox, max_band_value = tifs_2_tif_depth(
+            folder_path=folder_path,
+            tifs_list=tifs_list,
+            postfix=postfix,
+            post_stem=post_stem,
+            threshold=threshold,
+            n_bands=n_bands,
+            max_block_process_size=max_block_process_size,
+            max_resolution=max_resolution,
+            to_epsg_3857=to_epsg_3857,
+            summary_file=summary_file,
+            agreement_band=agreement_band,
+            grid=grid,
+        )
+        summary = read_daily_summary(summary_file, stem) if summary_file is not None else None
+        put_cached_depth(cache_folder, key, output_file, empty, bbox, max_band_value, summary=summary)
+
+        return output_file, empty, bbox, max_band_value
 
-    # Return the output file name, and a boolean indicating if the array is empty
-    return output_file, empty, bbox, max_band_value
+    return tifs_2_tif_depths(
+        folder_path=folder_path,
+        tifs_list=tifs_list,
+        postfixes={threshold: postfix},
+        post_stem=post_stem,
+        n_bands=n_bands,
+        max_block_process_size=max_block_process_size,
+        max_resolution=max_resolution,
+        to_epsg_3857=to_epsg_3857,
+        summary_file=summary_file,
+        agreement_band=agreement_band,
+        grid=grid,
+    )[threshold]
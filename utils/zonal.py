@@ -0,0 +1,188 @@
+import os
+import json
+import hashlib
+
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import rasterio
+import geopandas as gpd
+
+from rasterio.features import rasterize
+
+from utils.depth import create_band_depth_mapping
+from utils.files import createFolderIfNotExists
+from utils.logger import get_logger
+
+from constants.constants import DATA_FOLDER, COUNTRIES_FOLDER, ZONES_FOLDER, N_BANDS
+
+logger = get_logger(__name__)
+
+# admin units rasterized during the run, by country and grid key (see zone_labels)
+_ZONE_LABELS = {}
+
+
+def grid_key(meta: dict) -> str:
+    """
+    Get a short key identifying the grid of a raster
+    :param meta:
+    :return:
+    """
+    grid = [str(meta['crs']), *[float(value) for value in list(meta['transform'])[:6]], meta['width'], meta['height']]
+    return hashlib.sha256(json.dumps(grid).encode()).hexdigest()[:16]
+
+
+def zone_labels(country: str, meta: dict) -> tuple[np.ndarray, pd.DataFrame]:
+    """
+    Get the admin units of a country rasterized on the grid of a raster, computed once per grid and cached in the
+    country's data folder, then kept in memory for the run: each pixel holds the label of its ADM2 unit (0 outside of
+    the country). The depth maps should be on the grid of the country (see utils.grid), otherwise every extent is a new
+    grid
+    :param country:
+    :param meta: metadata of the raster (crs, transform, width, height)
+    :return: label raster (uint16, read-only), admin units (label, ADM1_NAME, ADM2_NAME)
+    """
+
+    key = grid_key(meta)
+    if (country, key) not in _ZONE_LABELS:
+        labels, zones = read_zone_labels(country, meta, key)
+        labels.flags.writeable = False
+        _ZONE_LABELS[(country, key)] = labels, zones
+
+    return _ZONE_LABELS[(country, key)]
+
+
+def read_zone_labels(country: str, meta: dict, key: str) -> tuple[np.ndarray, pd.DataFrame]:
+    """
+    Read the admin units of a country rasterized on a grid from the country's data folder, rasterizing them first if
+    they are not there
+    :param country:
+    :param meta: metadata of the raster (crs, transform, width, height)
+    :param key: key of the grid (see grid_key)
+    :return: label raster (uint16), admin units (label, ADM1_NAME, ADM2_NAME)
+    """
+
+    zones_folder = os.path.join(DATA_FOLDER, country, ZONES_FOLDER)
+    labels_file = os.path.join(zones_folder, f'labels_{key}.tif')
+    zones_file = os.path.join(zones_folder, f'zones_{key}.csv')
+
+    if os.path.exists(labels_file) and os.path.exists(zones_file):
+        with rasterio.open(labels_file) as src:
+            return src.read(1), pd.read_csv(zones_file)
+
+    logger.info(f'Rasterizing the admin units of {country}... ', extra={'indent': 3, 'color': 'blue'})
+    gdf = gpd.read_file(os.path.join(COUNTRIES_FOLDER, f'{country}_adm_shapefile.zip')).to_crs(meta['crs'])
+    gdf = gdf.sort_values(by='ADM2_CODE').reset_index(drop=True)
+    gdf['label'] = np.arange(1, len(gdf) + 1)
+
+    labels = rasterize(
+        shapes=zip(gdf.geometry, gdf['label']),
+        out_shape=(meta['height'], meta['width']),
+        transform=meta['transform'],
+        fill=0,
+        dtype='uint16',
+    )
+
+    zones = gdf[['label', 'ADM1_NAME', 'ADM2_NAME']]
+
+    createFolderIfNotExists(zones_folder)
+    with rasterio.open(f'{labels_file}.tmp', 'w', driver='GTiff', dtype='uint16', count=1, crs=meta['crs'], transform=meta['transform'],
+                       width=meta['width'], height=meta['height'], compress='lzw', tiled=True) as dst:
+        dst.write(labels, 1)
+    zones.to_csv(f'{zones_file}.tmp', index=False)
+    os.replace(f'{labels_file}.tmp', labels_file)
+    os.replace(f'{zones_file}.tmp', zones_file)
+
+    return labels, zones
+
+
+@lru_cache(maxsize=None)
+def band_depths_m(n_bands: int = N_BANDS) -> np.ndarray:
+    """
+    Get the depth in meters of each band (see constants/range_classes.csv), read once per run
+    :param n_bands:
+    :return: array of shape (n_bands + 1,), read-only
+    """
+
+    depth_m = np.zeros(n_bands + 1)
+    for band, depth in create_band_depth_mapping('./constants/range_classes.csv').items():
+        if band < len(depth_m):
+            depth_m[band] = depth
+    depth_m.flags.writeable = False
+
+    return depth_m
+
+
+def array_2_zonal_stats(
+        array: np.ndarray,
+        labels: np.ndarray,
+        zones: pd.DataFrame,
+        pixel_size_x_m: float,
+        pixel_size_y_m: float,
+        n_bands: int = N_BANDS,
+) -> dict:
+    """
+    Get the flooded area, water volume and severity of each admin unit, with one bincount over the depth map
+    :param array: depth map (bands)
+    :param labels: label raster on the same grid (see zone_labels)
+    :param zones:
+    :param pixel_size_x_m:
+    :param pixel_size_y_m:
+    :param n_bands:
+    :return: records of the flooded ADM1 and ADM2 units
+    """
+
+    # Calculate the area of a single pixel (as in array_2_stats)
+    pixel_area_m2 = pixel_size_x_m * abs(pixel_size_y_m)
+
+    # depth in meters of each band
+    depth_m = band_depths_m(max(n_bands, int(array.max())))
+
+    flooded = array != 0
+    minlength = len(zones) + 1
+    flooded_area_px = np.bincount(labels[flooded], minlength=minlength)
+    total_water_m3 = np.bincount(labels[flooded], weights=depth_m[array[flooded]], minlength=minlength) * pixel_area_m2
+
+    df = zones.copy()
+    df['flooded_area_px'] = flooded_area_px[df['label']]
+    df['total_water_m3'] = total_water_m3[df['label']]
+
+    adm = {}
+    for level, columns in [('adm1', ['ADM1_NAME']), ('adm2', ['ADM1_NAME', 'ADM2_NAME'])]:
+        df_level = df.groupby(by=columns, as_index=False)[['flooded_area_px', 'total_water_m3']].sum()
+        df_level = df_level[df_level['flooded_area_px'] > 0]
+
+        flooded_area_m2 = df_level['flooded_area_px'] * pixel_area_m2
+        df_level['flooded_area_km2'] = np.round(flooded_area_m2 / 1e6, 2)
+        df_level['severity_index_1m'] = np.round(df_level['total_water_m3'] / flooded_area_m2, 2)
+        df_level['total_water_m3'] = np.round(df_level['total_water_m3'], 2)
+        df_level['flooded_area_px'] = df_level['flooded_area_px'].astype(int)
+
+        adm[level] = df_level.to_dict(orient='records')
+
+    return adm
+
+
+def depth_2_zonal_stats(country: str, array: np.ndarray, meta: dict) -> dict | None:
+    """
+    Get the zonal stats of a depth map of a country, None if the admin units of the country are not available
+    :param country:
+    :param array: depth map (bands)
+    :param meta:
+    :return:
+    """
+
+    try:
+        labels, zones = zone_labels(country, meta)
+    except Exception as e:
+        logger.error(f'Could not get the admin units of {country}: {e}', extra={'indent': 3})
+        return None
+
+    return array_2_zonal_stats(
+        array=array,
+        labels=labels,
+        zones=zones,
+        pixel_size_x_m=meta['transform'].a,
+        pixel_size_y_m=meta['transform'].e,
+    )